@@ -1,16 +1,23 @@
 # -*- coding: utf-8 -*-
 import json
-from collections import namedtuple
-
-from tornado.httpclient import AsyncHTTPClient
+import math
+import time
+import zlib
+from collections import OrderedDict, namedtuple
+from types import MappingProxyType
 
+from .Compiler import Compiler
 from .Config import Config
+from .Context import read_only
 from .Logger import Logger
+from .StoryCache import StoryCache
+from .Trace import Trace
 from .Types import StreamingService
 from .constants.ServiceConstants import ServiceConstants
 from .processing import Story
 from .processing.Services import Services
 from .utils import Dict
+from .utils.HttpClients import HttpClients
 from .utils.HttpUtils import HttpUtils
 
 Subscription = namedtuple('Subscription',
@@ -29,7 +36,8 @@ class App:
         self.version = version
         self.logger = logger
         self.environment = environment
-        self.stories = stories['stories']
+        self.stories = Compiler.compile_all(stories['stories'],
+                                            StoryCache.for_config(config))
         self.entrypoint = stories['entrypoint']
         self.services = services
         secrets = {}
@@ -39,6 +47,205 @@ class App:
                 if not isinstance(v, dict):
                     secrets[k.lower()] = v
         self.app_context = {'secrets': secrets}
+        self.app_layer = MappingProxyType({
+            'app': read_only(self.app_context)
+        })
+        """
+        The read-only context layer which is shared by all the stories
+        executed in this app (see asyncy.Context). Executions copy its
+        lists and dicts when they change them.
+        """
+        self.tunables = self.app_tunables()
+        """
+        The settings which the operator overrides for this app
+        (see App#tunable).
+        """
+        self.yield_lines = self.tunable('STORY_YIELD_LINES')
+        self.yield_interval = \
+            self.tunable('STORY_YIELD_MICROSECONDS') / 1e6
+        """
+        A story which executes lines without waiting on anything (a loop
+        of sets, for example) yields to the event loop every yield_lines
+        lines, and every yield_interval seconds, so that it doesn't
+        starve the stories of other apps (see Stories#tick). Zero
+        disables either check.
+        """
+        self.loop_concurrency = self.tunable('STORY_LOOP_CONCURRENCY')
+        """
+        How many iterations of a parallel for loop are executed at a time
+        (see Lexicon#parallel_for_loop).
+        """
+        self.story_timeout = \
+            self.tunable('STORY_TIMEOUT_SECONDS', float) or None
+        self.story_max_lines = self.tunable('STORY_MAX_LINES') or None
+        """
+        The budget of each story execution (see asyncy.Deadline),
+        None when it's unlimited.
+        """
+        self.function_memo_scope = config.STORY_FUNCTION_MEMO
+        self.function_memo_size = self.tunable('STORY_FUNCTION_MEMO_SIZE')
+        self.function_memo = OrderedDict()
+        """
+        The calls to pure functions memoized for all the executions of
+        this app, least recently used first (see asyncy.processing.Memo).
+        """
+        self.response_cache_size = self.tunable('SERVICE_CACHE_SIZE')
+        self.responses = OrderedDict()
+        """
+        The responses of services cached for all the executions of this
+        app, least recently used first (see asyncy.processing.ResponseCache).
+        """
+        self.trace = Trace.for_app(self)
+        """
+        The trace of the lines executed by this app's stories, None when
+        they're not traced (see asyncy.Trace).
+        """
+        self.prepared_requests = {}
+        """
+        The HTTP requests of static lines, keyed by their line
+        (see Services#http_request). Compiled stories are shared by apps,
+        so these can't be stored in the lines.
+        """
+        self.dispatch_plans = {}
+        """
+        How each line calls it's service, keyed by the line (see
+        Services#plan).
+        """
+        self.containers = {}
+        """
+        The hostnames of the containers started for this app, keyed by
+        their name (see Containers#start).
+        """
+        self.story_invocations = {}
+        self.codegen_threshold = self.tunable('STORY_CODEGEN_THRESHOLD')
+        self.generated_stories = {}
+        """
+        The generated code of the stories which have been promoted,
+        keyed by the story's name (see asyncy.processing.Codegen).
+        """
+        self.idle_ttl = float(config.APP_IDLE_TTL_SECONDS or 0) or None
+        """
+        An app which hasn't executed a story for idle_ttl seconds is
+        hibernated (see App#hibernate). None when apps never hibernate.
+        """
+        self.executions = 0
+        self.last_active = time.monotonic()
+        self.hibernated = None
+        """
+        The compressed story trees of a hibernated app, None when the
+        app is awake.
+        """
+
+    def app_tunables(self):
+        """
+        Reads the settings which the operator overrides for this app from
+        STORY_APP_TUNABLES, a JSON object of settings keyed by app id,
+        such as {"<app id>": {"STORY_YIELD_LINES": 100}}. An invalid value
+        is logged, and ignored.
+        """
+        setting = self.config.STORY_APP_TUNABLES
+        if not setting:
+            return {}
+
+        try:
+            tunables = json.loads(setting).get(self.app_id) or {}
+        except (AttributeError, TypeError, ValueError):
+            tunables = None
+
+        if not isinstance(tunables, dict):
+            self.logger.warn(f'STORY_APP_TUNABLES should be a JSON object '
+                             f'of settings keyed by app id, got {setting!r}')
+            return {}
+
+        return tunables
+
+    def tunable(self, key, kind=int):
+        """
+        Returns a numeric setting of the engine (see Config), which is
+        never negative. An invalid value is logged, and it's default is
+        used instead.
+
+        These are limits which the operator sets for all apps, or for this
+        app (see App#app_tunables), so they're never read from the
+        environment of an app (which it's developers write).
+        """
+        setting = self.tunables.get(key, getattr(self.config, key))
+        try:
+            value = kind(setting or 0)
+        except (TypeError, ValueError):
+            value = None
+
+        if value is None or not math.isfinite(value):
+            self.logger.warn(f'{key} should be a number, got {setting!r}; '
+                             f'using the default')
+            value = kind(Config.defaults[key] or 0)
+
+        return max(value, 0)
+
+    def activate(self):
+        """
+        Counts a story execution which is starting (see Story#run), and
+        wakes this app up first if it's hibernated.
+        """
+        if self.hibernated is not None:
+            self.wake()
+
+        self.executions += 1
+        self.last_active = time.monotonic()
+
+    def deactivate(self):
+        self.executions -= 1
+        self.last_active = time.monotonic()
+
+    def is_idle(self, now: float):
+        """
+        :return: True if this app is awake, isn't executing any story,
+        and has been so for App#idle_ttl seconds
+        """
+        return self.idle_ttl is not None and self.hibernated is None \
+            and self.executions == 0 \
+            and now - self.last_active >= self.idle_ttl
+
+    def hibernate(self):
+        """
+        Drops the compiled stories of this app, and everything derived
+        from them, keeping just the compressed story trees. The
+        subscriptions of the app are kept, so events keep being routed
+        to it, and it's woken up by the first story it executes.
+
+        The stories are evicted from the memory of the StoryCache too
+        (otherwise they'd stay there until they're the least recently
+        used), so they're compiled again, or read from STORY_CACHE_DIR,
+        when the app wakes up.
+        """
+        stories = {}
+        for name, compiled in self.stories.items():
+            stories[name] = {
+                'entrypoint': compiled.entrypoint,
+                'tree': {line.ln: line.raw for line in compiled.lines}
+            }
+            StoryCache.evict(StoryCache.key(name, stories[name]))
+
+        self.hibernated = zlib.compress(json.dumps(stories).encode('utf-8'))
+        self.stories = None
+        self.function_memo.clear()
+        self.responses.clear()
+        self.prepared_requests = {}
+        self.dispatch_plans = {}
+        self.story_invocations = {}
+        self.codegen_threshold = self.tunable('STORY_CODEGEN_THRESHOLD')
+        self.generated_stories = {}
+
+    def wake(self):
+        """
+        Loads the stories of a hibernated app. Stories which are still
+        cached (see asyncy.StoryCache) aren't compiled again.
+        """
+        stories = json.loads(zlib.decompress(self.hibernated).decode('utf-8'))
+        self.stories = Compiler.compile_all(stories,
+                                            StoryCache.for_config(self.config))
+        self.hibernated = None
+        self.logger.info(f'Woke up app {self.app_id}')
 
     async def bootstrap(self):
         """
@@ -85,7 +292,7 @@ class App:
                 'Content-Type': 'application/json; charset=utf-8'
             }
         }
-        client = AsyncHTTPClient()
+        client = HttpClients.get('synapse')
         response = await HttpUtils.fetch_with_retry(3, self.logger, url,
                                                     client, kwargs)
         if int(response.code / 100) == 2:
@@ -114,7 +321,7 @@ class App:
                   f':{http_conf.get("port", conf.get("port", 80))}' \
                   f'{http_conf["path"]}'
 
-            client = AsyncHTTPClient()
+            client = HttpClients.get('services')
             self.logger.info(f'Unsubscribing {sub}...')
 
             method = http_conf.get('method', 'post')
@@ -142,3 +349,4 @@ class App:
         await self.clear_subscriptions_synapse()
         await self.unsubscribe_all()
         await Services.remove_all(self)
+        self.containers.clear()
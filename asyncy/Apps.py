@@ -4,9 +4,12 @@ import os
 import select
 import signal
 import threading
+import time
 
 import psycopg2
 
+from tornado.ioloop import PeriodicCallback
+
 from .App import App
 from .Config import Config
 from .Containers import Containers
@@ -126,6 +129,10 @@ class Apps:
                              daemon=True)
         t.start()
 
+        idle_ttl = float(config.APP_IDLE_TTL_SECONDS or 0)
+        if idle_ttl > 0:
+            PeriodicCallback(cls.hibernate_idle, idle_ttl * 1000).start()
+
         for release in releases:
             app_id = release[0]
             await cls.reload_app(config, glogger, app_id)
@@ -134,6 +141,18 @@ class Apps:
     def get(cls, app_id: str):
         return cls.apps[app_id]
 
+    @classmethod
+    def hibernate_idle(cls):
+        """
+        Hibernates the apps which have been idle for APP_IDLE_TTL_SECONDS
+        (see App#hibernate).
+        """
+        now = time.monotonic()
+        for app in cls.apps.values():
+            if app is not None and app.is_idle(now):
+                app.hibernate()
+                app.logger.info(f'Hibernated app {app.app_id}')
+
     @classmethod
     async def get_services(cls, asyncy_yaml, glogger: Logger,
                            stories: dict):
@@ -0,0 +1,614 @@
+# -*- coding: utf-8 -*-
+from .utils.Resolver import Resolver
+
+
+class Node:
+    """
+    A node with arguments (a line, or a mutation in a line), compiled at
+    deploy time. Item access is proxied to the raw node.
+    """
+    __slots__ = ('raw', 'arguments')
+
+    def __init__(self, raw: dict):
+        self.raw = raw
+        self.arguments = {}
+        """
+        The compiled arguments of this node, keyed by their name.
+        """
+
+    def __getitem__(self, key):
+        return self.raw[key]
+
+    def __contains__(self, key):
+        return key in self.raw
+
+    def get(self, key, default=None):
+        return self.raw.get(key, default)
+
+
+class Line(Node):
+    """
+    A story line, compiled at deploy time.
+
+    The interpreter reads the attributes, which are resolved once when the
+    app is deployed. The raw line (as emitted by the Storyscript compiler)
+    is kept, and item access is proxied to it, so that line['service'] or
+    line.get('args') keep working for services, containers and Sentry.
+    """
+    __slots__ = ('id', 'ln', 'method', 'handler',
+                 'next', 'enter', 'exit', 'parent',
+                 'block_exit', 'pre', 'post',
+                 'function', 'call_args', 'args', 'slot', 'static',
+                 'group', 'parallel', 'pure')
+
+    def __init__(self, _id: int, raw: dict):
+        super().__init__(raw)
+        self.id = _id
+        self.ln = raw['ln']
+        self.method = raw.get('method')
+        self.args = ()
+        """
+        The compiled args of this line, in the same order as line['args'].
+        Mutations are compiled into a Node, everything else into an
+        Expression.
+        """
+        self.static = True
+        """
+        True if none of the args of this line depend on the context, so
+        they resolve to the same values on every execution.
+        """
+        self.slot = None
+        """
+        The slot of the variable this line assigns (for set and for lines),
+        or None if it's not assigned to a slot. See CompiledStory#slots.
+        """
+        self.handler = None
+        self.next = None
+        self.enter = None
+        self.exit = None
+        self.parent = None
+        self.block_exit = None
+        """
+        The first line after the block this line opens (or after this line,
+        if it doesn't open a block). See Stories#next_block.
+        """
+        self.pre = 0
+        self.post = 0
+        """
+        The pre and post order numbers of this line, in a depth first walk
+        of the story. A line is a child of another line (directly or
+        indirectly) if it's interval is contained in the other's interval.
+        """
+        self.function = None
+        """
+        The function line this line calls. For function declarations,
+        this is the line itself.
+        """
+        self.call_args = ()
+        """
+        The arguments for the call, as (name, argument) pairs, in the order
+        of the function's parameters. The argument is None if the caller
+        doesn't pass one.
+        """
+        self.group = None
+        """
+        The lines (starting with this line) which are independent of each
+        other, and can be executed concurrently. See Compiler#_group.
+        """
+        self.pure = False
+        """
+        True if this is a function which doesn't have any effect outside
+        of it's own context. See Compiler#_purity.
+        """
+        self.parallel = False
+        """
+        True if this is a for loop whose iterations are independent of
+        each other, and can be executed concurrently.
+        See Compiler#_independent_iterations.
+        """
+
+    def __repr__(self):
+        return f'Line(ln={self.ln}, method={self.method})'
+
+
+class CompiledStory:
+
+    __slots__ = ('name', 'lines', 'tree', 'entrypoint', 'functions',
+                 'slots')
+
+    def __init__(self, name: str, lines: list, entrypoint: str):
+        self.name = name
+        self.lines = lines
+        """
+        All lines in this story, indexed by Line#id.
+        """
+        self.tree = {line.ln: line for line in lines}
+        """
+        All lines in this story, keyed by their line number.
+        """
+        self.entrypoint = entrypoint
+        self.functions = {}
+        """
+        All functions declared in this story, keyed by their name.
+        """
+        self.slots = {}
+        """
+        The slot (an index in Context#values) of each top level variable
+        and function parameter in this story, keyed by the variable's name.
+        """
+
+
+class Compiler:
+    """
+    Compiles story trees into a compact representation, which the
+    interpreter can walk without any string keyed lookups.
+    """
+
+    handlers = {}
+    """
+    The handler for each method, keyed by the method.
+    These are registered by asyncy.processing.Story.
+    """
+
+    @classmethod
+    def register_handler(cls, method: str, handler):
+        cls.handlers[method] = handler
+
+    @classmethod
+    def compile_all(cls, stories: dict, cache=None) -> dict:
+        """
+        Compiles all the stories of an app. If a cache (see
+        asyncy.StoryCache) is given, stories which are already cached
+        aren't compiled again.
+        """
+        compiled = {}
+        for story_name, story in stories.items():
+            if cache is None:
+                compiled[story_name] = cls.compile(story_name, story)
+                continue
+
+            key = cache.key(story_name, story)
+            compiled_story = cache.get(key)
+            if compiled_story is None:
+                compiled_story = cls.compile(story_name, story)
+                cache.put(key, compiled_story)
+            compiled[story_name] = compiled_story
+
+        return compiled
+
+    @classmethod
+    def compile(cls, story_name: str, story: dict) -> CompiledStory:
+        tree = story['tree']
+        lines = [Line(i, raw) for i, raw in enumerate(tree.values())]
+        compiled = CompiledStory(story_name, lines, story.get('entrypoint'))
+
+        cls._allocate_slots(compiled)
+
+        for line in lines:
+            line.handler = cls.handlers.get(line.method)
+            line.next = cls._ref(compiled, line.raw, 'next')
+            line.enter = cls._ref(compiled, line.raw, 'enter')
+            line.exit = cls._ref(compiled, line.raw, 'exit')
+            line.parent = cls._ref(compiled, line.raw, 'parent')
+            cls._compile_args(line, compiled.slots)
+
+        cls._number(compiled)
+
+        block_exits = {}
+        for line in lines:
+            line.block_exit = cls._block_exit(line, block_exits)
+
+        for line in lines:
+            if line.method == 'function' and line.parent is None \
+                    and line.get('function') is not None:
+                compiled.functions.setdefault(line['function'], line)
+
+        for line in lines:
+            if line.method == 'function':
+                line.function = line
+            elif line.method == 'call':
+                cls._bind_call(compiled, line)
+
+        cls._purity(compiled)
+        defined = cls._defined(compiled)
+        cls._group(compiled, defined)
+
+        for line in lines:
+            if line.method == 'for':
+                line.parallel = cls._independent_iterations(compiled, line,
+                                                            defined)
+
+        return compiled
+
+    @classmethod
+    def _defined(cls, compiled: CompiledStory):
+        """
+        :return: The names of the variables of a story, which can't be told
+        apart from services at compile time
+        """
+        defined = set()
+        for line in compiled.lines:
+            cls._writes(line, defined)
+        defined.update(compiled.slots)
+        return defined
+
+    @classmethod
+    def _group(cls, compiled: CompiledStory, defined: set):
+        """
+        Groups runs of consecutive execute lines in the same block which
+        are independent of each other: no line reads or writes a variable
+        written by another line in the run, and each line calls a
+        different service. The run is stored in Line#group of it's first
+        line (see Story#execute_group).
+        """
+        grouped = set()
+        for line in compiled.lines:
+            if line.id in grouped:
+                continue
+
+            group = cls._independent_run(line, defined, grouped)
+            if len(group) > 1:
+                line.group = tuple(group)
+                grouped.update(member.id for member in group)
+
+    @classmethod
+    def _independent_run(cls, line: Line, defined: set, grouped: set):
+        flow = cls._dataflow(line, defined)
+        if flow is None:
+            return [line]
+
+        group = [line]
+        reads, writes = flow
+        services = {line['service']}
+        candidate = line.next
+        while candidate is not None and candidate.id not in grouped \
+                and candidate.parent is line.parent \
+                and candidate is group[-1].block_exit:
+            flow = cls._dataflow(candidate, defined)
+            if flow is None or candidate['service'] in services \
+                    or flow[0] & writes or flow[1] & (reads | writes):
+                break
+
+            group.append(candidate)
+            reads |= flow[0]
+            writes |= flow[1]
+            services.add(candidate['service'])
+            candidate = candidate.next
+
+        return group
+
+    @classmethod
+    def _dataflow(cls, line: Line, defined: set):
+        """
+        Returns the variables read and written by an execute line
+        (which isn't streaming), or None if the line can't be executed
+        concurrently with other lines. The service must not be a variable
+        (like the output of a when), since events are answered in order.
+        """
+        if line.method != 'execute' or line.enter is not None:
+            return None
+
+        service = line.get('service')
+        if not isinstance(service, str) or service in defined:
+            return None
+
+        reads = set()
+        writes = set()
+        if not cls._reads(line.get('args'), reads) \
+                or not cls._writes(line, writes):
+            return None
+
+        return reads, writes
+
+    @classmethod
+    def _independent_iterations(cls, compiled: CompiledStory, line: Line,
+                                defined: set):
+        """
+        Checks if the iterations of a for loop are independent of each
+        other: every variable which the body reads and writes is written
+        before it's read (by a line directly in the body, which is always
+        executed), so no iteration reads what another one wrote. Bodies
+        which mutate values in place, assign a nested path (a.b = ...)
+        or stream are never independent, and neither are bodies which
+        execute a service held in a variable (like the output of a when),
+        since events are answered in order (see Compiler#_dataflow).
+        """
+        output = line.get('output')
+        if not output or not all(isinstance(name, str) for name in output):
+            return False
+
+        first_read = {}
+        first_write = {name: 0 for name in output}
+        body = sorted((child for child in compiled.lines
+                       if cls.has_parent(line, child)),
+                      key=lambda child: child.pre)
+        for child in body:
+            if child.method == 'when':
+                return False
+
+            if child.method == 'execute':
+                service = child.get('service')
+                if child.enter is not None or not isinstance(service, str) \
+                        or service in defined:
+                    return False
+
+            name = child.get('name')
+            if name and len(name) > 1 \
+                    or any(isinstance(arg, Node) for arg in child.args):
+                return False
+
+            reads = set()
+            writes = set()
+            if not cls._reads(child.get('args'), reads) \
+                    or not cls._writes(child, writes):
+                return False
+
+            for read in reads:
+                first_read.setdefault(read, child.pre)
+            if child.parent is line:
+                for write in writes:
+                    first_write.setdefault(write, child.pre)
+
+        for child in body:
+            writes = set()
+            cls._writes(child, writes)
+            for write in writes:
+                if write in first_read and \
+                        first_write.get(write, first_read[write]) \
+                        >= first_read[write]:
+                    return False
+
+        return bool(body)
+
+    @classmethod
+    def _reads(cls, node, reads: set):
+        """
+        Collects the variables which node reads into reads.
+
+        :return: False if a variable can't be known at compile time
+        """
+        if isinstance(node, list):
+            return all(cls._reads(item, reads) for item in node)
+
+        if not isinstance(node, dict):
+            return True
+
+        if node.get('$OBJECT') == 'path':
+            paths = node.get('paths')
+            if not paths or not isinstance(paths[0], str):
+                return False
+
+            reads.add(paths[0])
+            return cls._reads(paths[1:], reads)
+
+        return all(cls._reads(item, reads) for item in node.values())
+
+    @staticmethod
+    def _writes(line: Line, writes: set):
+        """
+        Collects the variables which line assigns into writes.
+
+        :return: False if a variable can't be known at compile time
+        """
+        known = True
+        for key in ('name', 'output'):
+            names = line.get(key)
+            if isinstance(names, str):
+                names = [names]
+            elif not isinstance(names, list):
+                known = known and names is None
+                continue
+
+            if key == 'name':
+                # A path (a.b = ...), which writes it's first element.
+                names = names[:1]
+
+            for name in names:
+                if isinstance(name, str):
+                    writes.add(name)
+                else:
+                    known = False
+
+        return known
+
+    @classmethod
+    def _bind_call(cls, compiled: CompiledStory, line: Line):
+        """
+        Binds a call to the function it calls, and maps the arguments
+        passed by the caller onto the function's parameters.
+        """
+        function_line = compiled.functions.get(line.get('function'))
+        if function_line is None:
+            return
+
+        call_args = []
+        for arg in function_line.get('args') or []:
+            if arg['$OBJECT'] == 'argument':
+                name = arg['name']
+                call_args.append((name, line.arguments.get(name)))
+
+        line.function = function_line
+        line.call_args = tuple(call_args)
+
+    pure_methods = ('set', 'if', 'elif', 'else', 'for')
+    """
+    The lines which only read and write the context they're executed in.
+    """
+
+    @classmethod
+    def _purity(cls, compiled: CompiledStory):
+        """
+        Marks the functions whose body only has set lines (with or without
+        mutations), control flow, and calls to other pure functions, as
+        Line#pure. These don't call services, so when their arguments are
+        immutable, they have no effect outside of their own context
+        (see asyncy.processing.Memo).
+        """
+        bodies = {}
+        for line in compiled.lines:
+            if line.method == 'function':
+                line.pure = True
+                bodies[line.id] = [child for child in compiled.lines
+                                   if cls.has_parent(line, child)]
+
+        changed = True
+        while changed:
+            changed = False
+            for line in compiled.lines:
+                if line.pure and not all(cls._is_pure(child)
+                                         for child in bodies[line.id]):
+                    line.pure = False
+                    changed = True
+
+    @classmethod
+    def _is_pure(cls, line: Line):
+        if line.method == 'call':
+            return line.function is not None and line.function.pure
+
+        return line.method in cls.pure_methods
+
+    @classmethod
+    def _allocate_slots(cls, compiled: CompiledStory):
+        """
+        Assigns a slot to each variable which is set by name (a set line
+        with a single name, or the output of a for loop), and to each
+        function parameter. Variables set through a nested path
+        (a.b = ...) keep being stored by name.
+        """
+        slots = compiled.slots
+        for line in compiled.lines:
+            if line.method == 'set':
+                name = line.get('name')
+            elif line.method == 'for':
+                name = line.get('output')
+            elif line.method == 'function':
+                for arg in line.get('args') or []:
+                    if arg['$OBJECT'] == 'argument':
+                        slots.setdefault(arg['name'], len(slots))
+                continue
+            else:
+                continue
+
+            if name and len(name) == 1 and isinstance(name[0], str):
+                line.slot = slots.setdefault(name[0], len(slots))
+
+    @classmethod
+    def _compile_args(cls, line: Line, slots: dict = None):
+        args = []
+        for arg in line.get('args') or []:
+            if isinstance(arg, dict) and arg.get('$OBJECT') == 'mutation':
+                mutation = Node(arg)
+                cls._compile_arguments(mutation, slots)
+                args.append(mutation)
+            else:
+                args.append(Resolver.compile(arg, slots))
+
+        line.args = tuple(args)
+        cls._compile_arguments(line, slots)
+        line.static = cls._is_static(line)
+
+    @staticmethod
+    def _is_static(line: Line):
+        for arg in line.args:
+            if isinstance(arg, Node):
+                # A mutation, which resolves it's arguments.
+                static = all(argument.static
+                             for argument in arg.arguments.values())
+            else:
+                static = arg.static
+
+            if not static:
+                return False
+
+        return True
+
+    @classmethod
+    def _compile_arguments(cls, node: Node, slots: dict = None):
+        """
+        Compiles the arguments (name: value) of a node, keyed by their name.
+        If an argument is passed more than once, the first one wins.
+        """
+        for arg in node.get('args') or []:
+            if isinstance(arg, dict) and arg.get('$OBJECT') == 'argument':
+                node.arguments.setdefault(
+                    arg.get('name'),
+                    Resolver.compile(arg.get('argument'), slots))
+
+    @classmethod
+    def _number(cls, compiled: CompiledStory):
+        """
+        Assigns Line#pre and Line#post, walking the story depth first.
+        """
+        children = {line.id: [] for line in compiled.lines}
+        roots = []
+        for line in compiled.lines:
+            if line.parent is None:
+                roots.append(line)
+            else:
+                children[line.parent.id].append(line)
+
+        counter = 0
+        for root in roots:
+            stack = [(root, False)]
+            while stack:
+                line, visited = stack.pop()
+                counter += 1
+                if visited:
+                    line.post = counter
+                    continue
+
+                line.pre = counter
+                stack.append((line, True))
+                for child in reversed(children[line.id]):
+                    stack.append((child, False))
+
+    @staticmethod
+    def has_parent(parent_line: Line, line: Line):
+        return parent_line.pre < line.pre and line.post < parent_line.post
+
+    @classmethod
+    def _block_exit(cls, parent_line: Line, block_exits: dict):
+        """
+        Skips through the block of parent_line, and returns the line
+        after this block. Results are memoized in block_exits, keyed by
+        Line#id, so that nested blocks are only walked once.
+        """
+        if parent_line.id in block_exits:
+            return block_exits[parent_line.id]
+
+        next_line = parent_line
+
+        while next_line.next is not None:
+            next_line = next_line.next
+
+            # See if the next line is a block. If it is, skip through it.
+            if next_line.enter is not None \
+                    and next_line.parent is parent_line:
+                next_line = cls._block_exit(next_line, block_exits)
+
+                if next_line is None:
+                    break
+
+            if next_line.parent is not parent_line:
+                break
+
+        # We might have skipped through all the lines in this story,
+        # and ended up on on the last line.
+        # If this last line belongs to the same parent, then there's no
+        # line after this block. This check is required because the while
+        # loop breaks when it can't find a next line.
+        if next_line is None \
+                or next_line is parent_line \
+                or cls.has_parent(parent_line, next_line):
+            next_line = None
+
+        block_exits[parent_line.id] = next_line
+        return next_line
+
+    @classmethod
+    def _ref(cls, compiled: CompiledStory, raw: dict, key: str):
+        ln = raw.get(key)
+        if ln is None:
+            return None
+
+        return compiled.tree.get(ln)
@@ -17,7 +17,33 @@ class Config:
         'ENGINE_HOST': socket.gethostname(),
         'CLUSTER_CERT': '',
         'CLUSTER_AUTH_TOKEN': '',
-        'CLUSTER_HOST': 'kubernetes.default.svc'
+        'CLUSTER_HOST': 'kubernetes.default.svc',
+        'STORY_CODEGEN': 'off',
+        'STORY_CODEGEN_THRESHOLD': 50,
+        'STORY_LOOP_CONCURRENCY': 1,
+        'STORY_YIELD_LINES': 1000,
+        'STORY_YIELD_MICROSECONDS': 2000,
+        'STORY_APP_TUNABLES': None,
+        'STORY_TIMEOUT_SECONDS': 0,
+        'STORY_MAX_LINES': 0,
+        'STORY_FUNCTION_MEMO': 'off',
+        'STORY_FUNCTION_MEMO_SIZE': 1024,
+        'STORY_TRACE_SIZE': 4096,
+        'STORY_TRACE_SAMPLE_RATE': 0,
+        'STORY_CACHE_SIZE': 1024,
+        'STORY_CACHE_DIR': None,
+        'APP_IDLE_TTL_SECONDS': 0,
+        'OFFLOAD_EXECUTOR': 'off',
+        'OFFLOAD_WORKERS': 2,
+        'OFFLOAD_MIN_BYTES': 1048576,
+        'OFFLOAD_MIN_ITEMS': 100000,
+        'HTTP_POOL_SERVICES': 64,
+        'HTTP_POOL_SYNAPSE': 16,
+        'HTTP_POOL_KUBERNETES': 16,
+        'HTTP_POOL_HUB': 4,
+        'HTTP_POOL_FETCH': 32,
+        'SERVICE_CACHE_SIZE': 1024,
+        'HTTP_STREAM_BUFFER_BYTES': 8388608
     }
 
     ENGINE_PORT = None
@@ -89,6 +89,14 @@ class Containers:
     async def clean_app(cls, app):
         await Kubernetes.clean_namespace(app)
 
+    @classmethod
+    def forget(cls, app, container_name):
+        """
+        Removes a container from the registry of an app, so that it's
+        created (or found) again when it's started next.
+        """
+        app.containers.pop(container_name, None)
+
     @classmethod
     def is_service_reusable(cls, story, line):
         """
@@ -111,17 +119,31 @@ class Containers:
         return Kubernetes.get_hostname(story, line, container)
 
     @classmethod
-    async def start(cls, story, line):
+    async def start(cls, story, line, container_name=None):
         """
         Creates and starts a container as declared by line['service'].
+        container_name is looked up when it's not given (see
+        Services#plan).
 
-        If a container already exists, then it will be reused.
+        If a container already exists, then it will be reused. Containers
+        started by an app are kept in App#containers, and aren't looked
+        up in Kubernetes again until they're forgotten (see
+        Containers#forget).
         """
         service = line[LineConstants.service]
+        if container_name is None:
+            container_name = cls.get_container_name(story, line, service)
+
+        hostname = story.app.containers.get(container_name)
+        if hostname is not None:
+            return StreamingService(name=service, command=line['command'],
+                                    container_name=container_name,
+                                    hostname=hostname)
+
         story.logger.info(f'Starting container {service}')
-        container_name = cls.get_container_name(story, line, service)
         await cls.create_and_start(story, line, service, container_name)
-        hostname = await cls.get_hostname(story, line, service)
+        hostname = Kubernetes.get_hostname(story, line, container_name)
+        story.app.containers[container_name] = hostname
 
         ss = StreamingService(name=service, command=line['command'],
                               container_name=container_name,
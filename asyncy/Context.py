@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+from collections.abc import Mapping, MutableMapping
+
+UNSET = object()
+"""
+The value of a slot whose variable has not been set.
+"""
+
+
+class ReadOnlyError(TypeError):
+    """
+    Raised when a list or a dict of the shared layer is changed in place.
+    """
+
+
+def _read_only(*args, **kwargs):
+    raise ReadOnlyError('The values of the app are read-only')
+
+
+class ReadOnlyDict(dict):
+    """
+    A dict of the shared layer (see read_only). Dict#set changes a copy
+    of it instead (ReadOnlyDict#copy returns a dict).
+    """
+    __slots__ = ()
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    pop = popitem = clear = update = _read_only
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self[key]
+        _read_only()
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+
+class ReadOnlyList(list):
+    """
+    A list of the shared layer (see read_only). Like ReadOnlyDict,
+    ReadOnlyList#copy returns a list.
+    """
+    __slots__ = ()
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    append = extend = insert = remove = pop = clear = _read_only
+    sort = reverse = _read_only
+
+    def __reduce__(self):
+        return list, (list(self),)
+
+
+def read_only(value):
+    """
+    Returns a read-only version of value, whose lists and dicts (nested
+    or not) can't be changed, so that it can be shared by all the
+    executions of an app without copying it.
+    """
+    if isinstance(value, dict):
+        return ReadOnlyDict((k, read_only(v)) for k, v in value.items())
+    elif isinstance(value, list):
+        return ReadOnlyList(read_only(v) for v in value)
+    return value
+
+
+class Context(MutableMapping):
+    """
+    The context a story (or a function in a story) is executed with.
+
+    A context is layered: variables set by the story (or the arguments
+    of a function) live in the local layer, on top of a read-only layer
+    which is shared by all the executions of an app (see App#app_layer).
+    Reads fall through to the shared layer, and writes always go to the
+    local layer. Nothing is copied when a story starts, or when a function
+    is called: the lists and dicts of the shared layer are read-only (see
+    read_only), and they're only copied when an execution changes them
+    (see Dict#set), so that it can't change what other executions see.
+
+    Variables which the compiler assigned a slot to (see
+    CompiledStory#slots) are stored in Context#values, at their slot,
+    instead of the local layer. Compiled lines and expressions read and
+    write these by index; everything else keeps using their name.
+    """
+    __slots__ = ('local', 'parent', 'slots', 'values', 'forked')
+
+    def __init__(self, local: dict = None, parent: Mapping = None,
+                 slots: dict = None):
+        self.parent = {} if parent is None else parent
+        self.slots = {} if slots is None else slots
+        self.values = [UNSET] * len(self.slots)
+
+        local = {} if local is None else local
+        slotted = [key for key in local if key in self.slots]
+        if slotted:
+            local = dict(local)
+            for key in slotted:
+                self.values[self.slots[key]] = local.pop(key)
+
+        self.local = local
+        self.forked = None
+        """
+        The local layer and the slots of the context this one was copied
+        from, as they were when it was copied (see Context#copy).
+        """
+
+    def __getitem__(self, key):
+        slot = self.slots.get(key)
+        if slot is not None:
+            value = self.values[slot]
+            if value is not UNSET:
+                return value
+            return self.parent[key]
+
+        try:
+            return self.local[key]
+        except KeyError:
+            return self.parent[key]
+
+    def __setitem__(self, key, value):
+        slot = self.slots.get(key)
+        if slot is None:
+            self.local[key] = value
+        else:
+            self.values[slot] = value
+
+    def __delitem__(self, key):
+        # Only the local layer can be written to.
+        slot = self.slots.get(key)
+        if slot is None:
+            del self.local[key]
+        elif self.values[slot] is UNSET:
+            raise KeyError(key)
+        else:
+            self.values[slot] = UNSET
+
+    def __contains__(self, key):
+        slot = self.slots.get(key)
+        if slot is not None and self.values[slot] is not UNSET:
+            return True
+
+        return key in self.local or key in self.parent
+
+    def __iter__(self):
+        values = self.values
+        slotted = set()
+        for key, slot in self.slots.items():
+            if values[slot] is not UNSET:
+                slotted.add(key)
+                yield key
+
+        yield from self.local
+        for key in self.parent:
+            if key not in self.local and key not in slotted:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def setdefault(self, key, default=None):
+        """
+        A value which is read from the shared layer in order to be
+        modified (see Dict#set) is set in the local layer first.
+        """
+        try:
+            slot = self.slots.get(key)
+            if slot is not None:
+                value = self.values[slot]
+                if value is not UNSET:
+                    return value
+            else:
+                return self.local[key]
+        except KeyError:
+            pass
+
+        if key in self.parent:
+            value = self.parent[key]
+        else:
+            value = default
+
+        self[key] = value
+        return value
+
+    def copy(self):
+        """
+        Returns a shallow copy of this context, on top of the same
+        shared layer.
+        """
+        context = Context(dict(self.local), self.parent, self.slots)
+        context.values = list(self.values)
+        context.forked = (dict(self.local), list(self.values))
+        return context
+
+    def merge(self, other):
+        """
+        Assigns the variables which other (a copy of this context, see
+        Context#copy) assigned since it was copied. Variables which other
+        didn't assign keep their current value, even if this context (or
+        another copy, merged before) assigned them since.
+        """
+        local, values = other.forked
+        for key, value in other.local.items():
+            if local.get(key, UNSET) is not value:
+                self.local[key] = value
+
+        for slot, value in enumerate(other.values):
+            if value is not values[slot]:
+                self.values[slot] = value
+
+    def __repr__(self):
+        return repr(dict(self))
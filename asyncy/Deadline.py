@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import time
+
+from .Exceptions import DeadlineExceededError
+
+
+class Deadline:
+    """
+    The budget of a story execution: the time by which it must end, and
+    the number of lines it may execute. Each of them is unlimited when
+    it's None.
+
+    The budget is carried by Stories#deadline, and shared by everything
+    the execution does (including the iterations of parallel loops).
+    """
+    __slots__ = ('expires', 'lines')
+
+    def __init__(self, seconds: float = None, lines: int = None):
+        self.expires = time.monotonic() + seconds if seconds else None
+        self.lines = lines or None
+        """
+        The number of lines which can still be executed.
+        """
+
+    @classmethod
+    def for_app(cls, app):
+        return cls(app.story_timeout, app.story_max_lines)
+
+    def remaining(self):
+        """
+        :return: The seconds left before the deadline (never negative),
+        or None if the time is unlimited
+        """
+        if self.expires is None:
+            return None
+
+        return max(self.expires - time.monotonic(), 0.0)
+
+    def request_timeout(self, timeout: float = None):
+        """
+        Bounds the timeout of a request (None for the client's default)
+        by the time left.
+        """
+        remaining = self.remaining()
+        if remaining is None or timeout is not None and timeout < remaining:
+            return timeout
+
+        return remaining
+
+    def spend(self, story, line):
+        """
+        Counts a line which is about to be executed.
+        Raises DeadlineExceededError if the budget has run out.
+        """
+        if self.lines is not None:
+            self.lines -= 1
+            if self.lines < 0:
+                raise DeadlineExceededError(
+                    'Story executed too many lines', story=story, line=line)
+
+        if self.expires is not None and time.monotonic() >= self.expires:
+            raise DeadlineExceededError('Story ran out of time',
+                                        story=story, line=line)
@@ -9,6 +9,13 @@ class AsyncyError(Exception):
         super().__init__(message)
 
 
+class DeadlineExceededError(AsyncyError):
+    """
+    Raised when a story execution runs out of it's time or line budget
+    (see asyncy.Deadline).
+    """
+
+
 class ContainerSpecNotRegisteredError(AsyncyError):
     def __init__(self, container_name):
         super().__init__(message=f'Service {container_name} not registered!')
@@ -4,8 +4,9 @@ import json
 
 import certifi
 
-from tornado.httpclient import AsyncHTTPClient, HTTPError
+from tornado.httpclient import HTTPError
 
+from .utils.HttpClients import HttpClients
 from .utils.HttpUtils import HttpUtils
 
 
@@ -26,7 +27,7 @@ class GraphQLAPI:
         }
         """
 
-        client = AsyncHTTPClient()
+        client = HttpClients.get('hub')
         kwargs = {
             'headers': {'Content-Type': 'application/json'},
             'method': 'POST',
@@ -74,7 +75,7 @@ class GraphQLAPI:
         }
         """
 
-        client = AsyncHTTPClient()
+        client = HttpClients.get('hub')
 
         kwargs = {
             'headers': {'Content-Type': 'application/json'},
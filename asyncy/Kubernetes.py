@@ -3,11 +3,12 @@ import asyncio
 import json
 import ssl
 
-from tornado.httpclient import AsyncHTTPClient, HTTPResponse
+from tornado.httpclient import HTTPResponse
 
 from .Exceptions import K8sError
 from .Stories import Stories
 from .constants.LineConstants import LineConstants
+from .utils.HttpClients import HttpClients
 from .utils.HttpUtils import HttpUtils
 
 
@@ -83,7 +84,7 @@ class Kubernetes:
             if method == 'get':  # Default value.
                 kwargs['method'] = 'POST'
 
-        client = AsyncHTTPClient()
+        client = HttpClients.get('kubernetes')
         return await HttpUtils.fetch_with_retry(
             3, app.logger, f'https://{app.config.CLUSTER_HOST}{path}',
             client, kwargs)
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-from prometheus_client import Summary
+from prometheus_client import Counter, Summary
 
 
 story_request = Summary(
@@ -37,3 +37,21 @@ container_start_seconds_total = Summary(
     'Time spent executing commands in containers',
     ['app_id', 'story_name', 'service']
 )
+
+http_pool_wait_seconds = Summary(
+    'asyncy_engine_http_pool_wait_seconds',
+    'Time spent waiting for a free slot of an HTTP client pool',
+    ['pool']
+)
+
+service_cache_hits = Counter(
+    'asyncy_engine_service_cache_hits',
+    'Responses of services served from the response cache',
+    ['app_id', 'service', 'command']
+)
+
+service_cache_misses = Counter(
+    'asyncy_engine_service_cache_misses',
+    'Responses of cacheable services which were not cached',
+    ['app_id', 'service', 'command']
+)
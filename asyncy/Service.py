@@ -19,6 +19,7 @@ from .Sentry import Sentry
 from .http_handlers.StoryEventHandler import StoryEventHandler
 from .processing.Services import Services
 from .processing.internal import File, Http, Json, Log
+from .utils.HttpClients import HttpClients
 
 _ONE_DAY_IN_SECONDS = 60 * 60 * 24
 
@@ -56,6 +57,7 @@ class Service:
         global server
 
         Services.set_logger(logger)
+        HttpClients.init(config)
 
         # Init internal services.
         File.init()
@@ -1,11 +1,17 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import copy
 import pathlib
 import time
 import uuid
 from json import JSONDecodeError, dumps, loads
 
+from .Compiler import Compiler, Line, Node
+from .Context import Context
+from .Deadline import Deadline
+from .Trace import Trace
 from .utils import Dict
-from .utils.Resolver import Resolver
+from .utils.Resolver import Expression, Resolver
 
 
 class Stories:
@@ -14,9 +20,9 @@ class Stories:
         self.app = app
         self.name = story_name
         self.logger = logger
-        self.tree = app.stories[story_name]['tree']
-        self.entrypoint = app.stories[story_name]['entrypoint']
-        self.results = {}
+        self.compiled = app.stories[story_name]
+        self.tree = self.compiled.tree
+        self.entrypoint = self.compiled.entrypoint
         self.environment = None
         self.context = None
         self.containers = None
@@ -24,6 +30,49 @@ class Stories:
         self.version = None
         self.execution_id = str(uuid.uuid4())
         self._tmp_dir_created = False
+        self.deadline = None
+        self.function_memo = {}
+        """
+        The calls to pure functions memoized for this execution
+        (see asyncy.processing.Memo).
+        """
+        self._ticks = 0
+        self._slice_start = time.monotonic()
+        self.trace = None
+        """
+        The trace this execution is recorded in (see asyncy.Trace),
+        None when it's not traced.
+        """
+        self._line_starts = None
+
+    def tick(self, line=None):
+        """
+        Counts a line which is about to be executed, and returns True when
+        the story has executed App#yield_lines lines, or run for
+        App#yield_interval seconds, since it last yielded to the event
+        loop. The caller must then yield (see Stories#pause).
+
+        Raises DeadlineExceededError if the execution's budget has run out.
+        """
+        if self.deadline is not None:
+            self.deadline.spend(self, line)
+
+        self._ticks += 1
+        lines = self.app.yield_lines
+        if lines and self._ticks >= lines:
+            return True
+
+        interval = self.app.yield_interval
+        return bool(interval) and \
+            time.monotonic() - self._slice_start >= interval
+
+    async def pause(self):
+        """
+        Yields to the event loop, so that other stories can run.
+        """
+        await asyncio.sleep(0)
+        self._ticks = 0
+        self._slice_start = time.monotonic()
 
     def create_tmp_dir(self):
         if self._tmp_dir_created:
@@ -38,6 +87,17 @@ class Stories:
     def get_tmp_dir(self):
         return f'/tmp/story.{self.execution_id}'
 
+    def fork(self, context):
+        """
+        Returns a copy of this story, which executes with it's own context
+        (see Lexicon#for_loop).
+        """
+        story = copy.copy(self)
+        story.context = context
+        if self.trace is not None:
+            story._line_starts = {}
+        return story
+
     def line(self, line_number):
         if line_number is None:
             return None
@@ -47,73 +107,38 @@ class Stories:
     def first_line(self):
         return self.entrypoint
 
-    def line_has_parent(self, parent_line_number, line):
+    def line_has_parent(self, parent_line: Line, line: Line):
         """
         Looks up the hierarchy of this line to see if it
         belongs to a particular parent.
 
-        :param parent_line_number: The parent line number
+        :param parent_line: The parent line
         :param line: The line to test
         :return: True if this line is a child of the parent (directly or
                  indirectly), False otherwise
         """
+        return Compiler.has_parent(parent_line, line)
 
-        # Fast test - this line is an immediate child of the parent.
-        if parent_line_number == line.get('parent', None):
-            return True
-
-        while line is not None:
-            my_parent_number = line.get('parent', None)
-
-            if my_parent_number is None:
-                return False
-
-            if my_parent_number == parent_line_number:
-                return True
-
-            line = self.line(my_parent_number)
-
-    def next_block(self, parent_line: dict):
+    def next_block(self, parent_line: Line):
         """
         Given a parent_line, it skips through the block and returns the next
-        line after this block.
+        line after this block. This is computed when the story is compiled.
         """
-        next_line = parent_line
-
-        while next_line.get('next') is not None:
-            next_line = self.line(next_line['next'])
-
-            # See if the next line is a block. If it is, skip through it.
-            if next_line.get('enter', None) is not None \
-                    and next_line.get('parent') == parent_line['ln']:
-                next_line = self.next_block(next_line)
-
-                if next_line is None:
-                    return None
-
-            if next_line.get('parent', None) != parent_line['ln']:
-                break
-
-        # We might have skipped through all the lines in this story,
-        # and ended up on on the last line.
-        # If this last line belongs to the same parent, then return None.
-        # This check is required because the while loop breaks when it can't
-        # find a next line.
-        if next_line.get('parent') is not None \
-                and self.line_has_parent(parent_line['ln'], next_line):
-            return None
-
-        # If the next_line == parent_line, then there weren't any more lines
-        # after the parent.
-        if next_line['ln'] == parent_line['ln']:
-            return None
-
-        return next_line
+        return parent_line.block_exit
 
     def resolve(self, arg, encode=False):
         """
         Resolves line argument to their real value
         """
+        if isinstance(arg, Expression):
+            if arg.constant:
+                # Folded when the story was compiled.
+                result = arg.value
+            else:
+                result = arg.resolve(self.context)
+                self.logger.log('story-resolve', arg.node, result)
+            return self.encode(result) if encode else result
+
         if isinstance(arg, (str, int, float, bool)):
             self.logger.log('story-resolve', arg, arg)
             return arg
@@ -161,11 +186,10 @@ class Stories:
         return results
 
     def start_line(self, line_number):
-        self.results[line_number] = {'start': time.time()}
-
-    def end_line(self, line_number, output=None, assign=None):
-        start = self.results[line_number]['start']
+        if self.trace is not None:
+            self._line_starts[line_number] = Trace.clock()
 
+    def end_line(self, line_number, output=None, assign=None, slot=None):
         if type(output) is bytes:
             output = output.decode('utf-8')
 
@@ -183,11 +207,15 @@ class Stories:
         if isinstance(output, str):
             output = output.strip()
 
-        dictionary = {'output': output, 'end': time.time(), 'start': start}
-        self.results[line_number] = dictionary
+        if self.trace is not None:
+            self.trace.record(self.execution_id, line_number,
+                              self._line_starts.get(line_number),
+                              Trace.clock(), output)
 
         # assign a variable to the output
-        if assign:
+        if slot is not None:
+            self.context.values[slot] = output
+        elif assign:
             self.set_variable(assign, output)
 
     def set_variable(self, assign, output):
@@ -195,22 +223,19 @@ class Stories:
 
     def function_line_by_name(self, function_name):
         """
-        Finds the line which declares a function by the name of `function_name`
-        and returns it.
-
-        If no such function could be found, it returns None.
+        Returns the line which declares a function by the name of
+        `function_name`, or None if no such function was declared.
         """
-        next_line = self.line(self.first_line())
-        while next_line is not None:
-            if next_line.get('method', None) == 'function':
-                if next_line['function'] == function_name:
-                    return next_line
+        return self.compiled.functions.get(function_name)
 
-            next_line = self.next_block(next_line)
+    def argument_by_name(self, line, argument_name, encode=False):
+        if isinstance(line, Node):
+            argument = line.arguments.get(argument_name)
+            if argument is None:
+                return None
 
-        return None
+            return self.resolve(argument, encode=encode)
 
-    def argument_by_name(self, line, argument_name, encode=False):
         args = line.get('args')
         if args is None:
             return None
@@ -222,7 +247,7 @@ class Stories:
 
         return None
 
-    def context_for_function_call(self, line, function_line):
+    def context_for_function_call(self, line: Line):
         """
         Prepares a new context for calling a function.
         This context consists of the arguments required by the function,
@@ -235,23 +260,37 @@ class Stories:
         3. Execute the function block
         4. Restore the original Stories#context and continue execution
 
+        The arguments are mapped onto the function's parameters
+        when the story is compiled (see Line#call_args).
+
         :return: A new context, which contains the arguments required (if any)
         """
         new_context = {}
-        args = function_line.get('args', [])
-        for arg in args:
-            if arg['$OBJECT'] == 'argument':
-                arg_name = arg['name']
-                actual = self.argument_by_name(line, arg_name)
-                Dict.set(new_context, [arg_name], actual)
+        for arg_name, argument in line.call_args:
+            if argument is None:
+                new_context[arg_name] = None
+            else:
+                new_context[arg_name] = self.resolve(argument)
 
         return new_context
 
     def set_context(self, context):
-        self.context = context or {}
-        # Optimise this later.
-        self.context['app'] = self.app.app_context.copy()
+        """
+        Installs a context. Plain dicts become the local layer of a new
+        Context, on top of the app's shared layer (which is not copied),
+        with the slots of this story.
+        """
+        if isinstance(context, Context):
+            self.context = context
+        else:
+            self.context = Context(context, self.app.app_layer,
+                                   self.compiled.slots)
 
     def prepare(self, context=None):
         self.set_context(context)
+        self.deadline = Deadline.for_app(self.app)
+        trace = self.app.trace
+        if trace is not None and trace.sample():
+            self.trace = trace
+            self._line_starts = {}
         self.environment = self.app.environment or {}
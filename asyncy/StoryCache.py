@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import mmap
+import os
+import pickle
+import tempfile
+from collections import OrderedDict
+
+from .Compiler import CompiledStory, Compiler, Line
+
+
+class StoryCache:
+    """
+    Caches compiled stories under the hash of their tree (see
+    StoryCache#key), so that a release only compiles the stories which
+    changed since the previous one.
+
+    Compiled stories are kept in memory (the last STORY_CACHE_SIZE of them,
+    shared by all the apps of this engine) and, when STORY_CACHE_DIR is
+    set, in that directory, so that other engine processes (and the next
+    start of this one) don't compile them again. Files are written
+    atomically, and memory mapped when they're read. A file which can't be
+    read is ignored, and the story is compiled.
+
+    Compiled stories are shared, so nothing specific to an app or to an
+    execution may be stored in them (see App#prepared_requests).
+    """
+
+    version = 1
+    """
+    The version of the compiled form. Bump it whenever the compiler
+    changes what it produces, so that stale entries are never used.
+    """
+
+    links = ('next', 'enter', 'exit', 'parent', 'block_exit', 'function')
+    """
+    The attributes of a line which refer to another line. These are
+    stored as the Line#id of that line.
+    """
+
+    fields = ('pre', 'post', 'call_args', 'args', 'slot', 'static',
+              'parallel', 'pure')
+
+    compiled = OrderedDict()
+    """
+    The compiled stories kept in memory, least recently used first.
+    """
+
+    def __init__(self, size: int = 0, directory: str = None):
+        self.size = size
+        self.directory = directory or None
+
+    @classmethod
+    def for_config(cls, config):
+        return cls(int(config.STORY_CACHE_SIZE or 0), config.STORY_CACHE_DIR)
+
+    @classmethod
+    def key(cls, story_name: str, story: dict) -> str:
+        """
+        Hashes what the compiler reads from a story, so that the trees of
+        a hibernated app (see App#hibernate) have the same key.
+        """
+        source = json.dumps([cls.version, story_name,
+                             story.get('entrypoint'), story['tree']],
+                            sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+    def get(self, key: str):
+        """
+        :return: The story compiled under key, or None if it's not cached
+        """
+        compiled = self.compiled.get(key)
+        if compiled is not None:
+            self.compiled.move_to_end(key)
+            return compiled
+
+        if self.directory is None:
+            return None
+
+        try:
+            with open(self.path(key), 'rb') as f, \
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                compiled = self.loads(data)
+        except Exception:
+            return None
+
+        self.remember(key, compiled)
+        return compiled
+
+    def put(self, key: str, compiled: CompiledStory):
+        self.remember(key, compiled)
+        if self.directory is None:
+            return
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self.dumps(compiled))
+            os.replace(tmp, self.path(key))
+        except OSError:
+            # The story is still cached in memory.
+            pass
+
+    def remember(self, key: str, compiled: CompiledStory):
+        if self.size <= 0:
+            return
+
+        self.compiled[key] = compiled
+        while len(self.compiled) > self.size:
+            self.compiled.popitem(last=False)
+
+    @classmethod
+    def evict(cls, key: str):
+        """
+        Drops a story from memory. It's still cached in STORY_CACHE_DIR.
+        """
+        cls.compiled.pop(key, None)
+
+    def path(self, key: str):
+        return os.path.join(self.directory, f'{key}.pickle')
+
+    @classmethod
+    def dumps(cls, compiled: CompiledStory) -> bytes:
+        """
+        Serialises a compiled story. Lines refer to each other by their
+        Line#id (instead of being nested in each other), and handlers are
+        looked up again when the story is loaded.
+        """
+        lines = []
+        for line in compiled.lines:
+            state = {'raw': line.raw, 'arguments': line.arguments}
+            for link in cls.links:
+                target = getattr(line, link)
+                state[link] = None if target is None else target.id
+
+            for field in cls.fields:
+                state[field] = getattr(line, field)
+
+            if line.group is not None:
+                state['group'] = [member.id for member in line.group]
+            lines.append(state)
+
+        return pickle.dumps({
+            'name': compiled.name,
+            'entrypoint': compiled.entrypoint,
+            'slots': compiled.slots,
+            'functions': {name: line.id
+                          for name, line in compiled.functions.items()},
+            'lines': lines
+        }, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def loads(cls, data) -> CompiledStory:
+        story = pickle.loads(data)
+        states = story['lines']
+        lines = [Line(i, state['raw']) for i, state in enumerate(states)]
+        compiled = CompiledStory(story['name'], lines, story['entrypoint'])
+        compiled.slots = story['slots']
+
+        for line, state in zip(lines, states):
+            line.handler = Compiler.handlers.get(line.method)
+            line.arguments = state['arguments']
+            for link in cls.links:
+                target = state[link]
+                setattr(line, link, None if target is None else lines[target])
+
+            for field in cls.fields:
+                setattr(line, field, state[field])
+
+            group = state.get('group')
+            if group is not None:
+                line.group = tuple(lines[member] for member in group)
+
+        compiled.functions = {name: lines[i]
+                              for name, i in story['functions'].items()}
+        return compiled
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import random
+import time
+from collections import namedtuple
+
+try:
+    from time import perf_counter_ns as clock
+except ImportError:  # Python < 3.7
+    def clock():
+        return int(time.perf_counter() * 1e9)
+
+Record = namedtuple('Record',
+                    ['execution_id', 'line', 'start', 'end', 'size'])
+"""
+A line executed by a story: the line number, when it started and ended
+(in nanoseconds, see Trace#clock), and the size of it's output (the length
+of strings, bytes, lists and dicts, and 0 otherwise).
+"""
+
+
+class Trace:
+    """
+    Traces the lines executed by stories, into a ring buffer which holds
+    the last STORY_TRACE_SIZE records (see Stories#start_line and
+    Stories#end_line). Only lines with an output (or which assign one)
+    are recorded.
+
+    Tracing is off by default. When STORY_TRACE_SAMPLE_RATE is set (between
+    0 and 1), that fraction of the executions of an app are traced, and
+    each of them is traced completely.
+    """
+    __slots__ = ('buffer', 'size', 'sample_rate', 'position')
+
+    clock = staticmethod(clock)
+
+    def __init__(self, size: int, sample_rate: float):
+        self.size = size
+        self.sample_rate = sample_rate
+        self.buffer = [None] * size
+        self.position = 0
+        """
+        The number of records written so far. The next record is written
+        at position % size, over the oldest one.
+        """
+
+    @classmethod
+    def for_app(cls, app):
+        """
+        :return: The trace of an app, or None if it's not traced
+        """
+        size = app.tunable('STORY_TRACE_SIZE')
+        sample_rate = app.tunable('STORY_TRACE_SAMPLE_RATE', float)
+        if size <= 0 or sample_rate <= 0:
+            return None
+
+        return cls(size, min(sample_rate, 1.0))
+
+    def sample(self):
+        """
+        :return: True if an execution which is starting should be traced
+        """
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    @staticmethod
+    def output_size(output):
+        if isinstance(output, (str, bytes, list, dict)):
+            return len(output)
+
+        return 0
+
+    def record(self, execution_id, line, start, end, output):
+        self.buffer[self.position % self.size] = \
+            Record(execution_id, line, start, end, self.output_size(output))
+        self.position += 1
+
+    def records(self):
+        """
+        :return: The records in the buffer, oldest first
+        """
+        if self.position <= self.size:
+            return self.buffer[:self.position]
+
+        split = self.position % self.size
+        return self.buffer[split:] + self.buffer[:split]
+
+    def dump(self, execution_id):
+        """
+        :return: The records of an execution which are still in the
+        buffer, oldest first
+        """
+        return [record for record in self.records()
+                if record.execution_id == execution_id]
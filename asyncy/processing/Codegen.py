@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from .Lexicon import Lexicon
+from ..Exceptions import AsyncyError
+
+
+class UnsupportedLine(Exception):
+    """
+    Raised when a story has a line which Codegen can't generate code for.
+    Such stories are always interpreted.
+    """
+
+
+class Codegen:
+    """
+    Generates Python source for a compiled story: an async function which
+    executes the story exactly like the interpreter (Story#interpret) does.
+    if/elif/else and for lines become Python's own control flow (and only
+    the branch taken by a constant condition is generated), set lines
+    are inlined, groups of independent lines are executed together
+    (Story#execute_group), and the other lines call their handler. Each line is
+    still started (Stories#start_line) and errors are wrapped in the same
+    way, with the line which failed.
+
+    Stories are interpreted first, and promoted to their generated code
+    once they've been invoked STORY_CODEGEN_THRESHOLD times, when
+    STORY_CODEGEN is 'on' or 'compare'. In 'compare' mode the interpreter
+    stays authoritative, and the generated code is executed on a copy of
+    the context, to compare the results of both. Since that executes the
+    story twice, only stories without service calls are compared.
+    """
+
+    modes = ('on', 'compare')
+
+    successors = {
+        'set': 'next',
+        'execute': 'next',
+        'call': 'next',
+        'function': 'block_exit',
+        'when': 'block_exit'
+    }
+    """
+    The line executed after each kind of line, which calls it's handler.
+    """
+
+    side_effects = ('execute', 'when')
+
+    @classmethod
+    def promote(cls, story):
+        """
+        Counts an invocation of the story, and returns it's generated code
+        once it's promoted, or None if the story should be interpreted.
+        The generated code is cached in the app, so it's generated once
+        for each version of an app.
+        """
+        app = story.app
+        mode = app.config.STORY_CODEGEN
+        if mode not in cls.modes:
+            return None
+
+        name = story.name
+        if name in app.generated_stories:
+            return app.generated_stories[name]
+
+        invocations = app.story_invocations.get(name, 0) + 1
+        app.story_invocations[name] = invocations
+        if invocations <= app.codegen_threshold:
+            return None
+
+        generated = None
+        if mode == 'on' or not cls.has_side_effects(story.compiled):
+            generated = cls.build(story.compiled)
+
+        app.generated_stories[name] = generated
+        return generated
+
+    @classmethod
+    async def execute(cls, logger, story, generated):
+        from . import Story
+        if story.app.config.STORY_CODEGEN != 'compare':
+            await generated(logger, story)
+            return
+
+        shadow = Story.story(story.app, logger, story.name)
+        shadow.set_context(story.context.copy())
+        shadow.environment = story.environment
+
+        await Story.interpret(logger, story)
+        await generated(logger, shadow)
+
+        if dict(shadow.context) != dict(story.context):
+            logger.warn(f'Generated code for {story.name} returned '
+                        f'{dict(shadow.context)}, the interpreter returned '
+                        f'{dict(story.context)}')
+
+    @classmethod
+    def has_side_effects(cls, compiled):
+        for line in compiled.lines:
+            if line.method in cls.side_effects:
+                return True
+
+        return False
+
+    @classmethod
+    def build(cls, compiled):
+        """
+        Generates and compiles the code for a story.
+
+        :return: The generated function, or None if the story can't be
+        generated
+        """
+        source = cls.generate(compiled)
+        if source is None:
+            return None
+
+        from . import Story
+        namespace = {
+            'AsyncyError': AsyncyError,
+            'CancelledError': asyncio.CancelledError,
+            'L': compiled.lines,
+            'Lexicon': Lexicon,
+            'Story': Story
+        }
+        exec(compile(source, f'<story {compiled.name}>', 'exec'), namespace)
+        return namespace['run']
+
+    @classmethod
+    def generate(cls, compiled):
+        """
+        Generates the source of an async function run(logger, story),
+        which executes the story.
+
+        :return: The source, or None if the story can't be generated
+        """
+        first = None
+        if compiled.entrypoint is not None:
+            first = compiled.tree.get(compiled.entrypoint)
+            if first is None:
+                return None
+
+        source = [
+            'async def run(logger, story):',
+            '    line = None',
+            '    try:'
+        ]
+        try:
+            cls._sequence(source, first, None, 2, set())
+        except UnsupportedLine:
+            return None
+
+        source += [
+            '        pass',
+            '    except BaseException as e:',
+            '        if isinstance(e, (AsyncyError, CancelledError)):',
+            '            raise e',
+            '',
+            "        raise AsyncyError(message='Failed to execute line',",
+            '                          story=story, line=line)',
+            ''
+        ]
+        return '\n'.join(source)
+
+    @staticmethod
+    def _emit(source, depth, statement):
+        source.append('    ' * depth + statement)
+
+    @classmethod
+    def _sequence(cls, source, line, scope, depth, seen):
+        """
+        Generates the lines executed from line onwards, while they belong
+        to the block of scope (like Story#execute_block). At the top level
+        (scope is None), all the lines are generated, and each line is
+        logged like Story#interpret does.
+        """
+        while line is not None and (scope is None or line.parent is scope):
+            if line.id in seen:
+                raise UnsupportedLine(line)
+            seen.add(line.id)
+
+            cls._start(source, line, depth)
+            if line.method in ('if', 'elif', 'else'):
+                # Logs the line it returns by itself, since it depends
+                # on which branch is taken.
+                line = cls._if(source, line, scope, depth, seen)
+                continue
+
+            if line.method == 'for':
+                line = cls._for(source, line, depth, seen)
+            elif line.group is not None:
+                line = cls._group(source, line, depth, seen)
+            elif line.method in cls.successors and line.handler is not None:
+                line = cls._line(source, line, depth)
+            else:
+                raise UnsupportedLine(line)
+
+            if scope is None:
+                cls._log(source, line, depth)
+
+    @classmethod
+    def _start(cls, source, line, depth):
+        cls._emit(source, depth, f'line = L[{line.id}]')
+        cls._emit(source, depth, 'if story.tick(line):')
+        cls._emit(source, depth + 1, 'await story.pause()')
+        cls._emit(source, depth, 'story.start_line(line.ln)')
+
+    @classmethod
+    def _log(cls, source, line, depth):
+        next_line = 'None' if line is None else f'L[{line.id}]'
+        cls._emit(source, depth, f"logger.log('story-execution', {next_line})")
+
+    @classmethod
+    def _block(cls, source, parent_line, depth, seen):
+        """
+        Generates the block of parent_line, like Story#execute_block.
+        """
+        cls._emit(source, depth,
+                  f'Story.enter_block(story, L[{parent_line.id}])')
+        cls._sequence(source, parent_line.enter, parent_line, depth, seen)
+
+    @classmethod
+    def _line(cls, source, line, depth):
+        if line.method == 'set' and line.handler is Lexicon.set \
+                and line.slot is not None and len(line.args) == 1:
+            cls._emit(source, depth,
+                      'story.end_line(line.ln, '
+                      'output=story.resolve(line.args[0]), '
+                      f'slot={line.slot})')
+        else:
+            cls._emit(source, depth, 'await line.handler(logger, story, line)')
+
+        return getattr(line, cls.successors[line.method])
+
+    @classmethod
+    def _group(cls, source, line, depth, seen):
+        for member in line.group[1:]:
+            if member.id in seen:
+                raise UnsupportedLine(member)
+            seen.add(member.id)
+
+        cls._emit(source, depth,
+                  'await Story.execute_group(logger, story, line)')
+        return line.group[-1].next
+
+    @staticmethod
+    def _chain_exit(line):
+        """
+        Returns the line after an if/elif/else chain, starting at line.
+        See Lexicon#if_condition.
+        """
+        while True:
+            next_line = line.block_exit
+            if next_line is None:
+                return None
+
+            if next_line.method in ('else', 'elif'):
+                line = next_line
+            else:
+                return next_line
+
+    @classmethod
+    def _if(cls, source, line, scope, depth, seen):
+        if line.handler is not Lexicon.if_condition:
+            raise UnsupportedLine(line)
+
+        cls._emit(source, depth,
+                  "logger.log('lexicon-if', line, story.context)")
+        chain_exit = cls._chain_exit(line)
+        if line.method == 'else':
+            cls._block(source, line, depth, seen)
+            if scope is None:
+                cls._log(source, chain_exit, depth)
+            return chain_exit
+
+        if len(line.args) != 1:
+            cls._emit(source, depth,
+                      "raise AsyncyError(message='Complex if condition "
+                      f"found! len={len(line.args)}', "
+                      'story=story, line=line)')
+            return None
+
+        condition = line.args[0]
+        if condition.constant:
+            # Folded when the story was compiled, so only the branch
+            # which is taken is generated.
+            if condition.value:
+                cls._then(source, line, scope, depth, seen, chain_exit)
+            else:
+                cls._otherwise(source, line, scope, depth, seen)
+            return chain_exit
+
+        cls._emit(source, depth,
+                  'if story.resolve(line.args[0], encode=False):')
+        cls._then(source, line, scope, depth + 1, seen, chain_exit)
+
+        cls._emit(source, depth, 'else:')
+        statements = len(source)
+        cls._otherwise(source, line, scope, depth + 1, seen)
+        if len(source) == statements:
+            source.pop()
+
+        return chain_exit
+
+    @classmethod
+    def _then(cls, source, line, scope, depth, seen, chain_exit):
+        cls._block(source, line, depth, seen)
+        if scope is None:
+            cls._log(source, chain_exit, depth)
+
+    @classmethod
+    def _otherwise(cls, source, line, scope, depth, seen):
+        """
+        When the condition is false, the interpreter carries on with the
+        line after this block, which is either the next elif/else of
+        this chain, or the line after the chain.
+        """
+        next_line = line.block_exit
+        if next_line is not None \
+                and next_line.method in ('else', 'elif') \
+                and (scope is None or next_line.parent is scope):
+            if next_line.id in seen:
+                raise UnsupportedLine(next_line)
+            seen.add(next_line.id)
+
+            if scope is None:
+                cls._log(source, next_line, depth)
+            cls._start(source, next_line, depth)
+            cls._if(source, next_line, scope, depth, seen)
+        elif scope is None:
+            cls._log(source, next_line, depth)
+
+    @classmethod
+    def _for(cls, source, line, depth, seen):
+        output = line.get('output')
+        if line.handler is not Lexicon.for_loop or not line.args \
+                or not output or not isinstance(output[0], str):
+            raise UnsupportedLine(line)
+
+        if line.parallel:
+            # Iterations may be executed concurrently, by the handler.
+            cls._emit(source, depth, 'await line.handler(logger, story, line)')
+            return line.exit
+
+        items = f'items_{line.id}'
+        item = f'item_{line.id}'
+        cls._emit(source, depth,
+                  f'{items} = story.resolve(line.args[0], encode=False)')
+        cls._emit(source, depth, f"if hasattr({items}, '__aiter__'):")
+        cls._emit(source, depth + 1,
+                  f'await Lexicon.for_stream(logger, story, line, {items})')
+        cls._emit(source, depth, 'else:')
+        depth += 1
+
+        cls._emit(source, depth, f'for {item} in {items}:')
+        if line.slot is None:
+            cls._emit(source, depth + 1,
+                      f'story.context[{output[0]!r}] = {item}')
+        else:
+            cls._emit(source, depth + 1,
+                      f'story.context.values[{line.slot}] = {item}')
+
+        cls._block(source, line, depth + 1, seen)
+        return line.exit
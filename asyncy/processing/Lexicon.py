@@ -1,10 +1,12 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import json
 import time
 
 from .Mutations import Mutations
 from .Services import Services
 from .. import Metrics
+from ..Context import Context
 from ..Exceptions import AsyncyError
 from ..Types import StreamingService
 from ..constants.LineConstants import LineConstants
@@ -44,50 +46,60 @@ class Lexicon:
                 story_name=story.name, service=service
             ).observe(time.time() - start)
 
-            story.end_line(line['ln'], output=output,
+            story.end_line(line.ln, output=output,
                            assign={'paths': line.get('output')})
 
-            return Lexicon.next_line_or_none(story.line(line.get('next')))
+            return line.next
         else:
-            output = await Services.execute(story, line)
-            Metrics.container_exec_seconds_total.labels(
-                app_id=story.app.app_id,
-                story_name=story.name, service=service
-            ).observe(time.time() - start)
+            output = await Lexicon.execute_service(story, line)
+            return Lexicon.assign_output(story, line, output)
 
-            if line.get('name') and len(line['name']) == 1:
-                story.end_line(line['ln'], output=output,
-                               assign={'paths': line['name']})
-            else:
-                story.end_line(line['ln'], output=output,
-                               assign=line.get('output'))
+    @staticmethod
+    async def execute_service(story, line):
+        """
+        Runs the service of an execute line (which isn't streaming),
+        and returns it's output.
+        """
+        start = time.time()
+        output = await Services.execute(story, line)
+        Metrics.container_exec_seconds_total.labels(
+            app_id=story.app.app_id,
+            story_name=story.name, service=line[LineConstants.service]
+        ).observe(time.time() - start)
+        return output
 
-            return Lexicon.next_line_or_none(story.line(line.get('next')))
+    @staticmethod
+    def assign_output(story, line, output):
+        """
+        Ends an execute line, assigning the output of it's service.
+        """
+        if line.get('name') and len(line['name']) == 1:
+            story.end_line(line.ln, output=output,
+                           assign={'paths': line['name']})
+        else:
+            story.end_line(line.ln, output=output,
+                           assign=line.get('output'))
+
+        return line.next
 
     @staticmethod
     async def function(logger, story, line):
         """
         Functions are not executed when they're encountered.
-        This method returns the next block's line number,
+        This method returns the next block's first line,
         if there are more statements to be executed.
         """
-        return Lexicon.next_line_or_none(story.next_block(line))
-
-    @staticmethod
-    def next_line_or_none(line):
-        if line:
-            return line['ln']
-
-        return None
+        return story.next_block(line)
 
     @staticmethod
     async def set(logger, story, line):
-        value = story.resolve(line['args'][0])
+        value = story.resolve(line.args[0])
 
-        if len(line['args']) > 1:
+        if len(line.args) > 1:
             # Check if args[1] is a mutation.
             if line['args'][1]['$OBJECT'] == 'mutation':
-                value = Mutations.mutate(line['args'][1], value, story, line)
+                value = await Mutations.mutate_async(line.args[1], value,
+                                                     story, line)
                 logger.debug(f'Mutation result: {value}')
             else:
                 raise AsyncyError(
@@ -95,9 +107,12 @@ class Lexicon:
                             f'{line["args"][1]["$OBJECT"]}',
                     story=story, line=line)
 
-        story.end_line(line['ln'], output=value,
-                       assign={'$OBJECT': 'path', 'paths': line['name']})
-        return Lexicon.next_line_or_none(story.line(line.get('next')))
+        if line.slot is not None:
+            story.end_line(line.ln, output=value, slot=line.slot)
+        else:
+            story.end_line(line.ln, output=value,
+                           assign={'$OBJECT': 'path', 'paths': line['name']})
+        return line.next
 
     @staticmethod
     async def if_condition(logger, story, line):
@@ -106,15 +121,15 @@ class Lexicon:
         inside an if-block.
         """
         logger.log('lexicon-if', line, story.context)
-        if line['method'] == 'else':
+        if line.method == 'else':
             result = True
         else:
-            if len(line['args']) != 1:
+            if len(line.args) != 1:
                 raise AsyncyError(message=f'Complex if condition found! '
-                                          f'len={len(line["args"])}',
+                                          f'len={len(line.args)}',
                                   story=story, line=line)
 
-            result = story.resolve(line['args'][0], encode=False)
+            result = story.resolve(line.args[0], encode=False)
         if result:
             from . import Story
             await Story.execute_block(logger, story, line)
@@ -124,35 +139,113 @@ class Lexicon:
                 if next_line is None:
                     return None
 
-                if next_line['method'] == 'else' or \
-                        next_line['method'] == 'elif':
+                if next_line.method == 'else' or \
+                        next_line.method == 'elif':
                     line = next_line
                     continue
                 else:
                     break
 
-        return Lexicon.next_line_or_none(story.next_block(line))
+        return story.next_block(line)
 
     @staticmethod
     def unless_condition(logger, story, line):
         logger.log('lexicon-unless', line, story.context)
-        result = story.resolve(line['args'][0], encode=False)
+        result = story.resolve(line.args[0], encode=False)
         if result:
-            return line['exit']
-        return line['enter']
+            return line.exit
+        return line.enter
 
     @staticmethod
     async def for_loop(logger, story, line):
         """
         Evaluates a for loop
         """
-        _list = story.resolve(line['args'][0], encode=False)
-        output = line['output'][0]
+        _list = story.resolve(line.args[0], encode=False)
+        if hasattr(_list, '__aiter__'):
+            await Lexicon.for_stream(logger, story, line, _list)
+            return line.exit
+
+        if line.parallel and isinstance(story.context, Context):
+            concurrency = story.app.loop_concurrency
+            if concurrency > 1:
+                await Lexicon.parallel_for_loop(logger, story, line, _list,
+                                                concurrency)
+                return line.exit
+
         from . import Story
         for item in _list:
-            story.context[output] = item
+            Lexicon.assign_item(story, line, item)
             await Story.execute_block(logger, story, line)
-        return line['exit']
+        return line.exit
+
+    @staticmethod
+    async def for_stream(logger, story, line, stream):
+        """
+        Evaluates a for loop over an async iterator (such as the output of
+        file readLines), taking one item at a time, so that the items are
+        never held in memory all together. Streams are always iterated
+        sequentially. The stream is closed when the loop exits, even if it
+        fails, so that it stops reading.
+        """
+        from . import Story
+        try:
+            async for item in stream:
+                Lexicon.assign_item(story, line, item)
+                await Story.execute_block(logger, story, line)
+        finally:
+            aclose = getattr(stream, 'aclose', None)
+            if aclose is not None:
+                await aclose()
+
+    @staticmethod
+    def assign_item(story, line, item):
+        if line.slot is None:
+            story.context[line['output'][0]] = item
+        else:
+            story.context.values[line.slot] = item
+
+    @staticmethod
+    async def parallel_for_loop(logger, story, line, _list, concurrency):
+        """
+        Executes the iterations of a for loop whose iterations are
+        independent of each other (see Compiler#_independent_iterations),
+        up to concurrency iterations at a time. Each iteration gets it's
+        own copy of the context, and the variables it assigns are merged
+        back in the order of the items, as if the iterations were executed
+        one at a time. If an iteration fails, no more iterations are
+        started, the ones before it are merged, and it's error is raised.
+        """
+        from . import Story
+        items = enumerate(_list)
+        iterations = {}
+        failed = []
+
+        async def worker():
+            # Items are taken in order, so an iteration only starts once
+            # all the ones before it have started.
+            for index, item in items:
+                if failed:
+                    return
+
+                iteration = story.fork(story.context.copy())
+                Lexicon.assign_item(iteration, line, item)
+                try:
+                    await Story.execute_block(logger, iteration, line)
+                except BaseException as e:
+                    iterations[index] = e
+                    failed.append(e)
+                    return
+
+                iterations[index] = iteration
+
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        for index in sorted(iterations):
+            iteration = iterations[index]
+            if isinstance(iteration, BaseException):
+                raise iteration
+
+            story.context.merge(iteration.context)
 
     @staticmethod
     async def when(logger, story, line):
@@ -163,8 +256,7 @@ class Lexicon:
         if isinstance(s, StreamingService):
             # Yes, we need to subscribe to an event with the service.
             await Services.when(s, story, line)
-            next_line = story.next_block(line)
-            return Lexicon.next_line_or_none(next_line)
+            return story.next_block(line)
         else:
             raise AsyncyError(message=f'Unknown service {service} for when!',
                               story=story, line=line)
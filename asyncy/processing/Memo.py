@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+
+from ..utils.Resolver import immutable_types
+
+
+class Memo:
+    """
+    Memoizes the calls to pure functions (see Compiler#_purity).
+
+    Functions don't return anything, so a call to a pure function with
+    immutable arguments has no effect other than failing. Once such a call
+    succeeds, calling the same function with the same arguments again is
+    skipped. Note that the lines of a skipped call aren't traced again
+    (see asyncy.Trace).
+
+    Calls are memoized for the whole execution (Stories#function_memo)
+    when STORY_FUNCTION_MEMO is 'execution', or for all the executions
+    of an app (App#function_memo, which keeps the last
+    STORY_FUNCTION_MEMO_SIZE calls) when it's 'app'.
+    """
+
+    scopes = ('execution', 'app')
+
+    @classmethod
+    def key(cls, story, function_line, arguments: dict):
+        """
+        :return: The key of a call to function_line, or None if the call
+        can't be memoized
+        """
+        if story.app.function_memo_scope not in cls.scopes \
+                or not function_line.pure:
+            return None
+
+        for value in arguments.values():
+            if not isinstance(value, immutable_types):
+                return None
+
+        return story.name, function_line.id, tuple(sorted(arguments.items()))
+
+    @classmethod
+    def cache(cls, story):
+        if story.app.function_memo_scope == 'app':
+            return story.app.function_memo
+
+        return story.function_memo
+
+    @classmethod
+    def hit(cls, story, key):
+        cache = cls.cache(story)
+        if key not in cache:
+            return False
+
+        if isinstance(cache, OrderedDict):
+            cache.move_to_end(key)
+        return True
+
+    @classmethod
+    def add(cls, story, key):
+        cache = cls.cache(story)
+        cache[key] = True
+        if isinstance(cache, OrderedDict):
+            while len(cache) > story.app.function_memo_size:
+                cache.popitem(last=False)
@@ -3,25 +3,44 @@ from .mutations.DictMutations import DictMutations
 from .mutations.ListMutations import ListMutations
 from .mutations.NumberMutations import NumberMutations
 from .mutations.StringMutations import StringMutations
+from ..Context import ReadOnlyError, ReadOnlyList
 from ..Exceptions import AsyncyError
+from ..utils.Offload import Offload
 
 
 class Mutations:
 
+    @classmethod
+    async def mutate_async(cls, mutation, value, story, line):
+        """
+        Like Mutations#mutate, but long lists are sorted off the event loop
+        (see asyncy.utils.Offload).
+        """
+        if mutation.get('mutation') == 'sort' and isinstance(value, list) \
+                and not isinstance(value, ReadOnlyList):
+            await Offload.sort(story, value)
+            return None
+
+        return cls.mutate(mutation, value, story, line)
+
     @classmethod
     def mutate(cls, mutation, value, story, line):
         operator = mutation['mutation']
         operand = story.argument_by_name(mutation, operator)
         handler = None
         try:
+            arithmetic = operator in NumberMutations.arithmetic
             if isinstance(value, str):
                 handler = getattr(StringMutations, operator)
             elif isinstance(value, list):
-                handler = getattr(ListMutations, operator)
+                if arithmetic:
+                    handler = NumberMutations.op_vector
+                else:
+                    handler = getattr(ListMutations, operator)
             elif isinstance(value, dict):
                 handler = getattr(DictMutations, operator)
             elif isinstance(value, int) or isinstance(value, float):
-                if operator in ['+', '-', '/', '^', '*']:
+                if arithmetic:
                     handler = NumberMutations.op_unary
                 else:
                     handler = getattr(NumberMutations, operator)
@@ -34,4 +53,12 @@ class Mutations:
                         f'for mutation {operator}',
                 story=story, line=line)
 
-        return handler(mutation, value, story, line, operator, operand)
+        try:
+            return handler(mutation, value, story, line, operator, operand)
+        except ReadOnlyError as e:
+            # The values of the app are shared by all its executions
+            # (see asyncy.Context).
+            raise AsyncyError(
+                message=f'Cannot {operator} a value of the app in place, '
+                        f'since it is read-only',
+                story=story, line=line) from e
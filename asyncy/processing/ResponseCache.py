@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+
+from .. import Metrics
+
+
+class ResponseCache:
+    """
+    Caches the responses of the HTTP commands of services which declare it
+    in the http section of the command, in their OMG:
+
+        http:
+          method: get
+          path: /weather
+          cache:
+            ttl: 60  # Seconds.
+            key: [city]  # The arguments which the response depends on.
+
+    When key isn't given, the response depends on all the arguments of the
+    command. Only successful responses are cached, for ttl seconds.
+
+    Responses are cached for all the executions of an app (App#responses,
+    which keeps the last SERVICE_CACHE_SIZE responses), keyed by the
+    service, the command and the values of the key arguments. Entries are
+    tuples of (expires, content_type, body): the body is cached rather
+    than the output, so that stories can't change the output of other
+    executions.
+    """
+
+    clock = staticmethod(time.monotonic)
+
+    @staticmethod
+    def policy(command_conf: dict):
+        """
+        :return: A tuple of (ttl, key arguments) for the responses of a
+        command, or None if they aren't cached
+        """
+        cache = command_conf['http'].get('cache')
+        if not cache:
+            return None
+
+        ttl = float(cache.get('ttl') or 0)
+        if ttl <= 0:
+            return None
+
+        key = cache.get('key')
+        if key is None:
+            key = sorted((command_conf.get('arguments') or {}).keys())
+
+        return ttl, tuple(key)
+
+    @classmethod
+    def key(cls, story, line, service: str, command: str, arguments):
+        values = [story.argument_by_name(line, arg) for arg in arguments]
+        return service, command, json.dumps(values, sort_keys=True,
+                                            default=str)
+
+    @classmethod
+    def get(cls, story, key):
+        """
+        :return: A tuple of (content_type, body), or None if the response
+        isn't cached (or has expired)
+        """
+        responses = story.app.responses
+        service, command, _ = key
+        entry = responses.get(key)
+        if entry is not None and entry[0] <= cls.clock():
+            del responses[key]
+            entry = None
+
+        if entry is None:
+            Metrics.service_cache_misses.labels(
+                app_id=story.app.app_id, service=service,
+                command=command).inc()
+            return None
+
+        responses.move_to_end(key)
+        Metrics.service_cache_hits.labels(
+            app_id=story.app.app_id, service=service, command=command).inc()
+        return entry[1], entry[2]
+
+    @classmethod
+    def put(cls, story, key, ttl: float, content_type, body):
+        if story.app.response_cache_size <= 0:
+            return
+
+        responses = story.app.responses
+        responses[key] = (cls.clock() + ttl, content_type, body)
+        responses.move_to_end(key)
+        while len(responses) > story.app.response_cache_size:
+            responses.popitem(last=False)
@@ -5,10 +5,10 @@ import uuid
 from collections import deque, namedtuple
 from urllib import parse
 
-from tornado.httpclient import AsyncHTTPClient
-
 import ujson
 
+from .ResponseCache import ResponseCache
+from ..Compiler import Line
 from ..Containers import Containers
 from ..Exceptions import AsyncyError
 from ..Logger import Logger
@@ -17,7 +17,10 @@ from ..constants.ContextConstants import ContextConstants
 from ..constants.LineConstants import LineConstants
 from ..constants.ServiceConstants import ServiceConstants
 from ..utils import Dict
+from ..utils.HttpClients import HttpClients
 from ..utils.HttpUtils import HttpUtils
+from ..utils.Offload import Offload
+from ..utils.SingleFlight import SingleFlight
 
 InternalCommand = namedtuple('InternalCommand',
                              ['arguments', 'output_type', 'handler'])
@@ -27,6 +30,21 @@ Service = namedtuple('Service', ['name'])
 Command = namedtuple('Command', ['name'])
 Event = namedtuple('Event', ['name'])
 
+DispatchPlan = namedtuple('DispatchPlan',
+                          ['chain', 'kind', 'command_conf', 'container_name',
+                           'hostname', 'port', 'method', 'path', 'arguments',
+                           'cache', 'coalesce'])
+"""
+How a line calls it's service, resolved once per line of an app (see
+Services#plan). kind is 'internal', 'exec', 'inline' or 'http' (None when
+the command has neither a format nor an http section). container_name is
+the container which runs the service, and hostname, port, method, path
+(the template) and arguments (the location of each argument) describe
+the request of an 'http' line. cache is the ResponseCache#policy of it's
+responses, and coalesce is True when identical GET requests in flight at
+the same time are made once (see asyncy.utils.SingleFlight).
+"""
+
 
 class Services:
     internal_services = {}
@@ -58,12 +76,69 @@ class Services:
         return chain[len(chain) - 1]
 
     @classmethod
-    async def execute(cls, story, line):
+    async def plan(cls, story, line) -> DispatchPlan:
+        """
+        Returns the dispatch plan of a line. Compiled lines are planned the
+        first time they're executed, and the plan is reused after that
+        (see App#dispatch_plans).
+        """
+        if not isinstance(line, Line):
+            return await cls.build_plan(story, line)
+
+        plan = story.app.dispatch_plans.get(line)
+        if plan is None:
+            plan = await cls.build_plan(story, line)
+            story.app.dispatch_plans[line] = plan
+
+        return plan
+
+    @classmethod
+    async def build_plan(cls, story, line) -> DispatchPlan:
         chain = cls.resolve_chain(story, line)
         assert isinstance(chain, deque)
         assert isinstance(chain[0], Service)
+        service = chain[0].name
+
+        if service == 'http':
+            container_name = 'gateway'
+        else:
+            container_name = None
+
+        if cls.is_internal(service, cls.last(chain).name):
+            return DispatchPlan(chain, 'internal', None, container_name,
+                                None, None, None, None, None, None, False)
 
-        if cls.is_internal(chain[0].name, cls.last(chain).name):
+        command_conf = cls.get_command_conf(story, chain)
+        http = command_conf.get('http')
+        if container_name is None:
+            container_name = Containers.get_container_name(
+                story, line, line[LineConstants.service])
+
+        if command_conf.get('format') is not None:
+            kind = 'exec'
+        elif http is None:
+            kind = None
+        elif http.get('use_event_conn', False):
+            kind = 'inline'
+        else:
+            hostname = await Containers.get_hostname(story, line, service)
+            arguments = {
+                arg: conf.get('in', 'requestBody')
+                for arg, conf in (command_conf.get('arguments') or {}).items()
+            }
+            return DispatchPlan(chain, 'http', command_conf, container_name,
+                                hostname, http.get('port', 5000),
+                                http.get('method', 'post'), http.get('path'),
+                                arguments, ResponseCache.policy(command_conf),
+                                bool(http.get('coalesce', False)))
+
+        return DispatchPlan(chain, kind, command_conf, container_name,
+                            None, None, None, None, None, None, False)
+
+    @classmethod
+    async def execute(cls, story, line):
+        plan = await cls.plan(story, line)
+        if plan.kind == 'internal':
             return await cls.execute_internal(story, line)
         else:
             return await cls.execute_external(story, line)
@@ -94,22 +169,26 @@ class Services:
         and return a dict.
         """
         service = line[LineConstants.service]
-        chain = cls.resolve_chain(story, line)
-        command_conf = cls.get_command_conf(story, chain)
+        plan = await cls.plan(story, line)
         await cls.start_container(story, line)
-        if command_conf.get('format') is not None:
-            return await Containers.exec(story.logger, story, line,
-                                         service, line['command'])
-        elif command_conf.get('http') is not None:
-            if command_conf['http'].get('use_event_conn', False):
-                return await cls.execute_inline(story, line,
-                                                chain, command_conf)
-            else:
-                return await cls.execute_http(story, line, chain, command_conf)
-        else:
-            raise AsyncyError(message=f'Service {service}/{line["command"]} '
-                              f'has neither http nor format sections!',
-                              story=story, line=line)
+        try:
+            if plan.kind == 'exec':
+                return await Containers.exec(story.logger, story, line,
+                                             service, line['command'])
+            elif plan.kind == 'inline':
+                return await cls.execute_inline(story, line, plan.chain,
+                                                plan.command_conf)
+            elif plan.kind == 'http':
+                return await cls.execute_http(story, line, plan)
+        except Exception:
+            # The container might be gone, so it's looked up again by the
+            # next call (see Containers#start).
+            Containers.forget(story.app, plan.container_name)
+            raise
+
+        raise AsyncyError(message=f'Service {service}/{line["command"]} '
+                          f'has neither http nor format sections!',
+                          story=story, line=line)
 
     @classmethod
     def resolve_chain(cls, story, line):
@@ -170,16 +249,23 @@ class Services:
     @classmethod
     def get_command_conf(cls, story, chain):
         """
-        Returns the conf for the command specified by 'chain'.
+        Returns the conf for the command specified by 'chain', or an empty
+        dict if the OMG of the service doesn't declare it (which is fine for
+        a streaming line, see Services#start_container).
         """
         next = story.app.services
         for entry in chain:
+            if not next:
+                break
+
             if isinstance(entry, Service):
-                next = next[entry.name]['configuration']['actions']
+                next = next.get(entry.name, {}) \
+                    .get('configuration', {}).get('actions')
             elif isinstance(entry, Command):
-                next = next[entry.name]
+                next = next.get(entry.name)
             elif isinstance(entry, Event):
-                next = next['events'][entry.name]['output']['actions']
+                next = next.get('events', {}).get(entry.name, {}) \
+                    .get('output', {}).get('actions')
 
         return next or {}
 
@@ -206,18 +292,27 @@ class Services:
         # HTTP hack
 
     @classmethod
-    async def execute_http(cls, story, line, chain, command_conf):
-        assert isinstance(chain, deque)
-        assert isinstance(chain[0], Service)
-        hostname = await Containers.get_hostname(story, line, chain[0].name)
-        args = command_conf.get('arguments')
+    def http_request(cls, story, line, plan: DispatchPlan):
+        """
+        Resolves the arguments of an HTTP command into the request's
+        method, path (with the query string) and serialised body.
+
+        If none of the arguments of the line depend on the context
+        (see Line#static), this is done the first time the line is
+        executed, and reused after that (see App#prepared_requests).
+
+        :return: A tuple of (method, path, body)
+        """
+        prepared = story.app.prepared_requests.get(line)
+        if prepared is not None:
+            return prepared
+
         body = {}
         query_params = {}
         path_params = {}
 
-        for arg in args:
+        for arg, location in plan.arguments.items():
             value = story.argument_by_name(line, arg)
-            location = args[arg].get('in', 'requestBody')
             if location == 'query':
                 query_params[arg] = value
             elif location == 'path':
@@ -228,55 +323,88 @@ class Services:
                 raise AsyncyError(f'Invalid location for argument "{arg}" '
                                   f'specified: {location}')
 
-        method = command_conf['http'].get('method', 'post')
-        kwargs = {
-            'method': method.upper()
-        }
-
+        method = plan.method
+        serialised = None
         if method.lower() == 'post':
-            kwargs['body'] = json.dumps(body)
-            kwargs['headers'] = {
-                'Content-Type': 'application/json; charset=utf-8'
-            }
+            serialised = json.dumps(body)
         elif len(body) > 0:
             raise AsyncyError(
                 message=f'Parameters found in the request body, '
                         f'but the method is {method}', story=story, line=line)
 
-        port = command_conf['http'].get('port', 5000)
         path = HttpUtils.add_params_to_url(
-            command_conf['http']['path'].format(**path_params), query_params)
-        url = f'http://{hostname}:{port}{path}'
+            plan.path.format(**path_params), query_params)
+
+        request = (method.upper(), path, serialised)
+        if line.static:
+            story.app.prepared_requests[line] = request
+
+        return request
+
+    @classmethod
+    async def execute_http(cls, story, line, plan: DispatchPlan):
+        cache_key = None
+        if plan.cache is not None:
+            cache_key = ResponseCache.key(story, line, plan.chain[0].name,
+                                          cls.last(plan.chain).name,
+                                          plan.cache[1])
+            cached = ResponseCache.get(story, cache_key)
+            if cached is not None:
+                return await cls.http_output(story, *cached)
+
+        method, path, body = cls.http_request(story, line, plan)
+        kwargs = {
+            'method': method
+        }
+
+        if body is not None:
+            kwargs['body'] = body
+            kwargs['headers'] = {
+                'Content-Type': 'application/json; charset=utf-8'
+            }
+
+        url = f'http://{plan.hostname}:{plan.port}{path}'
 
         story.logger.debug(f'Invoking service on {url} with payload {kwargs}')
 
-        client = AsyncHTTPClient()
-        response = await HttpUtils.fetch_with_retry(
-            3, story.logger, url, client, kwargs)
+        client = HttpClients.get('services')
+        if plan.coalesce and method == 'GET':
+            response = await SingleFlight.run(
+                ('services', url), HttpUtils.fetch_with_retry, 3,
+                story.logger, url, client, kwargs, deadline=story.deadline)
+        else:
+            response = await HttpUtils.fetch_with_retry(
+                3, story.logger, url, client, kwargs, deadline=story.deadline)
 
         story.logger.debug(f'HTTP response code is {response.code}')
         if int(response.code / 100) == 2:
             content_type = response.headers.get('Content-Type')
-            if content_type and 'application/json' in content_type:
-                return ujson.loads(response.body)
-            else:
-                return response.body
+            if cache_key is not None:
+                ResponseCache.put(story, cache_key, plan.cache[0],
+                                  content_type, response.body)
+            return await cls.http_output(story, content_type, response.body)
         else:
             raise AsyncyError(message=f'Failed to invoke service!',
                               story=story, line=line)
 
+    @classmethod
+    async def http_output(cls, story, content_type, body):
+        if content_type and 'application/json' in content_type:
+            return await Offload.ujson_loads(story, body)
+        else:
+            return body
+
     @classmethod
     async def start_container(cls, story, line):
-        chain = cls.resolve_chain(story, line)
-        assert isinstance(chain[0], Service)
-        if chain[0].name == 'http':
+        plan = await cls.plan(story, line)
+        if plan.chain[0].name == 'http':
             return StreamingService(
                 name='http',
                 command=line[LineConstants.command],
-                container_name='gateway',
+                container_name=plan.container_name,
                 hostname=story.app.config.ASYNCY_HTTP_GW_HOST)
 
-        return await Containers.start(story, line)
+        return await Containers.start(story, line, plan.container_name)
 
     @classmethod
     def init(cls, logger):
@@ -345,7 +473,7 @@ class Services:
             }
         }
 
-        client = AsyncHTTPClient()
+        client = HttpClients.get('synapse')
         story.logger.debug(f'Subscribing to {service} '
                            f'from {s.command} via Synapse...')
 
@@ -354,7 +482,8 @@ class Services:
               f'/subscribe'
 
         response = await HttpUtils.fetch_with_retry(3, story.logger, url,
-                                                    client, kwargs)
+                                                    client, kwargs,
+                                                    deadline=story.deadline)
         if int(response.code / 100) == 2:
             story.logger.info(f'Subscribed!')
             story.app.add_subscription(sub_id, s, command, body)
@@ -1,9 +1,13 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import time
 
+from .Codegen import Codegen
+from .Memo import Memo
 from .. import Metrics
+from ..Compiler import Compiler, Line
 from ..Containers import Containers
-from ..Exceptions import AsyncyError
+from ..Exceptions import AsyncyError, DeadlineExceededError
 from ..Stories import Stories
 from ..constants.ContextConstants import ContextConstants
 from ..constants.LineConstants import LineConstants
@@ -28,78 +32,127 @@ class Story:
     @staticmethod
     async def execute(logger, story):
         """
-        Executes each line in the story
+        Executes each line in the story, with the interpreter or with the
+        story's generated code, once it's been promoted (see Codegen).
         """
-        line_number = story.first_line()
-        while line_number:
-            line_number = await Story.execute_line(logger, story, line_number)
-            logger.log('story-execution', line_number)
+        generated = Codegen.promote(story)
+        if generated is not None:
+            await Codegen.execute(logger, story, generated)
+        else:
+            await Story.interpret(logger, story)
 
     @staticmethod
-    async def execute_line(logger, story, line_number):
+    async def interpret(logger, story):
         """
-        Executes a single line by calling the Lexicon for various operations.
+        Executes each line in the story, one line at a time.
+        """
+        line = story.line(story.first_line())
+        while line is not None:
+            line = await Story.execute_line(logger, story, line)
+            logger.log('story-execution', line)
+
+    @staticmethod
+    async def execute_line(logger, story, line: Line):
+        """
+        Executes a single line by calling it's handler, which is bound to
+        the line when the story is compiled (see asyncy.Compiler).
 
         To execute a function completely, see Story#execute_function.
 
-        :return: Returns the next line number to be executed
+        :return: Returns the next line to be executed
         (return value from Lexicon), or None if there is none.
         """
-        line = story.line(line_number)
-        story.start_line(line_number)
+        if story.tick(line):
+            await story.pause()
+
+        story.start_line(line.ln)
         try:
-            method = line['method']
-            if method == 'if' or method == 'else' or method == 'elif':
-                return await Lexicon.if_condition(logger, story, line)
-            elif method == 'for':
-                return await Lexicon.for_loop(logger, story, line)
-            elif method == 'execute':
-                return await Lexicon.execute(logger, story, line)
-            elif method == 'set':
-                return await Lexicon.set(logger, story, line)
-            elif method == 'call':
-                return await Story.execute_function(logger, story, line)
-            elif method == 'function':
-                return await Lexicon.function(logger, story, line)
-            elif method == 'when':
-                return await Lexicon.when(logger, story, line)
-            else:
+            if line.handler is None:
                 raise NotImplementedError(
-                    f'Unknown method to execute: {method}'
+                    f'Unknown method to execute: {line.method}'
                 )
+
+            if line.group is not None:
+                return await Story.execute_group(logger, story, line)
+
+            return await line.handler(logger, story, line)
         except BaseException as e:
-            if isinstance(e, AsyncyError):  # Don't wrap AsyncyError.
+            # Don't wrap AsyncyError, and let cancellations through.
+            if isinstance(e, (AsyncyError, asyncio.CancelledError)):
                 raise e
 
             raise AsyncyError(message='Failed to execute line',
                               story=story, line=line)
 
     @staticmethod
-    async def execute_function(logger, story, line):
+    async def execute_group(logger, story, line: Line):
+        """
+        Executes the group of independent execute lines which starts at
+        line (see Compiler#_group). Their services are called concurrently,
+        and their outputs are assigned in the order of the lines once all
+        of them are done, so the story sees the same results as if they
+        were executed one at a time. If a service fails, the lines before
+        it are still assigned, and it's error is raised.
+
+        :return: Returns the line after the group
+        """
+        group = line.group
+        for member in group:
+            story.start_line(member.ln)
+
+        outputs = await asyncio.gather(
+            *[Lexicon.execute_service(story, member) for member in group],
+            return_exceptions=True)
+
+        for member, output in zip(group, outputs):
+            if isinstance(output, (AsyncyError, asyncio.CancelledError)):
+                raise output
+            elif isinstance(output, BaseException):
+                raise AsyncyError(message='Failed to execute line',
+                                  story=story, line=member) from output
+
+            Lexicon.assign_output(story, member, output)
+
+        return group[-1].next
+
+    @staticmethod
+    async def execute_function(logger, story, line: Line):
         """
         Calls a particular function indicated by the line.
         The parameter types are verified, and ensures that all the required
         parameters are present. This will setup a new context for the
-        function block to be executed, and will return the output (if any).
+        function block to be executed, and will return the next line
+        to be executed (if any).
         """
+        function_line = line.function
+        if function_line is None:
+            raise AsyncyError(
+                message=f'Function {line["function"]} is not declared',
+                story=story, line=line)
+
         current_context = story.context
-        function_line = story.function_line_by_name(line['function'])
-        context = story.context_for_function_call(line, function_line)
+        context = story.context_for_function_call(line)
+        key = Memo.key(story, function_line, context)
+        if key is not None and Memo.hit(story, key):
+            return line.next
+
         try:
             story.set_context(context)
             await Story.execute_block(logger, story, function_line)
         finally:
             story.set_context(current_context)
 
+        if key is not None:
+            Memo.add(story, key)
+
+        return line.next
+
     @staticmethod
-    async def execute_block(logger, story, parent_line: dict):
+    def enter_block(story, parent_line: Line):
         """
-        Executes all the lines whose parent is parent_line.
+        If this block represents a streaming service, copy over it's
+        output to the context, so that Lexicon can read it later.
         """
-        next_line = story.line(parent_line['enter'])
-
-        # If this block represents a streaming service, copy over it's
-        # output to the context, so that Lexicon can read it later.
         if parent_line.get('output') is not None:
             story.context[ContextConstants.service_output] = \
                 parent_line['output'][0]
@@ -108,14 +161,29 @@ class Story:
                 story.context[parent_line['output'][0]] = \
                     story.context[ContextConstants.service_event].get('data')
 
-        while next_line is not None and \
-                next_line['parent'] == parent_line['ln']:
-            if next_line.get('enter') is not None:
-                await Story.execute_block(logger, story, next_line)
-                next_line = story.next_block(next_line)
-            else:
-                await Story.execute_line(logger, story, next_line['ln'])
-                next_line = story.line(next_line.get('next'))
+    @staticmethod
+    async def execute_block(logger, story, parent_line: Line):
+        """
+        Executes all the lines whose parent is parent_line.
+        """
+        Story.enter_block(story, parent_line)
+
+        # Nested blocks (if, for, etc) are executed by their own handler,
+        # which returns the line after the block.
+        next_line = parent_line.enter
+        while next_line is not None and next_line.parent is parent_line:
+            next_line = await Story.execute_line(logger, story, next_line)
+
+    @classmethod
+    async def execute_run(cls, logger, story, block=None,
+                          function_name=None):
+        if function_name:
+            function_line = story.function_line_by_name(function_name)
+            await cls.execute_function(logger, story, function_line)
+        elif block:
+            await cls.execute_block(logger, story, story.line(block))
+        else:
+            await cls.execute(logger, story)
 
     @classmethod
     async def run(cls,
@@ -123,19 +191,28 @@ class Story:
                   block=None, context=None,
                   function_name=None):
         start = time.time()
+        app.activate()
         try:
             logger.log('story-start', story_name, story_id)
 
             story = cls.story(app, logger, story_name)
             story.prepare(context)
 
-            if function_name:
-                function_line = story.function_line_by_name(function_name)
-                await cls.execute_function(logger, story, function_line)
-            elif block:
-                await cls.execute_block(logger, story, story.line(block))
+            execution = cls.execute_run(logger, story, block, function_name)
+            timeout = None
+            if story.deadline is not None:
+                timeout = story.deadline.remaining()
+
+            if timeout is None:
+                await execution
             else:
-                await cls.execute(logger, story)
+                try:
+                    # Cancels the execution when it's out of time, even if
+                    # it's waiting on something.
+                    await asyncio.wait_for(execution, timeout)
+                except asyncio.TimeoutError:
+                    raise DeadlineExceededError('Story ran out of time',
+                                                story=story)
 
             logger.log('story-end', story_name, story_id)
             Metrics.story_run_success.labels(app_id=app.app_id,
@@ -147,6 +224,18 @@ class Story:
                 .observe(time.time() - start)
             raise err
         finally:
+            app.deactivate()
             Metrics.story_run_total.labels(app_id=app.app_id,
                                            story_name=story_name) \
                 .observe(time.time() - start)
+
+
+Compiler.register_handler('if', Lexicon.if_condition)
+Compiler.register_handler('elif', Lexicon.if_condition)
+Compiler.register_handler('else', Lexicon.if_condition)
+Compiler.register_handler('for', Lexicon.for_loop)
+Compiler.register_handler('execute', Lexicon.execute)
+Compiler.register_handler('set', Lexicon.set)
+Compiler.register_handler('call', Story.execute_function)
+Compiler.register_handler('function', Lexicon.function)
+Compiler.register_handler('when', Lexicon.when)
@@ -51,6 +51,29 @@ async def file_read(story, line, resolved_args):
                           story=story, line=line)
 
 
+@Decorators.create_service(name='file', command='readLines', arguments={
+    'path': {'type': 'string'}
+}, output_type='any')
+async def file_read_lines(story, line, resolved_args):
+    """
+    Streams the lines of a file, without their line breaks. The file is
+    opened when the stream is iterated (see Lexicon#for_stream), and read
+    one line at a time.
+    """
+    path = safe_path(story, resolved_args['path'])
+    return read_lines(story, line, path)
+
+
+async def read_lines(story, line, path):
+    try:
+        with open(path, 'r') as f:
+            for text in f:
+                yield text.rstrip('\n')
+    except IOError as e:
+        raise AsyncyError(message=f'Failed to read file: {e}',
+                          story=story, line=line)
+
+
 @Decorators.create_service(name='file', command='exists', arguments={
     'path': {'type': 'string'}
 }, output_type='boolean')
@@ -1,24 +1,21 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import json
 
 import certifi
 
-from tornado.httpclient import AsyncHTTPClient
+from tornado.httputil import parse_response_start_line
 
 from .Decorators import Decorators
 from ...Exceptions import AsyncyError
+from ...utils.HttpClients import HttpClients
 from ...utils.HttpUtils import HttpUtils
+from ...utils.Offload import Offload
+from ...utils.SingleFlight import SingleFlight
 
 
-@Decorators.create_service(name='http', command='fetch', arguments={
-    'url': {'type': 'string'},
-    'headers': {'type': 'map'},
-    'body': {'type': 'string'},
-    'method': {'type': 'string'}
-}, output_type='any')
-async def http_post(story, line, resolved_args):
+def request_kwargs(resolved_args):
     method = resolved_args.get('method', 'get') or 'get'
-    http_client = AsyncHTTPClient()
     kwargs = {'method': method.upper(), 'ca_certs': certifi.where()}
 
     headers = resolved_args.get('headers') or {}
@@ -32,19 +29,132 @@ async def http_post(story, line, resolved_args):
         if isinstance(kwargs['body'], dict):
             kwargs['body'] = json.dumps(kwargs['body'])
 
-    response = await HttpUtils.fetch_with_retry(3, story.logger,
-                                                resolved_args['url'],
-                                                http_client, kwargs)
+    return kwargs
+
+
+@Decorators.create_service(name='http', command='fetch', arguments={
+    'url': {'type': 'string'},
+    'headers': {'type': 'map'},
+    'body': {'type': 'string'},
+    'method': {'type': 'string'},
+    'coalesce': {'type': 'boolean'}
+}, output_type='any')
+async def http_post(story, line, resolved_args):
+    """
+    When coalesce is true, identical GET requests which are in flight at
+    the same time are made once (see asyncy.utils.SingleFlight).
+    """
+    http_client = HttpClients.get('fetch')
+    kwargs = request_kwargs(resolved_args)
+    url = resolved_args['url']
+    if resolved_args.get('coalesce') and kwargs['method'] == 'GET':
+        key = ('fetch', url, json.dumps(kwargs['headers'], sort_keys=True),
+               kwargs.get('body'))
+        response = await SingleFlight.run(
+            key, HttpUtils.fetch_with_retry, 3, story.logger, url,
+            http_client, kwargs, deadline=story.deadline)
+    else:
+        response = await HttpUtils.fetch_with_retry(
+            3, story.logger, url, http_client, kwargs,
+            deadline=story.deadline)
     if int(response.code / 100) != 2:
         raise AsyncyError(
             story=story, line=line,
             message=f'Failed to make HTTP call: {response.error}')
 
     if 'application/json' in response.headers.get('Content-Type'):
-        return json.loads(response.body.decode('utf-8'))
+        return await Offload.json_loads(story,
+                                        response.body.decode('utf-8'))
 
     return response.body.decode('utf-8')
 
 
+@Decorators.create_service(name='http', command='fetchLines', arguments={
+    'url': {'type': 'string'},
+    'headers': {'type': 'map'},
+    'body': {'type': 'string'},
+    'method': {'type': 'string'}
+}, output_type='any')
+async def http_fetch_lines(story, line, resolved_args):
+    """
+    Streams the lines of the response body, as they're received.
+    Nothing is requested until the stream is iterated (see
+    Lexicon#for_stream), and since a part of the body may have been
+    consumed already, failed requests aren't retried.
+
+    Tornado can't pause a download, so the part of the body which has
+    been received but not read yet is buffered; if it grows past
+    HTTP_STREAM_BUFFER_BYTES, the download is aborted and the stream
+    fails. Closing the stream aborts the download too.
+    """
+    kwargs = request_kwargs(resolved_args)
+    if story.deadline is not None:
+        timeout = story.deadline.request_timeout()
+        if timeout is not None:
+            kwargs['request_timeout'] = timeout
+
+    limit = int(story.app.config.HTTP_STREAM_BUFFER_BYTES or 0)
+    return stream_lines(story, line, resolved_args['url'], kwargs, limit)
+
+
+async def stream_lines(story, line, url, kwargs, limit):
+    chunks = asyncio.Queue()
+    status = []
+    buffered = [0]
+    aborted = []
+
+    def on_header(header):
+        if header.startswith('HTTP/'):
+            # A new response starts (after a redirect, for example).
+            status[:] = [parse_response_start_line(header.strip()).code]
+
+    def on_chunk(chunk):
+        if not aborted and status and int(status[0] / 100) == 2:
+            buffered[0] += len(chunk)
+            if limit <= 0 or buffered[0] <= limit:
+                chunks.put_nowait(chunk)
+                return
+
+            aborted.append(f'More than {limit} bytes of {url} were '
+                           f'received, but not read yet')
+
+        if aborted:
+            # Raising from the callback makes tornado close the connection.
+            raise AsyncyError(story=story, line=line, message=aborted[0])
+
+    response = asyncio.ensure_future(HttpClients.get('fetch').fetch(
+        url, header_callback=on_header, streaming_callback=on_chunk,
+        raise_error=False, **kwargs))
+    response.add_done_callback(lambda _: chunks.put_nowait(None))
+
+    try:
+        pending = b''
+        while True:
+            chunk = await chunks.get()
+            if chunk is None:
+                break
+
+            buffered[0] -= len(chunk)
+            *received, pending = (pending + chunk).split(b'\n')
+            for text in received:
+                yield text.rstrip(b'\r').decode('utf-8')
+
+        if aborted:
+            raise AsyncyError(story=story, line=line, message=aborted[0])
+
+        response = response.result()
+        if int(response.code / 100) != 2:
+            raise AsyncyError(
+                story=story, line=line,
+                message=f'Failed to make HTTP call: {response.error}')
+
+        if pending:
+            yield pending.rstrip(b'\r').decode('utf-8')
+    finally:
+        if not response.done():
+            aborted.append(f'The stream of {url} was closed')
+            response.cancel()
+
+
 def init():
     pass
@@ -1,21 +1,20 @@
 # -*- coding: utf-8 -*-
-import json
-
 from .Decorators import Decorators
+from ...utils.Offload import Offload
 
 
 @Decorators.create_service(name='json', command='stringify', arguments={
     'content': {'type': 'string'}
 }, output_type='any')
 async def stringify(story, line, resolved_args):
-    return json.dumps(resolved_args['content'])
+    return await Offload.json_dumps(story, resolved_args['content'])
 
 
 @Decorators.create_service(name='json', command='parse', arguments={
     'content': {'type': 'string'}
 }, output_type='any')
 async def parse(story, line, resolved_args):
-    return json.loads(resolved_args['content'])
+    return await Offload.json_loads(story, resolved_args['content'])
 
 
 def init():
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+from ...Exceptions import AsyncyError
 
 
 class DictMutations:
@@ -26,3 +27,17 @@ class DictMutations:
     @classmethod
     def has(cls, mutation, value, story, line, operator, operand):
         return value.get(operand) is not None
+
+    @classmethod
+    def merge(cls, mutation, value, story, line, operator, operand):
+        """
+        Returns a new dict with the keys of value, updated with the keys
+        of operand. Neither of them is modified.
+        """
+        if not isinstance(operand, dict):
+            raise AsyncyError(message=f'Cannot merge {operand!r} into a dict',
+                              story=story, line=line)
+
+        merged = dict(value)
+        merged.update(operand)
+        return merged
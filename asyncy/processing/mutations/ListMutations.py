@@ -1,8 +1,19 @@
 # -*- coding: utf-8 -*-
 import random
+from collections import OrderedDict
+
+from ...Compiler import Node
+from ...Exceptions import AsyncyError
+from ...utils.Resolver import Resolver
 
 
 class ListMutations:
+    """
+    Mutations of lists. Besides the scalar ones, bulk mutations (unique,
+    chunk, flatten, pluck, group_by, filter) transform a whole list in
+    one line, instead of a for loop with a set for each item. These
+    return a new list, and leave the original one as it is.
+    """
 
     @classmethod
     def _list_shift(cls, l, n):
@@ -75,3 +86,154 @@ class ListMutations:
         except ValueError:
             # The value to be removed is not in the list.
             pass
+
+    @classmethod
+    def unique(cls, mutation, value, story, line, operator, operand):
+        """
+        Removes the duplicate items, keeping the first one of each.
+        """
+        seen = set()
+        unhashable = []
+        items = []
+        for item in value:
+            try:
+                key = cls._identity(item)
+                if key in seen:
+                    continue
+                seen.add(key)
+            except TypeError:
+                # Values which aren't JSON (sets, for example).
+                if item in unhashable:
+                    continue
+                unhashable.append(item)
+
+            items.append(item)
+
+        return items
+
+    @classmethod
+    def _identity(cls, item):
+        """
+        :return: A hashable key for item, which is equal to another item's
+        when both are the same JSON value. Unlike in Python, booleans are
+        never equal to numbers (true isn't 1), and lists and dicts are
+        compared by their items.
+        """
+        if type(item) is bool:
+            return bool, item
+        elif isinstance(item, list):
+            return list, tuple(map(cls._identity, item))
+        elif isinstance(item, dict):
+            return dict, frozenset((key, cls._identity(value))
+                                   for key, value in item.items())
+        return item
+
+    @classmethod
+    def chunk(cls, mutation, value, story, line, operator, operand):
+        if type(operand) is not int or operand <= 0:
+            raise AsyncyError(
+                message=f'The size of a chunk must be a positive integer, '
+                        f'not {operand!r}', story=story, line=line)
+
+        return [value[i:i + operand] for i in range(0, len(value), operand)]
+
+    @classmethod
+    def flatten(cls, mutation, value, story, line, operator, operand):
+        """
+        Flattens one level of nested lists.
+        """
+        items = []
+        for item in value:
+            if isinstance(item, list):
+                items.extend(item)
+            else:
+                items.append(item)
+
+        return items
+
+    @classmethod
+    def pluck(cls, mutation, value, story, line, operator, operand):
+        """
+        Returns the value of the key operand in each item (None for items
+        which don't have it).
+        """
+        return [item.get(operand) if isinstance(item, dict) else None
+                for item in value]
+
+    @classmethod
+    def group_by(cls, mutation, value, story, line, operator, operand):
+        """
+        Groups the items (which are dicts) by their value for the key
+        operand, keeping the order in which each group first appears.
+        Booleans are grouped apart from numbers, under the keys 'true'
+        and 'false'.
+        """
+        groups = OrderedDict()
+        for item in value:
+            key = item.get(operand) if isinstance(item, dict) else None
+            try:
+                group = groups.setdefault((type(key) is bool, key), [])
+            except TypeError:
+                raise AsyncyError(
+                    message=f'Cannot group by {operand!r}, since it has '
+                            f'the value {key!r}', story=story, line=line)
+            group.append(item)
+
+        result = {}
+        for (is_bool, key), items in groups.items():
+            if is_bool:
+                key = 'true' if key else 'false'
+                if (False, key) in groups:
+                    raise AsyncyError(
+                        message=f'Cannot group by {operand!r}, since it '
+                                f'has both the boolean and the string '
+                                f'{key}', story=story, line=line)
+            result[key] = items
+
+        return result
+
+    @staticmethod
+    def _argument_names(mutation):
+        if isinstance(mutation, Node):
+            return mutation.arguments.keys()
+
+        return [arg.get('name') for arg in mutation.get('args') or []
+                if arg.get('$OBJECT') == 'argument']
+
+    @classmethod
+    def filter(cls, mutation, value, story, line, operator, operand):
+        """
+        Keeps the items which satisfy a simple assertion, given as another
+        argument named after it (equals, not_equal, greater, greater_equal,
+        less or less_equal). The operand is the key of the items (which
+        are dicts) to compare, or None to compare the items themselves:
+
+            adults = users filter filter: 'age' greater_equal: 18
+        """
+        names = [name for name in cls._argument_names(mutation)
+                 if name in Resolver.assertions]
+        if len(names) != 1:
+            raise AsyncyError(
+                message='filter requires exactly one of '
+                        f'{", ".join(Resolver.assertions)}',
+                story=story, line=line)
+
+        compare = Resolver.assertions[names[0]]
+        expected = story.argument_by_name(mutation, names[0])
+        items = []
+        for item in value:
+            if operand is not None:
+                if not isinstance(item, dict) or operand not in item:
+                    continue
+                subject = item[operand]
+            else:
+                subject = item
+
+            try:
+                if compare(subject, expected):
+                    items.append(item)
+            except TypeError:
+                # Values which can't be compared don't satisfy it.
+                pass
+
+        return items
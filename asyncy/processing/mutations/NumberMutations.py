@@ -1,20 +1,67 @@
 # -*- coding: utf-8 -*-
+import operator as operators
+from itertools import repeat
+
+from ...Exceptions import AsyncyError
 
 
 class NumberMutations:
 
+    arithmetic = {
+        '*': operators.mul,
+        '/': operators.truediv,
+        '+': operators.add,
+        '-': operators.sub,
+        '^': pow
+    }
+
     @classmethod
     def op_unary(cls, mutation, value, story, line, operator, operand):
-        if operator == '*':
-            return value * operand
-        elif operator == '/':
-            return value / operand
-        elif operator == '+':
-            return value + operand
-        elif operator == '-':
-            return value - operand
-        elif operator == '^':
-            return pow(value, operand)
+        return cls.arithmetic[operator](value, operand)
+
+    @classmethod
+    def op_vector(cls, mutation, value, story, line, operator, operand):
+        """
+        Applies an arithmetic operator to each number of a list, and the
+        operand: either a number, or a list of the same length (whose
+        numbers are used pairwise). Returns a new list.
+
+        The operator is mapped over the list in a single call, so a list
+        of thousands of numbers is processed by one line of a story.
+        """
+        if isinstance(operand, list):
+            if len(operand) != len(value):
+                raise AsyncyError(
+                    message=f'Cannot apply {operator} to lists of different '
+                            f'lengths ({len(value)} and {len(operand)})',
+                    story=story, line=line)
+            operands = operand
+        else:
+            operands = repeat(operand, len(value))
+
+        numbers = operand if isinstance(operand, list) else (operand,)
+        if not cls._all_numbers(value) or not cls._all_numbers(numbers):
+            raise AsyncyError(
+                message=f'Cannot apply {operator} to a list which has '
+                        'items other than numbers, or with an operand '
+                        'which is not a number',
+                story=story, line=line)
+
+        try:
+            return list(map(cls.arithmetic[operator], value, operands))
+        except (ZeroDivisionError, OverflowError) as e:
+            raise AsyncyError(
+                message=f'Cannot apply {operator} to a list: {e}',
+                story=story, line=line) from e
+
+    @staticmethod
+    def _is_number(item):
+        # bool is a subclass of int, but True + 1 isn't arithmetic.
+        return type(item) is not bool and isinstance(item, (int, float))
+
+    @classmethod
+    def _all_numbers(cls, items):
+        return all(map(cls._is_number, items))
 
     @classmethod
     def is_odd(cls, mutation, value, story, line, operator, operand):
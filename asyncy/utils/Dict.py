@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+from ..Context import ReadOnlyDict
 
 
 class Dict:
@@ -8,11 +9,16 @@ class Dict:
         if len(keys) == 1:
             _dict[keys[0]] = output
         else:
+            # keys belongs to the (compiled) story, so it's not modified.
             _cur = _dict
-            last = keys.pop()
-            for key in keys:
-                _cur = _cur.setdefault(key, {})
-                if not isinstance(_cur, dict):
+            last = keys[-1]
+            for key in keys[:-1]:
+                _parent = _cur
+                _cur = _parent.setdefault(key, {})
+                if isinstance(_cur, ReadOnlyDict):
+                    # Copied from the shared layer (see asyncy.Context).
+                    _cur = _parent[key] = _cur.copy()
+                elif not isinstance(_cur, dict):
                     _dict[key] = {}
                     _cur = _dict[key]
             _cur[last] = output
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import time
+from weakref import WeakKeyDictionary
+
+from tornado.curl_httpclient import CurlAsyncHTTPClient
+from tornado.ioloop import IOLoop
+from tornado.locks import Semaphore
+from tornado.simple_httpclient import SimpleAsyncHTTPClient
+
+from .. import Metrics
+
+
+class HttpClient:
+    """
+    The HTTP client of a pool (see HttpClients). At most size requests
+    are made at a time, and the time other requests wait for their turn
+    is observed in Metrics#http_pool_wait_seconds.
+
+    Requests only wait for a slot: the client may make more requests than
+    size at a time, so that it never queues them itself.
+    """
+
+    def __init__(self, pool: str, size: int, client_class=None):
+        self.pool = pool
+        self.size = size
+        self.slots = Semaphore(size)
+        self.client = (client_class or CurlAsyncHTTPClient)(
+            force_instance=True, max_clients=size + 1)
+
+    async def fetch(self, request, **kwargs):
+        start = time.perf_counter()
+        async with self.slots:
+            Metrics.http_pool_wait_seconds.labels(pool=self.pool) \
+                .observe(time.perf_counter() - start)
+            return await self.client.fetch(request, **kwargs)
+
+
+class HttpClients:
+    """
+    Separate HTTP clients for each kind of destination, so that a burst of
+    slow requests to one of them (third party APIs called by stories, for
+    example) doesn't hold up the requests to the others.
+
+    The pools are:
+    - services: the services called by stories
+    - synapse: subscriptions to events
+    - kubernetes: the Kubernetes API
+    - hub: the Asyncy Hub API
+    - fetch: the URLs fetched by stories (see http fetch)
+
+    The size of a pool is set by HTTP_POOL_<POOL> (see Config). Pools use
+    curl, which keeps connections alive, except for the kubernetes pool
+    (see HttpClients#client_classes): tornado's simple client, which it
+    uses, opens a connection for each request.
+    """
+
+    sizes = {}
+    """
+    The size of each pool, read from the config (see HttpClients#init).
+    """
+
+    default_size = 10
+
+    client_classes = {'kubernetes': SimpleAsyncHTTPClient}
+    """
+    The client class of the pools which can't use curl: requests to the
+    Kubernetes API pass ssl_options (the cluster's certificate is kept in
+    memory), which curl doesn't support.
+    """
+
+    clients = WeakKeyDictionary()
+    """
+    The clients which have been created, keyed by their IOLoop (like
+    tornado's AsyncHTTPClient) and then by their pool.
+    """
+
+    @classmethod
+    def init(cls, config):
+        for pool in ('services', 'synapse', 'kubernetes', 'hub', 'fetch'):
+            size = int(getattr(config, f'HTTP_POOL_{pool.upper()}') or 0)
+            if size > 0:
+                cls.sizes[pool] = size
+
+    @classmethod
+    def get(cls, pool: str) -> HttpClient:
+        clients = cls.clients.setdefault(IOLoop.current(), {})
+        client = clients.get(pool)
+        if client is None:
+            client = HttpClient(pool, cls.sizes.get(pool, cls.default_size),
+                                cls.client_classes.get(pool))
+            clients[pool] = client
+
+        return client
@@ -8,12 +8,28 @@ from tornado.httpclient import HTTPError
 class HttpUtils:
 
     @staticmethod
-    async def fetch_with_retry(tries, logger, url, http_client, kwargs):
+    async def fetch_with_retry(tries, logger, url, http_client, kwargs,
+                               deadline=None):
+        """
+        Fetches url, retrying when the network fails. If a deadline is given
+        (see asyncy.Deadline), each attempt times out when it expires, and
+        no attempt is made after that.
+        """
         kwargs['raise_error'] = False
         attempts = 0
         last_exception = None
         while attempts < tries:
             attempts = attempts + 1
+            if deadline is not None:
+                timeout = deadline.request_timeout(
+                    kwargs.get('request_timeout'))
+                if timeout is not None:
+                    if timeout <= 0:
+                        raise HTTPError(599, message=f'Deadline exceeded '
+                                                     f'calling {url}!') \
+                            from last_exception
+                    kwargs['request_timeout'] = timeout
+
             try:
                 res = await http_client.fetch(url, **kwargs)
                 if res.code == 599:  # Network connectivity issues.
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import ujson
+
+
+class Offload:
+    """
+    Runs CPU heavy work on large payloads (parsing and serialising JSON,
+    sorting long lists) off the event loop, so that a story processing
+    a large document doesn't hold up the stories of other apps.
+
+    Work is offloaded when OFFLOAD_EXECUTOR is 'process' or 'thread', and
+    it's big enough: documents to parse of at least OFFLOAD_MIN_BYTES, and
+    lists or dicts to serialise or sort with at least OFFLOAD_MIN_ITEMS
+    items (see Offload#items). Smaller work runs inline, since handing
+    it over costs more than doing it. Note that CPython's json and sort
+    hold the GIL, so only the 'process' executor lets the event loop run
+    while they do (at the cost of pickling the payload).
+    """
+
+    executors = {
+        'process': ProcessPoolExecutor,
+        'thread': ThreadPoolExecutor
+    }
+
+    pools = {}
+    """
+    The executors which have been started, keyed by their kind.
+    """
+
+    @classmethod
+    def executor(cls, config):
+        kind = config.OFFLOAD_EXECUTOR
+        if kind not in cls.executors:
+            return None
+
+        pool = cls.pools.get(kind)
+        if pool is None:
+            workers = int(config.OFFLOAD_WORKERS or 0) or None
+            pool = cls.executors[kind](max_workers=workers)
+            cls.pools[kind] = pool
+
+        return pool
+
+    @classmethod
+    def executor_for(cls, story, size: int, threshold: str):
+        """
+        :return: The executor to run work of the given size in, or None if
+        it should run inline (when size is below the setting named
+        threshold, or offloading is off)
+        """
+        if story is None:
+            return None
+
+        config = story.app.config
+        limit = int(getattr(config, threshold) or 0)
+        if 0 < limit <= size:
+            return cls.executor(config)
+
+        return None
+
+    @classmethod
+    async def run(cls, story, size: int, threshold: str, fn, *args):
+        """
+        Calls fn(*args), in the executor if size is at least the setting
+        named threshold.
+        """
+        executor = cls.executor_for(story, size, threshold)
+        if executor is not None:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(executor, fn, *args)
+
+        return fn(*args)
+
+    @staticmethod
+    def items(content):
+        """
+        A cheap estimate of the size of a list or dict: the number of it's
+        items, plus (for a dict) the number of items of the lists and dicts
+        in it, since documents are often a dict wrapping a large list.
+        """
+        if isinstance(content, list):
+            return len(content)
+
+        if not isinstance(content, dict):
+            return 0
+
+        count = len(content)
+        for value in content.values():
+            if isinstance(value, (list, dict)):
+                count += len(value)
+
+        return count
+
+    @classmethod
+    async def json_loads(cls, story, content, loads=json.loads):
+        size = len(content) if isinstance(content, (str, bytes)) else 0
+        return await cls.run(story, size, 'OFFLOAD_MIN_BYTES', loads, content)
+
+    @classmethod
+    async def ujson_loads(cls, story, content):
+        return await cls.json_loads(story, content, ujson.loads)
+
+    @classmethod
+    async def json_dumps(cls, story, content):
+        return await cls.run(story, cls.items(content), 'OFFLOAD_MIN_ITEMS',
+                             json.dumps, content)
+
+    @classmethod
+    async def sort(cls, story, items: list):
+        """
+        Sorts items in place. Offloaded sorts work on a copy (which is
+        sent to the executor), and inline sorts don't copy.
+        """
+        if cls.executor_for(story, len(items), 'OFFLOAD_MIN_ITEMS') is None:
+            items.sort()
+            return
+
+        items[:] = await cls.run(story, len(items), 'OFFLOAD_MIN_ITEMS',
+                                 sorted, items)
@@ -1,10 +1,62 @@
 # -*- coding: utf-8 -*-
+import operator
 import re
 from functools import reduce
 
+from ..Context import UNSET
+
+immutable_types = (str, bytes, int, float, bool, type(None),
+                   type(re.compile('')))
+"""
+The types of constants which can be shared by all executions.
+"""
+
+
+class Expression:
+    """
+    An argument node compiled by Resolver#compile. Calling
+    expression.resolve(data) returns the same value as
+    Resolver.resolve(expression.node, data).
+
+    Expressions are pickled as their node, and compiled again when they're
+    unpickled (see asyncy.StoryCache).
+    """
+    __slots__ = ('node', 'resolve', 'static', 'constant', 'value', 'slots')
+
+    def __init__(self, node, resolve, slots: dict = None):
+        self.node = node
+        self.resolve = resolve
+        self.slots = slots
+        self.static = getattr(resolve, 'static', False)
+        """
+        True if the expression doesn't depend on the data it's resolved
+        against (it may still resolve to a new list or dict each time).
+        """
+        self.constant = hasattr(resolve, 'value')
+        self.value = getattr(resolve, 'value', None)
+        """
+        The value of a constant expression, folded when the story
+        was compiled.
+        """
+
+    def __reduce__(self):
+        return Resolver.compile, (self.node, self.slots)
+
+    def __repr__(self):
+        return f'Expression({self.node})'
+
 
 class Resolver:
 
+    assertions = {
+        'equals': operator.eq,
+        'not_equal': operator.ne,
+        'greater': operator.gt,
+        'greater_equal': operator.ge,
+        'less': operator.lt,
+        'less_equal': operator.le
+    }
+
     @staticmethod
     def _walk(item, index):
         if isinstance(index, dict):
@@ -137,3 +189,261 @@ class Resolver:
         elif type(item) is list:
             return cls.list(item, data)
         return item
+
+    @classmethod
+    def compile(cls, item, slots: dict = None) -> Expression:
+        """
+        Compiles an argument node into an Expression, so that
+        the type of each object is dispatched on just once (when the story
+        is compiled), instead of every time it's resolved.
+
+        If slots (see CompiledStory#slots) are given, paths which start with
+        a slotted variable read it from Context#values directly.
+        """
+        return Expression(item, cls._compile(item, slots), slots)
+
+    @classmethod
+    def _compile(cls, item, slots=None):
+        if type(item) is dict:
+            return cls._compile_object(item, slots)
+        elif type(item) is list:
+            parts = [cls._compile(part, slots) for part in item]
+            if cls._all_constant(parts):
+                return cls._fold(lambda: ' '.join(
+                    [part.value for part in parts]), parts)
+
+            return cls._static(
+                lambda data: ' '.join([part(data) for part in parts]),
+                parts)
+        return cls._constant(item)
+
+    @staticmethod
+    def _constant(value):
+        """
+        Returns a closure which resolves to value. If value is immutable,
+        it's exposed as closure.value, so that it can be folded into other
+        constants.
+        """
+        def constant(data):
+            return value
+
+        constant.static = True
+        if isinstance(value, immutable_types):
+            constant.value = value
+
+        return constant
+
+    @staticmethod
+    def _static(resolve, parts):
+        """
+        Marks resolve as static (it doesn't depend on the data it's
+        resolved against) if all of it's parts are static.
+        """
+        resolve.static = all(
+            getattr(part, 'static', False) for part in parts)
+        return resolve
+
+    @staticmethod
+    def _all_constant(parts):
+        for part in parts:
+            if not hasattr(part, 'value'):
+                return False
+
+        return True
+
+    @classmethod
+    def _fold(cls, evaluate, parts):
+        """
+        Evaluates a node whose parts are all constant, when it's compiled.
+        If that fails, it's evaluated (and fails) when it's resolved.
+        """
+        try:
+            return cls._constant(evaluate())
+        except Exception:
+            return cls._static(lambda data: evaluate(), parts)
+
+    @classmethod
+    def _compile_object(cls, item, slots=None):
+        if not isinstance(item, dict):
+            return cls._constant(item)
+
+        try:
+            return cls._compile_object_type(item, slots)
+        except (AttributeError, AssertionError, KeyError, TypeError,
+                re.error):
+            # A malformed object. Resolve it the slow way, so that the
+            # error surfaces when the line is executed, like it always has.
+            return lambda data: cls.object(item, data)
+
+    @classmethod
+    def _compile_object_type(cls, item, slots=None):
+        object_type = item.get('$OBJECT')
+        if object_type == 'string':
+            return cls._compile_string(item, slots)
+        elif object_type == 'path':
+            return cls._compile_path(item['paths'], slots)
+        elif object_type == 'regexp':
+            return cls._constant(re.compile(item['regexp']))
+        elif object_type == 'value':
+            return cls._constant(item['value'])
+        elif object_type == 'dict':
+            items = [(cls._compile_object(k, slots),
+                      cls._compile_object(v, slots))
+                     for k, v in item['items']]
+            return cls._compile_items(items)
+        elif object_type == 'list':
+            items = [cls._compile(i, slots) for i in item['items']]
+            if cls._all_constant(items):
+                # Lists are mutable, so a new one is built each time.
+                template = tuple(i.value for i in items)
+                return cls._static(lambda data: list(template), items)
+
+            return cls._static(lambda data: [i(data) for i in items], items)
+        elif object_type == 'assertion':
+            return cls._compile_assertion(item, slots)
+
+        items = [(cls._constant(key), cls._compile(value, slots))
+                 for key, value in item.items()]
+        return cls._compile_items(items)
+
+    @classmethod
+    def _compile_string(cls, item, slots=None):
+        string = item['string']
+        if not item.get('values'):
+            return cls._constant(string)
+
+        values = [cls._compile(value, slots) for value in item['values']]
+        if cls._all_constant(values):
+            return cls._fold(lambda: string.format(
+                *[value.value for value in values]), values)
+
+        return cls._static(lambda data: string.format(
+            *[value(data) for value in values]), values)
+
+    @classmethod
+    def _compile_items(cls, items):
+        """
+        Compiles the (key, value) items of a dictionary.
+        """
+        parts = [part for pair in items for part in pair]
+        if cls._all_constant(parts):
+            # Dictionaries are mutable, so a new one is built each time.
+            template = tuple((k.value, v.value) for k, v in items)
+            return cls._static(lambda data: dict(template), parts)
+
+        return cls._static(
+            lambda data: {k(data): v(data) for k, v in items}, parts)
+
+    @classmethod
+    def _compile_assertion(cls, item, slots=None):
+        op = cls.assertions[item['assertion']]
+        values = item['values']
+        assert len(values) == 2, \
+            f'Only simple assertions are supported. Found {len(values)}'
+
+        left = cls._compile(values[0], slots)
+        right = cls._compile(values[1], slots)
+        if cls._all_constant((left, right)):
+            return cls._fold(lambda: op(left.value, right.value),
+                             (left, right))
+
+        return cls._static(lambda data: op(left(data), right(data)),
+                           (left, right))
+
+    @classmethod
+    def _compile_path(cls, paths, slots=None):
+        """
+        Compiles a path. Path segments which are digits are converted to
+        list indexes here, instead of on every walk.
+        """
+        walk = cls._compile_keys(paths)
+        if slots and paths and isinstance(paths[0], str) \
+                and paths[0] in slots:
+            return cls._slot_path(slots, paths[0],
+                                  cls._compile_keys(paths[1:]), walk)
+
+        return walk
+
+    @classmethod
+    def _compile_keys(cls, paths):
+        keys = []
+        dynamic = False
+        for index in paths:
+            if isinstance(index, dict):
+                # Resolved against the item being walked, which is not a
+                # Context, so this is never compiled with slots.
+                keys.append(cls._compile_object(index))
+                dynamic = True
+            elif index.isdigit():
+                keys.append(int(index))
+            else:
+                keys.append(index)
+
+        if dynamic:
+            return cls._dynamic_path(keys)
+        return cls._static_path(tuple(keys))
+
+    @staticmethod
+    def _slot_path(slots, name, walk_rest, walk):
+        """
+        Reads the variable name from it's slot, and walks the rest of the
+        path from there. If data is not a Context with these slots, or the
+        variable is not set, the path is walked by name.
+        """
+        slot = slots[name]
+
+        def walk_slot(data):
+            try:
+                value = data.values[slot] if data.slots is slots else UNSET
+            except AttributeError:
+                value = UNSET
+
+            if value is UNSET:
+                return walk(data)
+            return walk_rest(value)
+
+        return walk_slot
+
+    @staticmethod
+    def _static_path(keys):
+        if len(keys) == 1:
+            key = keys[0]
+
+            def walk_one(data):
+                try:
+                    return data[key]
+                except (KeyError, TypeError):
+                    return None
+
+            return walk_one
+
+        def walk(data):
+            try:
+                for key in keys:
+                    data = data[key]
+                return data
+            except (KeyError, TypeError):
+                return None
+
+        return walk
+
+    @staticmethod
+    def _dynamic_path(keys):
+        """
+        Path segments which are objects are resolved against the item
+        being walked (see Resolver#_walk).
+        """
+        keys = tuple((key, callable(key)) for key in keys)
+
+        def walk(data):
+            try:
+                for key, is_object in keys:
+                    if is_object:
+                        data = data[key(data)]
+                    else:
+                        data = data[key]
+                return data
+            except (KeyError, TypeError):
+                return None
+
+        return walk
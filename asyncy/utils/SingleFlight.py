@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+
+class SingleFlight:
+    """
+    Coalesces identical calls which are in flight at the same time: the
+    first call runs, and the calls with the same key made before it
+    completes await it's result (or exception) instead of running again.
+
+    Callers share the result, so it should be immutable (an HTTP response,
+    rather than the document parsed from it's body). A caller which is
+    cancelled doesn't cancel the call for the others.
+    """
+
+    calls = {}
+    """
+    The calls in flight, keyed by their key.
+    """
+
+    @classmethod
+    async def run(cls, key, fn, *args, **kwargs):
+        call = cls.calls.get(key)
+        if call is None:
+            call = asyncio.ensure_future(fn(*args, **kwargs))
+            cls.calls[key] = call
+            call.add_done_callback(lambda _: cls.calls.pop(key, None))
+
+        return await asyncio.shield(call)
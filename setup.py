@@ -38,6 +38,7 @@ setup(
         'storyscript==0.8.3',
         'ujson==1.35',
         'certifi>=2018.8.24',
+        'pycurl==7.43.0.2',
         'psycopg2==2.7.5',
         'google-cloud-logging==1.9.0'
     ],
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from unittest.mock import MagicMock
 
+from asyncy.Compiler import Compiler
 from asyncy.constants.LineConstants import LineConstants
 from asyncy.constants.ServiceConstants import ServiceConstants
 
@@ -61,6 +62,28 @@ def patch(mocker, patch_init, patch_many):
     return mocker.patch
 
 
+@fixture
+def compile_story():
+    """
+    Compiles a raw story tree into an asyncy.Compiler.CompiledStory.
+    """
+    def compile_story(tree, entrypoint=None):
+        story = {'tree': tree, 'entrypoint': entrypoint}
+        return Compiler.compile('hello.story', story)
+    return compile_story
+
+
+@fixture
+def compile_tree(compile_story):
+    """
+    Compiles a raw story tree, and returns the compiled lines
+    keyed by their line number.
+    """
+    def compile_tree(tree):
+        return compile_story(tree).tree
+    return compile_tree
+
+
 @fixture
 def echo_line():
     return {
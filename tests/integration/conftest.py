@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+from asyncy.Compiler import Compiler
 from asyncy.Config import Config
 from asyncy.Logger import Logger
 from asyncy.Stories import Stories
@@ -31,7 +32,8 @@ def story(app, logger):
     asset_dir = examples.__path__[0]
 
     with open(asset_dir + '/stories.json', 'r') as file:
-        app.stories = ujson.loads(file.read())['stories']
+        app.stories = Compiler.compile_all(
+            ujson.loads(file.read())['stories'])
 
     return Stories(app, 'hello.story', logger)
 
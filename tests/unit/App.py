@@ -3,16 +3,20 @@ import json
 from unittest import mock
 
 from asyncy.App import App
+from asyncy.Compiler import Compiler
+from asyncy.Config import Config
 from asyncy.Kubernetes import Kubernetes
+from asyncy.StoryCache import StoryCache
 from asyncy.Types import StreamingService
 from asyncy.constants.ServiceConstants import ServiceConstants
 from asyncy.processing import Story
+from asyncy.utils.HttpClients import HttpClients
 from asyncy.utils.HttpUtils import HttpUtils
 
 import pytest
 from pytest import fixture, mark
 
-from tornado.httpclient import AsyncHTTPClient, HTTPRequest, HTTPResponse
+from tornado.httpclient import HTTPRequest, HTTPResponse
 
 
 @fixture
@@ -90,9 +94,7 @@ async def test_unsubscribe_all(patch, app, async_mock, magic, response_code):
     patch.object(HttpUtils, 'fetch_with_retry',
                  new=async_mock(return_value=res))
 
-    patch.init(AsyncHTTPClient)
-
-    client = AsyncHTTPClient()
+    client = HttpClients.get('services')
 
     await app.unsubscribe_all()
 
@@ -113,7 +115,8 @@ async def test_unsubscribe_all(patch, app, async_mock, magic, response_code):
 
 
 @mark.parametrize('env', [{'env': True}, None, {'a': {'nested': '1'}}])
-def test_app_init(magic, config, logger, env):
+def test_app_init(patch, magic, config, logger, env):
+    patch.object(Compiler, 'compile_all')
     services = magic()
     stories = magic()
     expected_secrets = {}
@@ -128,13 +131,165 @@ def test_app_init(magic, config, logger, env):
     assert app.app_dns == 'app_dns'
     assert app.config == config
     assert app.logger == logger
-    assert app.stories == stories['stories']
+    cache = Compiler.compile_all.call_args[0][1]
+    Compiler.compile_all.assert_called_with(stories['stories'], cache)
+    assert isinstance(cache, StoryCache)
+    assert app.stories == Compiler.compile_all()
+    assert app.prepared_requests == {}
+    assert app.dispatch_plans == {}
+    assert app.containers == {}
+    assert app.executions == 0
+    assert app.hibernated is None
     assert app.services == services
     assert app.environment == env
     assert app.app_context['secrets'] == expected_secrets
+    assert app.app_layer == {'app': app.app_context}
+    assert app.story_invocations == {}
+    assert app.generated_stories == {}
     assert app.entrypoint == stories['entrypoint']
 
 
+@mark.parametrize('env', [{'STORY_YIELD_LINES': '10'}, None])
+def test_app_init_yield(patch, magic, logger, env):
+    patch.object(Compiler, 'compile_all')
+    config = Config()
+    config.STORY_YIELD_MICROSECONDS = 500
+    app = App('app_id', 'app_dns', 1, config, logger, magic(), magic(), env)
+    assert app.yield_lines == 1000
+    assert app.yield_interval == 0.0005
+    assert app.tunable('STORY_YIELD_MICROSECONDS') == 500
+    assert app.story_timeout is None
+    assert app.story_max_lines is None
+    assert app.loop_concurrency == 1
+    assert app.codegen_threshold == 50
+    assert app.function_memo_scope == 'off'
+    assert app.function_memo_size == 1024
+    assert app.function_memo == {}
+    assert app.response_cache_size == 1024
+    assert app.responses == {}
+    assert app.trace is None
+
+
+def test_app_init_budget(patch, magic, logger):
+    patch.object(Compiler, 'compile_all')
+    config = Config()
+    config.STORY_TIMEOUT_SECONDS = '2.5'
+    config.STORY_MAX_LINES = 100
+    env = {'STORY_TIMEOUT_SECONDS': '0', 'STORY_MAX_LINES': '-1'}
+    app = App('app_id', 'app_dns', 1, config, logger, magic(), magic(), env)
+    assert app.story_timeout == 2.5
+    assert app.story_max_lines == 100
+
+
+def test_app_init_trace(patch, magic, logger):
+    patch.object(Compiler, 'compile_all')
+    config = Config()
+    config.STORY_TRACE_SAMPLE_RATE = '0.25'
+    app = App('app_id', 'app_dns', 1, config, logger, magic(), magic(), {})
+    assert app.trace.size == 4096
+    assert app.trace.sample_rate == 0.25
+
+
+@mark.parametrize('setting,kind,expected', [
+    ('12', int, 12),
+    (None, int, 0),
+    ('-5', int, 0),
+    ('lots', int, 1000),
+    ('1.5', int, 1000),
+    ('nan', float, 1000.0),
+    ('inf', float, 1000.0)
+])
+def test_app_tunable(patch, magic, logger, setting, kind, expected):
+    patch.object(Compiler, 'compile_all')
+    app = App('app_id', 'app_dns', 1, Config(), logger, magic(), magic(), {})
+    app.config.STORY_YIELD_LINES = setting
+    assert app.tunable('STORY_YIELD_LINES', kind) == expected
+    assert (logger.warn.call_count == 1) is (expected == 1000)
+
+
+@mark.parametrize('setting,expected,warns', [
+    ({'app_id': {'STORY_YIELD_LINES': '10'}}, 10, False),
+    ({'other_app': {'STORY_YIELD_LINES': 10}}, 1000, False),
+    ({'app_id': 10}, 1000, True),
+    ([], 1000, True),
+    ('{', 1000, True)
+])
+def test_app_tunables(patch, magic, logger, setting, expected, warns):
+    patch.object(Compiler, 'compile_all')
+    config = Config()
+    config.STORY_APP_TUNABLES = setting if isinstance(setting, str) \
+        else json.dumps(setting)
+    # The environment of an app is written by it's developers.
+    env = {'STORY_YIELD_LINES': '20'}
+    app = App('app_id', 'app_dns', 1, config, logger, magic(), magic(), env)
+    assert app.yield_lines == expected
+    assert app.yield_interval == 0.002
+    assert logger.warn.called is warns
+
+
+@fixture
+def idle_app(patch, magic, logger):
+    StoryCache.compiled.clear()
+    config = Config()
+    config.APP_IDLE_TTL_SECONDS = '60'
+    stories = {'stories': {'a.story': {'entrypoint': '1', 'tree': {
+        '1': {'ln': '1', 'method': 'set', 'name': ['a'], 'args': [1]}
+    }}}, 'entrypoint': ['a.story']}
+    app = App('app_id', 'app_dns', 1, config, logger, stories, magic(), {})
+    yield app
+    StoryCache.compiled.clear()
+
+
+def test_app_activate(idle_app):
+    assert idle_app.idle_ttl == 60
+    idle_app.last_active = 0
+    idle_app.activate()
+    assert idle_app.executions == 1
+    assert idle_app.last_active > 0
+    assert idle_app.is_idle(idle_app.last_active + 60) is False
+    idle_app.deactivate()
+    assert idle_app.executions == 0
+    assert idle_app.is_idle(idle_app.last_active + 60) is True
+    assert idle_app.is_idle(idle_app.last_active + 59) is False
+
+
+def test_app_is_idle_disabled(idle_app):
+    idle_app.idle_ttl = None
+    assert idle_app.is_idle(idle_app.last_active + 3600) is False
+
+
+def test_app_hibernate_wake(patch, idle_app):
+    compiled = idle_app.stories['a.story']
+    idle_app.generated_stories = {'a.story': None}
+    idle_app.function_memo['call'] = True
+    idle_app.hibernate()
+    assert idle_app.stories is None
+    assert idle_app.hibernated is not None
+    assert idle_app.generated_stories == {}
+    assert idle_app.dispatch_plans == {}
+    assert idle_app.function_memo == {}
+    assert idle_app.responses == {}
+    assert idle_app.is_idle(idle_app.last_active + 3600) is False
+
+    assert StoryCache.compiled == {}
+
+    idle_app.activate()
+    assert idle_app.hibernated is None
+    assert idle_app.executions == 1
+    assert idle_app.stories['a.story'] is not compiled
+    assert idle_app.stories['a.story'].tree['1'].raw \
+        == compiled.tree['1'].raw
+
+
+def test_app_wake_compiles(patch, idle_app):
+    raw = idle_app.stories['a.story'].tree['1'].raw
+    idle_app.hibernate()
+    idle_app.wake()
+    line = idle_app.stories['a.story'].tree['1']
+    assert line.raw == raw
+    assert idle_app.stories['a.story'].entrypoint == '1'
+
+
 @mark.asyncio
 async def test_app_bootstrap(patch, app, async_mock):
     patch.object(app, 'run_stories', new=async_mock())
@@ -209,7 +364,8 @@ async def test_clear_subscriptions_synapse(patch, app, async_mock,
 
     ret = await app.clear_subscriptions_synapse()
     HttpUtils.fetch_with_retry.mock.assert_called_with(
-        3, app.logger, expected_url, AsyncHTTPClient(), expected_kwargs)
+        3, app.logger, expected_url, HttpClients.get('synapse'),
+        expected_kwargs)
 
     if status_code == 200:
         assert ret is True
@@ -227,8 +383,10 @@ async def test_app_destroy(patch, app, async_mock):
     patch.object(Kubernetes, 'clean_namespace', new=async_mock())
     patch.object(app, 'unsubscribe_all', new=async_mock())
     patch.object(app, 'clear_subscriptions_synapse', new=async_mock())
+    app.containers['asyncy-alpine'] = 'hostname'
     await app.destroy()
 
     app.unsubscribe_all.mock.assert_called()
     app.clear_subscriptions_synapse.mock.assert_called()
     Kubernetes.clean_namespace.mock.assert_called()
+    assert app.containers == {}
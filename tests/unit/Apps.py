@@ -19,6 +19,8 @@ import psycopg2
 import pytest
 from pytest import fixture, mark
 
+from tornado.ioloop import PeriodicCallback
+
 
 @fixture
 def exc():
@@ -101,6 +103,9 @@ async def test_init_all(patch, magic, async_mock, config, logger, db):
     patch.object(Sentry, 'init')
     patch.init(Thread)
     patch.object(Thread, 'start')
+    patch.init(PeriodicCallback)
+    patch.object(PeriodicCallback, 'start')
+    config.APP_IDLE_TTL_SECONDS = '30'
 
     releases = [
         ['my_app_uuid']
@@ -120,6 +125,8 @@ async def test_init_all(patch, magic, async_mock, config, logger, db):
                                        args=[config, logger, loop],
                                        daemon=True)
     Thread.start.assert_called()
+    PeriodicCallback.__init__.assert_called_with(Apps.hibernate_idle, 30000)
+    PeriodicCallback.start.assert_called()
 
 
 def test_get(magic):
@@ -128,6 +135,15 @@ def test_get(magic):
     assert Apps.get('app_id') == app
 
 
+@mark.parametrize('idle', [True, False])
+def test_hibernate_idle(patch, magic, idle):
+    app = magic()
+    app.is_idle.return_value = idle
+    patch.object(Apps, 'apps', {'app_id': app, 'destroyed': None})
+    Apps.hibernate_idle()
+    assert app.hibernate.called is idle
+
+
 @mark.asyncio
 async def test_reload_app_ongoing_deployment(config, logger, patch):
     app_id = 'my_app'
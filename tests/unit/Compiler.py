@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+from asyncy.Compiler import CompiledStory, Compiler, Line, Node
+from asyncy.Context import Context
+from asyncy.utils.Resolver import Expression
+
+from pytest import fixture, mark
+
+
+@fixture
+def raw_story():
+    return {
+        'entrypoint': '1',
+        'tree': {
+            '1': {'ln': '1', 'method': 'if', 'enter': '2', 'next': '2',
+                  'exit': '3'},
+            '2': {'ln': '2', 'method': 'set', 'parent': '1', 'next': '3'},
+            '3': {'ln': '3', 'method': 'foo'}
+        }
+    }
+
+
+def test_compiler_compile(patch, magic, raw_story):
+    handler = magic()
+    patch.dict(Compiler.handlers, {'if': handler})
+    story = Compiler.compile('hello.story', raw_story)
+
+    assert isinstance(story, CompiledStory)
+    assert story.name == 'hello.story'
+    assert story.entrypoint == '1'
+    assert [line.id for line in story.lines] == [0, 1, 2]
+
+    first = story.tree['1']
+    second = story.tree['2']
+    third = story.tree['3']
+    assert first.handler == handler
+    assert first.method == 'if'
+    assert first.enter is second
+    assert first.next is second
+    assert first.exit is third
+    assert first.parent is None
+    assert second.parent is first
+    assert second.next is third
+    assert third.next is None
+    assert third.handler is None
+
+
+def test_compiler_compile_functions():
+    story = Compiler.compile('hello.story', {
+        'entrypoint': '1',
+        'tree': {
+            '1': {'ln': '1', 'method': 'function', 'function': 'greet',
+                  'enter': '2', 'next': '2',
+                  'args': [
+                      {'$OBJECT': 'argument', 'name': 'name',
+                       'argument': {'$OBJECT': 'type', 'type': 'string'}},
+                      {'$OBJECT': 'argument', 'name': 'greeting',
+                       'argument': {'$OBJECT': 'type', 'type': 'string'}}
+                  ]},
+            '2': {'ln': '2', 'method': 'set', 'parent': '1', 'next': '3'},
+            '3': {'ln': '3', 'method': 'call', 'function': 'greet',
+                  'next': '4',
+                  'args': [
+                      {'$OBJECT': 'argument', 'name': 'name',
+                       'argument': {'$OBJECT': 'string', 'string': 'a'}}
+                  ]},
+            '4': {'ln': '4', 'method': 'call', 'function': 'unknown'}
+        }
+    })
+
+    function_line = story.tree['1']
+    assert story.functions == {'greet': function_line}
+    assert function_line.function is function_line
+    assert function_line.call_args == ()
+
+    call = story.tree['3']
+    assert call.function is function_line
+    assert [name for name, argument in call.call_args] == [
+        'name', 'greeting'
+    ]
+    assert call.call_args[0][1].node == {'$OBJECT': 'string', 'string': 'a'}
+    assert call.call_args[1][1] is None
+
+    assert story.tree['4'].function is None
+
+
+def test_compiler_compile_blocks():
+    story = Compiler.compile('hello.story', {
+        'entrypoint': '1',
+        'tree': {
+            '1': {'ln': '1', 'enter': '2', 'next': '2'},
+            '2': {'ln': '2', 'parent': '1', 'enter': '3', 'next': '3'},
+            '3': {'ln': '3', 'parent': '2', 'next': '4'},
+            '4': {'ln': '4', 'parent': '1', 'next': '5'},
+            '5': {'ln': '5'}
+        }
+    })
+    tree = story.tree
+
+    assert tree['1'].block_exit is tree['5']
+    assert tree['2'].block_exit is tree['4']
+    assert tree['3'].block_exit is tree['4']
+    assert tree['4'].block_exit is tree['5']
+    assert tree['5'].block_exit is None
+
+    assert [(tree[ln].pre, tree[ln].post) for ln in '12345'] == [
+        (1, 8), (2, 5), (3, 4), (6, 7), (9, 10)
+    ]
+    assert Compiler.has_parent(tree['1'], tree['3']) is True
+    assert Compiler.has_parent(tree['2'], tree['4']) is False
+    assert Compiler.has_parent(tree['3'], tree['3']) is False
+
+
+def test_compiler_compile_args():
+    story = Compiler.compile('hello.story', {
+        'entrypoint': '1',
+        'tree': {
+            '1': {'ln': '1', 'method': 'set', 'args': [
+                {'$OBJECT': 'path', 'paths': ['a']},
+                {'$OBJECT': 'mutation', 'mutation': 'replace', 'args': [
+                    {'$OBJECT': 'argument', 'name': 'with',
+                     'argument': {'$OBJECT': 'string', 'string': 'b'}}
+                ]},
+                {'$OBJECT': 'argument', 'name': 'foo', 'argument': 'bar'},
+                {'$OBJECT': 'argument', 'name': 'foo', 'argument': 'baz'}
+            ]},
+            '2': {'ln': '2'}
+        }
+    })
+
+    line = story.tree['1']
+    assert len(line.args) == 4
+    assert isinstance(line.args[0], Expression)
+    assert line.args[0].resolve({'a': 'value'}) == 'value'
+
+    mutation = line.args[1]
+    assert isinstance(mutation, Node)
+    assert mutation['mutation'] == 'replace'
+    assert mutation.arguments['with'].resolve({}) == 'b'
+
+    assert list(line.arguments.keys()) == ['foo']
+    assert line.arguments['foo'].resolve({}) == 'bar'
+    assert story.tree['2'].args == ()
+    assert story.tree['2'].arguments == {}
+
+
+def test_compiler_compile_slots():
+    story = Compiler.compile('hello.story', {
+        'entrypoint': '1',
+        'tree': {
+            '1': {'ln': '1', 'method': 'set', 'name': ['a'], 'args': [1]},
+            '2': {'ln': '2', 'method': 'set', 'name': ['b', 'c'],
+                  'args': [{'$OBJECT': 'path', 'paths': ['a']}]},
+            '3': {'ln': '3', 'method': 'for', 'output': ['item'],
+                  'args': [{'$OBJECT': 'path', 'paths': ['b']}]},
+            '4': {'ln': '4', 'method': 'set', 'name': ['a'], 'args': [2]},
+            '5': {'ln': '5', 'method': 'function', 'function': 'f',
+                  'args': [{'$OBJECT': 'argument', 'name': 'x',
+                            'argument': {'$OBJECT': 'type'}}]}
+        }
+    })
+    tree = story.tree
+
+    assert story.slots == {'a': 0, 'item': 1, 'x': 2}
+    assert [tree[ln].slot for ln in '12345'] == [0, None, 1, 0, None]
+
+    context = Context({'b': 'by name'}, slots=story.slots)
+    context['a'] = 'slotted'
+    assert context.values[0] == 'slotted'
+    assert tree['2'].args[0].resolve(context) == 'slotted'
+    assert tree['3'].args[0].resolve(context) == 'by name'
+
+
+def test_compiler_compile_static():
+    tree = Compiler.compile('hello.story', {
+        'entrypoint': '1',
+        'tree': {
+            '1': {'ln': '1', 'args': [
+                {'$OBJECT': 'argument', 'name': 'a',
+                 'argument': {'$OBJECT': 'list', 'items': [1, 2]}}
+            ]},
+            '2': {'ln': '2', 'args': [
+                {'$OBJECT': 'argument', 'name': 'a',
+                 'argument': {'$OBJECT': 'path', 'paths': ['b']}}
+            ]},
+            '3': {'ln': '3', 'args': [
+                'value',
+                {'$OBJECT': 'mutation', 'mutation': 'replace', 'args': [
+                    {'$OBJECT': 'argument', 'name': 'with',
+                     'argument': {'$OBJECT': 'path', 'paths': ['b']}}
+                ]}
+            ]},
+            '4': {'ln': '4'}
+        }
+    }).tree
+
+    assert [tree[ln].static for ln in '1234'] == [True, False, False, True]
+
+
+def test_compiler_compile_groups():
+    def execute(ln, service, name=None, args=(), **raw):
+        raw.update({'ln': ln, 'method': 'execute', 'service': service,
+                    'command': 'run', 'args': list(args),
+                    'next': str(int(ln) + 1)})
+        if name is not None:
+            raw['name'] = [name]
+        return raw
+
+    def path(name):
+        return {'$OBJECT': 'argument', 'name': 'x',
+                'argument': {'$OBJECT': 'path', 'paths': [name]}}
+
+    tree = Compiler.compile('hello.story', {
+        'entrypoint': '1',
+        'tree': {
+            '1': execute('1', 'a', name='x'),
+            '2': execute('2', 'b', name='y', args=[path('z')]),
+            '3': execute('3', 'c', args=[path('x')]),
+            '4': execute('4', 'd'),
+            '5': execute('5', 'd'),
+            '6': execute('6', 'e', name='y'),
+            '7': execute('7', 'x'),
+            '8': execute('8', 'f'),
+            '9': {'ln': '9', 'method': 'set', 'name': ['z'], 'args': [1]}
+        }
+    }).tree
+
+    assert tree['1'].group == (tree['1'], tree['2'])
+    assert tree['3'].group == (tree['3'], tree['4'])
+    assert tree['5'].group == (tree['5'], tree['6'])
+    # Line 7 calls a service which is a variable.
+    assert [tree[ln].group for ln in '24789'] == [None] * 5
+
+
+def test_compiler_compile_parallel():
+    def loop(*body):
+        tree = {'1': {'ln': '1', 'method': 'for', 'output': ['i'],
+                      'enter': '2', 'next': '2',
+                      'args': [{'$OBJECT': 'path', 'paths': ['items']}]}}
+        for i, line in enumerate(body, 2):
+            line.setdefault('parent', '1')
+            line.update({'ln': str(i), 'next': str(i + 1)})
+            tree[str(i)] = line
+        tree[str(len(body) + 2)] = {'ln': str(len(body) + 2)}
+        return Compiler.compile('hello.story', {'entrypoint': '1',
+                                                'tree': tree}).tree['1']
+
+    def set_line(name, *reads, **raw):
+        raw.update({'method': 'set', 'name': name, 'args': [
+            {'$OBJECT': 'path', 'paths': [read]} for read in reads]})
+        return raw
+
+    assert loop(set_line(['a'], 'i'), set_line(['b'], 'a')).parallel
+    assert loop(set_line(['a'], 'outside')).parallel
+    # Reads what the previous iteration wrote.
+    assert not loop(set_line(['b'], 'a'), set_line(['a'], 'i')).parallel
+    assert not loop(set_line(['total'], 'total', 'i')).parallel
+    # Only written inside an if, which isn't always executed.
+    assert not loop(
+        {'method': 'if', 'enter': '3', 'args': [True]},
+        set_line(['a'], 'i', parent='2'),
+        set_line(['b'], 'a')).parallel
+    assert not loop(set_line(['a', 'b'], 'i')).parallel
+    assert not loop({'method': 'set', 'name': ['a'], 'args': [
+        'value', {'$OBJECT': 'mutation', 'mutation': 'append', 'args': []}
+    ]}).parallel
+    assert not loop({'method': 'when', 'service': 'client'}).parallel
+    assert not loop().parallel
+    assert loop({'method': 'execute', 'service': 'alpine',
+                 'command': 'echo', 'args': []}).parallel
+    # The service is a variable.
+    assert not loop({'method': 'execute', 'service': 'i',
+                     'command': 'write', 'args': []}).parallel
+
+
+def test_compiler_compile_parallel_event_connection():
+    """
+    Writes to an event's connection must stay in order.
+    """
+    tree = Compiler.compile('hello.story', {'entrypoint': '1', 'tree': {
+        '1': {'ln': '1', 'method': 'execute', 'service': 'http',
+              'command': 'server', 'enter': '2', 'output': ['server']},
+        '2': {'ln': '2', 'method': 'when', 'service': 'server',
+              'command': 'listen', 'parent': '1', 'enter': '3',
+              'output': ['req']},
+        '3': {'ln': '3', 'method': 'for', 'parent': '2', 'enter': '4',
+              'output': ['x'], 'args': [[1, 2, 3]]},
+        '4': {'ln': '4', 'method': 'execute', 'service': 'req',
+              'command': 'write', 'parent': '3', 'args': [
+                  {'$OBJECT': 'argument', 'name': 'content',
+                   'argument': {'$OBJECT': 'path', 'paths': ['x']}}
+              ]}
+    }}).tree
+    assert tree['3'].parallel is False
+
+
+def test_compiler_compile_purity():
+    def function(ln, name, *body):
+        tree = {ln: {'ln': ln, 'method': 'function', 'function': name,
+                     'enter': body[0]['ln'] if body else None}}
+        for line in body:
+            line['parent'] = ln
+            tree[line['ln']] = line
+        return tree
+
+    tree = {}
+    tree.update(function('1', 'pure',
+                         {'ln': '2', 'method': 'set', 'name': ['a']},
+                         {'ln': '3', 'method': 'if', 'enter': '4'},
+                         {'ln': '4', 'method': 'call', 'function': 'empty',
+                          'parent': '3'}))
+    tree['4']['parent'] = '3'
+    tree.update(function('5', 'empty'))
+    tree.update(function('6', 'service',
+                         {'ln': '7', 'method': 'execute', 'service': 'a'}))
+    tree.update(function('8', 'calls_service',
+                         {'ln': '9', 'method': 'call',
+                          'function': 'service'}))
+    tree.update(function('10', 'recursive',
+                         {'ln': '11', 'method': 'call',
+                          'function': 'recursive'}))
+    tree.update(function('12', 'unknown',
+                         {'ln': '13', 'method': 'call', 'function': 'foo'}))
+    tree['14'] = {'ln': '14', 'method': 'set'}
+    tree = Compiler.compile('hello.story', {'entrypoint': '1',
+                                            'tree': tree}).tree
+
+    assert [tree[ln].pure for ln in ('1', '5', '6', '8', '10', '12')] == [
+        True, True, False, False, True, False
+    ]
+    assert tree['14'].pure is False
+
+
+def test_compiler_compile_all(patch, raw_story):
+    patch.object(Compiler, 'compile')
+    compiled = Compiler.compile_all({'a': raw_story})
+    Compiler.compile.assert_called_with('a', raw_story)
+    assert compiled == {'a': Compiler.compile.return_value}
+
+
+@mark.parametrize('cached', [True, False])
+def test_compiler_compile_all_cache(patch, magic, raw_story, cached):
+    patch.object(Compiler, 'compile')
+    cache = magic()
+    if not cached:
+        cache.get.return_value = None
+
+    compiled = Compiler.compile_all({'a': raw_story}, cache)
+    cache.key.assert_called_with('a', raw_story)
+    cache.get.assert_called_with(cache.key())
+    if cached:
+        Compiler.compile.assert_not_called()
+        assert compiled == {'a': cache.get()}
+    else:
+        Compiler.compile.assert_called_with('a', raw_story)
+        cache.put.assert_called_with(cache.key(), Compiler.compile())
+        assert compiled == {'a': Compiler.compile()}
+
+
+def test_line_item_access():
+    raw = {'ln': '1', 'method': 'execute', 'service': 'alpine'}
+    line = Line(0, raw)
+    assert line['service'] == 'alpine'
+    assert line.get('service') == 'alpine'
+    assert line.get('output') is None
+    assert line.get('output', 'foo') == 'foo'
+    assert 'service' in line
+    assert 'output' not in line
+    assert line.ln == '1'
+    assert line.raw is raw
@@ -24,6 +24,32 @@ def test_config():
     assert Config.defaults['ASYNCY_SYNAPSE_HOST'] == 'synapse'
     assert Config.defaults['ASYNCY_SYNAPSE_PORT'] == 80
     assert Config.defaults['ASYNCY_HTTP_GW_HOST'] == 'gateway'
+    assert Config.defaults['STORY_CODEGEN'] == 'off'
+    assert Config.defaults['STORY_CODEGEN_THRESHOLD'] == 50
+    assert Config.defaults['STORY_LOOP_CONCURRENCY'] == 1
+    assert Config.defaults['STORY_YIELD_LINES'] == 1000
+    assert Config.defaults['STORY_YIELD_MICROSECONDS'] == 2000
+    assert Config.defaults['STORY_APP_TUNABLES'] is None
+    assert Config.defaults['STORY_TIMEOUT_SECONDS'] == 0
+    assert Config.defaults['STORY_MAX_LINES'] == 0
+    assert Config.defaults['STORY_FUNCTION_MEMO'] == 'off'
+    assert Config.defaults['STORY_FUNCTION_MEMO_SIZE'] == 1024
+    assert Config.defaults['STORY_TRACE_SIZE'] == 4096
+    assert Config.defaults['STORY_TRACE_SAMPLE_RATE'] == 0
+    assert Config.defaults['STORY_CACHE_SIZE'] == 1024
+    assert Config.defaults['STORY_CACHE_DIR'] is None
+    assert Config.defaults['APP_IDLE_TTL_SECONDS'] == 0
+    assert Config.defaults['OFFLOAD_EXECUTOR'] == 'off'
+    assert Config.defaults['OFFLOAD_WORKERS'] == 2
+    assert Config.defaults['OFFLOAD_MIN_BYTES'] == 1048576
+    assert Config.defaults['OFFLOAD_MIN_ITEMS'] == 100000
+    assert Config.defaults['HTTP_POOL_SERVICES'] == 64
+    assert Config.defaults['HTTP_POOL_SYNAPSE'] == 16
+    assert Config.defaults['HTTP_POOL_KUBERNETES'] == 16
+    assert Config.defaults['HTTP_POOL_HUB'] == 4
+    assert Config.defaults['HTTP_POOL_FETCH'] == 32
+    assert Config.defaults['SERVICE_CACHE_SIZE'] == 1024
+    assert Config.defaults['HTTP_STREAM_BUFFER_BYTES'] == 8388608
 
 
 def test_config_init(patch):
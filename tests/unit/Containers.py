@@ -179,6 +179,19 @@ async def test_start_no_command(patch, story, async_mock, run_command):
         story, line, 'alpine', 'asyncy-alpine',
         run_command or ['tail', '-f', '/dev/null'], None,
         {'alpine_only': True, 'global': 'yes'})
+    assert story.app.containers == {
+        'asyncy-alpine': Kubernetes.get_hostname(story, line, 'asyncy-alpine')
+    }
+
+    ss = await Containers.start(story, line)
+    assert Kubernetes.create_pod.mock.call_count == 1
+    assert ss.container_name == 'asyncy-alpine'
+    assert ss.hostname == story.app.containers['asyncy-alpine']
+
+    Containers.forget(story.app, 'asyncy-alpine')
+    assert story.app.containers == {}
+    await Containers.start(story, line)
+    assert Kubernetes.create_pod.mock.call_count == 2
 
 
 def test_format_command_no_format(logger, app, echo_service, echo_line):
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+from types import MappingProxyType
+
+from asyncy.Context import Context, ReadOnlyDict, UNSET, read_only
+from asyncy.utils import Dict, Resolver
+
+from pytest import fixture, raises
+
+
+@fixture
+def app_layer():
+    return MappingProxyType(
+        {'app': read_only({'secrets': {'token': 'secret'}})})
+
+
+@fixture
+def context(app_layer):
+    return Context({'foo': 'bar'}, app_layer)
+
+
+def test_context_read(context):
+    assert context['foo'] == 'bar'
+    assert context['app']['secrets']['token'] == 'secret'
+    assert context.get('unknown') is None
+    assert context.get('unknown', 1) == 1
+    assert 'app' in context
+    assert 'unknown' not in context
+    with raises(KeyError):
+        context['unknown']
+
+
+def test_context_write(context, app_layer):
+    context['app'] = 'overridden'
+    assert context['app'] == 'overridden'
+    assert app_layer['app'] == {'secrets': {'token': 'secret'}}
+    del context['app']
+    assert context['app'] == {'secrets': {'token': 'secret'}}
+    with raises(KeyError):
+        del context['app']
+
+
+def test_context_mapping(context):
+    context['app'] = 'overridden'
+    assert list(context) == ['foo', 'app']
+    assert len(context) == 2
+    assert context == {'foo': 'bar', 'app': 'overridden'}
+    assert repr(context) == repr({'foo': 'bar', 'app': 'overridden'})
+
+
+def test_context_copy_on_write(context, app_layer):
+    Dict.set(context, ['app', 'secrets', 'token'], 'changed')
+    assert context['app']['secrets']['token'] == 'changed'
+    assert app_layer['app']['secrets']['token'] == 'secret'
+    assert Context({}, app_layer)['app']['secrets']['token'] == 'secret'
+
+
+def test_context_shared(app_layer):
+    """
+    An execution can't change what other executions see, even through a
+    variable which holds a value of the shared layer.
+    """
+    context = Context({}, app_layer)
+    assert context['app'] is app_layer['app']
+    with raises(TypeError):
+        context['app']['secrets']['token'] = 'changed'
+
+    context['y'] = context['app']
+    Dict.set(context, ['y', 'secrets', 'k'], 'HACK')
+    assert context['y'] == {'secrets': {'token': 'secret', 'k': 'HACK'}}
+    assert context['app'] is app_layer['app']
+    assert app_layer['app'] == {'secrets': {'token': 'secret'}}
+    assert 'app' not in context.local
+
+
+def test_read_only():
+    value = read_only({'a': [1, {'b': 2}]})
+    assert value == {'a': [1, {'b': 2}]}
+    assert isinstance(value['a'][1], ReadOnlyDict)
+    with raises(TypeError):
+        value['a'].append(3)
+    with raises(TypeError):
+        value['a'][1].pop('b')
+    assert value.setdefault('a') is value['a']
+    copy = value.copy()
+    copy['c'] = 3
+    assert type(copy) is dict
+    assert 'c' not in value
+
+
+def test_context_setdefault(context):
+    assert context.setdefault('foo', 'baz') == 'bar'
+    assert context.setdefault('new', 'baz') == 'baz'
+    assert context.local['new'] == 'baz'
+
+
+def test_context_resolve(context):
+    path = {'$OBJECT': 'path', 'paths': ['app', 'secrets', 'token']}
+    assert Resolver.resolve(path, context) == 'secret'
+    assert Resolver.compile(path).resolve(context) == 'secret'
+    assert Resolver.path(['unknown'], context) is None
+
+
+@fixture
+def slotted(app_layer):
+    return Context({'foo': 'bar', 'baz': 1}, app_layer, {'foo': 0, 'n': 1})
+
+
+def test_context_slots(slotted):
+    assert slotted.values == ['bar', UNSET]
+    assert slotted.local == {'baz': 1}
+    assert slotted['foo'] == 'bar'
+    assert 'n' not in slotted
+    assert slotted.get('n') is None
+    slotted['n'] = 2
+    assert slotted.values == ['bar', 2]
+    assert 'n' in slotted
+    assert list(slotted) == ['foo', 'n', 'baz', 'app']
+    del slotted['n']
+    assert slotted.values == ['bar', UNSET]
+    with raises(KeyError):
+        del slotted['n']
+
+
+def test_context_slots_dict_set(slotted):
+    Dict.set(slotted, ['n', 'a'], 'b')
+    assert slotted.values[1] == {'a': 'b'}
+    assert slotted == {'foo': 'bar', 'n': {'a': 'b'}, 'baz': 1,
+                       'app': {'secrets': {'token': 'secret'}}}
+
+
+def test_context_slots_resolve(slotted):
+    slotted['n'] = {'a': ['x', 'y']}
+    slots = slotted.slots
+    path = {'$OBJECT': 'path', 'paths': ['n', 'a', '1']}
+    assert Resolver.compile(path, slots).resolve(slotted) == 'y'
+    assert Resolver.compile(path, slots).resolve({'n': {'a': [1, 2]}}) == 2
+    assert Resolver.resolve(path, slotted) == 'y'
+    del slotted['n']
+    assert Resolver.compile(path, slots).resolve(slotted) is None
+
+
+def test_context_merge(app_layer):
+    context = Context({'foo': 'bar', 'a': 1, 'keep': []}, app_layer,
+                      {'a': 0, 'b': 1})
+    copy = context.copy()
+    copy['foo'] = 'baz'
+    copy['b'] = 2
+    copy['new'] = 'value'
+    context.merge(copy)
+    assert dict(context) == {'foo': 'baz', 'a': 1, 'b': 2, 'new': 'value',
+                             'keep': [], 'app': app_layer['app']}
+
+
+def test_context_merge_unassigned(app_layer):
+    """
+    A copy which didn't assign a variable doesn't undo what another copy,
+    merged before it, assigned.
+    """
+    context = Context({'total': 0}, app_layer, {'n': 0})
+    context['n'] = 0
+    first = context.copy()
+    second = context.copy()
+    first['total'] = 5
+    first['n'] = 1
+    context.merge(first)
+    context.merge(second)
+    assert context['total'] == 5
+    assert context['n'] == 1
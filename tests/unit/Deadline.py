@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import time
+
+from asyncy.Deadline import Deadline
+from asyncy.Exceptions import DeadlineExceededError
+
+from pytest import fixture, raises
+
+
+@fixture
+def clock(patch):
+    patch.object(time, 'monotonic', return_value=100.0)
+    return time.monotonic
+
+
+def test_deadline_unlimited(story):
+    deadline = Deadline()
+    assert deadline.expires is None
+    assert deadline.lines is None
+    assert deadline.remaining() is None
+    assert deadline.request_timeout() is None
+    assert deadline.request_timeout(5) == 5
+    for _ in range(100):
+        deadline.spend(story, None)
+
+
+def test_deadline_for_app(app, clock):
+    app.story_timeout = 10
+    app.story_max_lines = 20
+    deadline = Deadline.for_app(app)
+    assert deadline.expires == 110.0
+    assert deadline.lines == 20
+
+
+def test_deadline_remaining(clock):
+    deadline = Deadline(seconds=10)
+    clock.return_value = 104.0
+    assert deadline.remaining() == 6.0
+    assert deadline.request_timeout() == 6.0
+    assert deadline.request_timeout(20) == 6.0
+    assert deadline.request_timeout(2) == 2
+    clock.return_value = 111.0
+    assert deadline.remaining() == 0.0
+
+
+def test_deadline_spend_time(story, clock):
+    deadline = Deadline(seconds=10)
+    deadline.spend(story, 'line')
+    clock.return_value = 110.0
+    with raises(DeadlineExceededError) as e:
+        deadline.spend(story, 'line')
+
+    assert e.value.story is story
+    assert e.value.line == 'line'
+
+
+def test_deadline_spend_lines(story):
+    deadline = Deadline(lines=2)
+    deadline.spend(story, None)
+    deadline.spend(story, None)
+    with raises(DeadlineExceededError):
+        deadline.spend(story, None)
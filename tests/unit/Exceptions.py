@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-from asyncy.Exceptions import AsyncyError
+from asyncy.Exceptions import AsyncyError, DeadlineExceededError
 
 from pytest import raises
 
@@ -7,3 +7,10 @@ from pytest import raises
 def test_asyncy_error():
     with raises(AsyncyError):
         raise AsyncyError('things happen')
+
+
+def test_deadline_exceeded_error():
+    error = DeadlineExceededError('out of time', story='story', line='line')
+    assert isinstance(error, AsyncyError)
+    assert error.story == 'story'
+    assert error.line == 'line'
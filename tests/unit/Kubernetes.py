@@ -8,13 +8,12 @@ from unittest.mock import MagicMock
 from asyncy.Exceptions import K8sError
 from asyncy.Kubernetes import Kubernetes
 from asyncy.constants.LineConstants import LineConstants
+from asyncy.utils.HttpClients import HttpClients
 from asyncy.utils.HttpUtils import HttpUtils
 
 import pytest
 from pytest import fixture, mark
 
-from tornado.httpclient import AsyncHTTPClient
-
 
 @fixture
 def line():
@@ -181,9 +180,7 @@ async def test_make_k8s_call(patch, story, async_mock):
     patch.object(Kubernetes, 'new_ssl_context', return_value=context)
     context.load_verify_locations = MagicMock()
 
-    patch.init(AsyncHTTPClient)
-
-    client = AsyncHTTPClient()
+    client = HttpClients.get('kubernetes')
 
     story.app.config.CLUSTER_CERT = 'this_is\\nmy_cert'  # Notice the \\n.
     story.app.config.CLUSTER_AUTH_TOKEN = 'my_token'
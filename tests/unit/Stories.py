@@ -1,20 +1,84 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import pathlib
 import time
 
+from asyncy.Context import Context
+from asyncy.Deadline import Deadline
+from asyncy.Exceptions import DeadlineExceededError
 from asyncy.Stories import Stories
+from asyncy.Trace import Trace
 from asyncy.utils import Dict, Resolver
 
+import pytest
 from pytest import mark
 
 
 def test_stories_init(app, logger, story):
-    assert story.entrypoint == app.stories['hello.story']['entrypoint']
+    assert story.compiled == app.stories['hello.story']
+    assert story.tree == app.stories['hello.story'].tree
+    assert story.entrypoint == app.stories['hello.story'].entrypoint
     assert story.app == app
     assert story.name == 'hello.story'
     assert story.logger == logger
     assert story.execution_id is not None
-    assert story.results == {}
+    assert story.trace is None
+
+
+def test_stories_fork(story):
+    story.context = Context({'a': 1})
+    context = story.context.copy()
+    fork = story.fork(context)
+    assert fork.context is context
+    assert fork.app is story.app
+    assert fork.execution_id == story.execution_id
+    assert fork.trace is None
+
+
+def test_stories_fork_traced(story):
+    story.trace = Trace(4, 1.0)
+    story._line_starts = {'1': 10}
+    fork = story.fork(Context())
+    assert fork.trace is story.trace
+    assert fork._line_starts == {}
+    assert story._line_starts == {'1': 10}
+
+
+def test_stories_tick_lines(story):
+    story.app.yield_lines = 3
+    assert [story.tick() for _ in range(4)] == [False, False, True, True]
+
+
+def test_stories_tick_interval(patch, story):
+    story.app.yield_interval = 0.5
+    patch.object(time, 'monotonic', return_value=story._slice_start + 0.4)
+    assert story.tick() is False
+    time.monotonic.return_value += 0.1
+    assert story.tick() is True
+
+
+def test_stories_tick_deadline(story):
+    story.deadline = Deadline(lines=1)
+    story.tick('line')
+    with pytest.raises(DeadlineExceededError) as e:
+        story.tick('line')
+    assert e.value.line == 'line'
+
+
+@mark.asyncio
+async def test_stories_pause(patch, story):
+    story.app.yield_lines = 2
+    story.tick()
+    story.tick()
+    others = []
+
+    async def other():
+        others.append(1)
+
+    asyncio.ensure_future(other())
+    await story.pause()
+    assert others == [1]
+    assert story.tick() is False
 
 
 def test_stories_get_tmp_dir(story):
@@ -56,15 +120,15 @@ def test_stories_first_line(patch, story):
     assert result == '16'
 
 
-def test_stories_function_line_by_name(patch, story):
-    story.entrypoint = '1'
-    story.tree = {
+def test_stories_function_line_by_name(patch, story, compile_story):
+    story.compiled = compile_story({
         '1': {'ln': '1', 'next': '2'},
         '2': {'ln': '2', 'method': 'function', 'function': 'execute'}
-    }
+    }, entrypoint='1')
 
     function_line = story.function_line_by_name('execute')
-    assert function_line == story.tree['2']
+    assert function_line == story.compiled.tree['2']
+    assert story.function_line_by_name('foo') is None
 
 
 def test_stories_resolve(patch, logger, story):
@@ -75,6 +139,21 @@ def test_stories_resolve(patch, logger, story):
     assert result == 'args'
 
 
+def test_stories_resolve_expression(logger, story):
+    arg = {'$OBJECT': 'path', 'paths': ['foo']}
+    story.context = {'foo': 'bar'}
+    assert story.resolve(Resolver.compile(arg)) == 'bar'
+    logger.log.assert_called_with('story-resolve', arg, 'bar')
+    assert story.resolve(Resolver.compile(arg), encode=True) == "'bar'"
+
+
+def test_stories_resolve_constant(logger, story):
+    arg = {'$OBJECT': 'string', 'string': 'a{}', 'values': ['b']}
+    assert story.resolve(Resolver.compile(arg)) == 'ab'
+    assert story.resolve(Resolver.compile(arg), encode=True) == "'ab'"
+    logger.log.assert_not_called()
+
+
 def test_command_arguments_list(patch, story):
     patch.object(Stories, 'resolve', return_value='something')
     obj = {'$OBJECT': 'string', 'string': 'string'}
@@ -95,62 +174,53 @@ def test_command_arguments_list_none(patch, story):
 
 
 def test_stories_start_line(patch, story):
-    patch.object(time, 'time')
+    patch.object(Trace, 'clock', return_value=10)
+    story.start_line('1')
+    Trace.clock.assert_not_called()
+
+
+def test_stories_start_line_traced(patch, story):
+    patch.object(Trace, 'clock', return_value=10)
+    story.trace = Trace(4, 1.0)
+    story._line_starts = {}
     story.start_line('1')
-    assert story.results['1'] == {'start': time.time()}
+    assert story._line_starts == {'1': 10}
 
 
 def test_stories_end_line(patch, story):
-    patch.object(time, 'time')
-    story.results = {'1': {'start': 'start'}}
+    patch.object(story, 'set_variable')
     story.end_line('1')
-    assert story.results['1']['output'] is None
-    assert story.results['1']['end'] == time.time()
-    assert story.results['1']['start'] == 'start'
+    story.set_variable.assert_not_called()
 
 
-def test_stories_end_line_output(patch, story):
-    patch.object(time, 'time')
-    story.results = {'1': {'start': 'start'}}
+def test_stories_end_line_traced(patch, story):
+    patch.object(Trace, 'clock', return_value=20)
+    story.trace = Trace(4, 1.0)
+    story._line_starts = {'1': 10}
     story.end_line('1', output='output')
-    assert story.results['1']['output'] == 'output'
+    assert story.trace.dump(story.execution_id) == [
+        (story.execution_id, '1', 10, 20, 6)
+    ]
 
 
 def test_stories_end_line_output_assign(patch, story):
     patch.object(Dict, 'set')
-    story.results = {'1': {'start': 'start'}}
     assign = {'paths': ['x']}
     story.end_line('1', output='output', assign=assign)
-    assert story.results['1']['output'] == 'output'
     Dict.set.assert_called_with(story.context, assign['paths'], 'output')
 
 
-def test_stories_end_line_output_as_list(patch, story):
-    patch.object(time, 'time')
-    story.results = {'1': {'start': 'start'}}
-    story.end_line('1', output=['a', 'b'])
-    assert story.results['1']['output'] == ['a', 'b']
-
-
-def test_stories_end_line_output_as_json_no_auto_convert(patch, story):
-    patch.object(time, 'time')
-    story.results = {'1': {'start': 'start'}}
-    story.end_line('1', output='{"key":"value"}')
-    assert story.results['1']['output'] == '{"key":"value"}'
-
-
-def test_stories_end_line_output_as_sting(patch, story):
-    patch.object(time, 'time')
-    story.results = {'1': {'start': 'start'}}
-    story.end_line('1', output='   foobar\n\t')
-    assert story.results['1']['output'] == 'foobar'
-
-
-def test_stories_end_line_output_as_bytes(patch, story):
-    patch.object(time, 'time')
-    story.results = {'1': {'start': 'start'}}
-    story.end_line('1', output=b'output')
-    assert story.results['1']['output'] == 'output'
+@mark.parametrize('output,expected', [
+    (['a', 'b'], ['a', 'b']),
+    ('{"key":"value"}', '{"key":"value"}'),
+    ('   foobar\n\t', 'foobar'),
+    (b'output', 'output')
+])
+def test_stories_end_line_output(patch, story, output, expected):
+    patch.object(Dict, 'set')
+    assign = {'paths': ['x']}
+    story.end_line('1', output=output, assign=assign)
+    Dict.set.assert_called_with(story.context, assign['paths'], expected)
 
 
 @mark.parametrize('input,output', [
@@ -187,6 +257,26 @@ def test_stories_argument_by_name_lookup(patch, story):
     story.resolve.assert_called_with(line['args'][0]['argument'], encode=False)
 
 
+def test_stories_argument_by_name_compiled(patch, story, compile_tree):
+    line = compile_tree({
+        '1': {
+            'ln': '1',
+            'args': [
+                {
+                    '$OBJECT': 'argument',
+                    'name': 'foo',
+                    'argument': {'$OBJECT': 'string', 'string': 'bar'}
+                }
+            ]
+        }
+    })['1']
+
+    patch.object(story, 'resolve')
+    story.argument_by_name(line, 'foo')
+    story.resolve.assert_called_with(line.arguments['foo'], encode=False)
+    assert story.argument_by_name(line, 'unknown') is None
+
+
 def test_stories_argument_by_name_missing(patch, story):
     line = {'args': []}
     assert story.argument_by_name(line, 'foo') is None
@@ -196,65 +286,112 @@ def test_stories_prepare(story):
     story.prepare(None)
 
 
-def test_stories_prepare_context(story, app):
+@mark.parametrize('sampled', [True, False])
+def test_stories_prepare_trace(patch, story, sampled):
+    story.app.trace = Trace(4, 0.5)
+    patch.object(Trace, 'sample', return_value=sampled)
+    story.prepare(None)
+    assert (story.trace is story.app.trace) is sampled
+
+
+def test_stories_prepare_context(story, app, compile_story):
     story.app = app
-    context = {'app': app.app_context}
+    story.compiled = compile_story({})
+    app.app_layer = {'app': {'secrets': {}}}
+    context = {'foo': 'bar'}
     story.prepare(context=context)
     assert story.environment == app.environment
-    assert story.context == context
+    assert isinstance(story.context, Context)
+    assert story.context.local is context
+    assert story.context.parent is app.app_layer
+    assert story.context == {'foo': 'bar', 'app': {'secrets': {}}}
+
+
+def test_stories_set_context_slots(story, app, compile_story):
+    story.compiled = compile_story({
+        '1': {'ln': '1', 'method': 'set', 'name': ['foo'], 'args': ['bar']}
+    })
+    app.app_layer = {}
+    story.set_context({'foo': 'bar', 'baz': 1})
+    assert story.context.slots is story.compiled.slots
+    assert story.context.values == ['bar']
+    assert story.context.local == {'baz': 1}
+
+
+def test_stories_end_line_slot(patch, story):
+    patch.object(story, 'set_variable')
+    story.context = Context(slots={'x': 0})
+    story.end_line('1', output='output', slot=0,
+                   assign={'paths': ['x']})
+    assert story.context['x'] == 'output'
+    story.set_variable.assert_not_called()
 
 
-def test_stories_next_block_simple(patch, story):
-    story.tree = {
+def test_stories_set_context(story):
+    context = Context()
+    story.set_context(context)
+    assert story.context is context
+
+
+def test_stories_next_block_simple(patch, story, compile_tree):
+    story.tree = compile_tree({
         '2': {'ln': '2', 'enter': '3', 'next': '3'},
         '3': {'ln': '3', 'parent': '2', 'next': '4'},
         '4': {'ln': '4'}
-    }
+    })
 
     assert isinstance(story, Stories)
 
     assert story.next_block(story.line('2')) == story.tree['4']
 
 
-def test_stories_next_block_as_lines(patch, story):
-    story.tree = {
+def test_stories_next_block_as_lines(patch, story, compile_tree):
+    story.tree = compile_tree({
         '2': {'ln': '2', 'next': '3'},
         '3': {'ln': '3', 'next': '4'}
-    }
+    })
 
     assert isinstance(story, Stories)
 
     assert story.next_block(story.line('2')) == story.tree['3']
 
 
-def test_stories_next_block_where_next_block_is_block(patch, story):
-    story.tree = {
+def test_stories_next_block_where_next_block_is_block(patch, story,
+                                                      compile_tree):
+    story.tree = compile_tree({
         '2': {'ln': '2', 'next': '3'},
         '3': {'ln': '3', 'next': '4', 'enter': '4'},
         '4': {'ln': '4', 'parent': '3'}
-    }
+    })
 
     assert isinstance(story, Stories)
 
     assert story.next_block(story.line('2')) == story.tree['3']
 
 
-def test_stories_next_block_only_block(patch, story):
-    story.tree = {
+def test_stories_next_block_only_block(patch, story, compile_tree):
+    story.tree = compile_tree({
         '2': {'ln': '2'}
-    }
+    })
 
     assert isinstance(story, Stories)
 
     assert story.next_block(story.line('2')) is None
 
 
-def test_stories_context_for_function_call(story):
-    assert story.context_for_function_call({}, {}) == {}
+def test_stories_context_for_function_call(story, compile_tree):
+    tree = compile_tree({
+        '1': {'ln': '1', 'method': 'function', 'function': 'foo'},
+        '2': {'ln': '2', 'method': 'call', 'function': 'foo'}
+    })
+    assert story.context_for_function_call(tree['2']) == {}
 
 
-def test_stories_context_for_function_call_with_args(story):
+def test_stories_context_for_function_call_with_args(story, compile_tree):
     line = {
+        'ln': '2',
+        'method': 'call',
+        'function': 'my_function',
         'args': [
             {
                 '$OBJECT': 'argument',
@@ -276,6 +413,9 @@ def test_stories_context_for_function_call_with_args(story):
     }
 
     function_line = {
+        'ln': '1',
+        'method': 'function',
+        'function': 'my_function',
         'args': [
             {
                 '$OBJECT': 'argument',
@@ -296,43 +436,54 @@ def test_stories_context_for_function_call_with_args(story):
         ]
     }
 
-    assert story.context_for_function_call(line, function_line) == {
+    function_line['args'].append({
+        '$OBJECT': 'argument',
+        'name': 'not_passed',
+        'argument': {
+            '$OBJECT': 'type',
+            'type': 'string'
+        }
+    })
+
+    tree = compile_tree({'1': function_line, '2': line})
+    assert story.context_for_function_call(tree['2']) == {
         'foo': 'bar',
-        'foo1': 'bar1'
+        'foo1': 'bar1',
+        'not_passed': None
     }
 
 
-def test_stories_next_block_nested(patch, story):
-    story.tree = {
+def test_stories_next_block_nested(patch, story, compile_tree):
+    story.tree = compile_tree({
         '2': {'ln': '2', 'enter': '3', 'next': '3'},
         '3': {'ln': '3', 'parent': '2', 'next': '4'},
         '4': {'ln': '4', 'enter': '5', 'parent': '2', 'next': '5'},
         '5': {'ln': '5', 'parent': '4', 'next': '6'},
         '6': {'ln': '6', 'parent': '4', 'next': '7'},
         '7': {'ln': '7'}
-    }
+    })
 
     assert isinstance(story, Stories)
 
     assert story.next_block(story.line('2')) == story.tree['7']
 
 
-def test_stories_next_block_last_line(patch, story):
-    story.tree = {
+def test_stories_next_block_last_line(patch, story, compile_tree):
+    story.tree = compile_tree({
         '2': {'ln': '2', 'enter': '3', 'next': '3'},
         '3': {'ln': '3', 'parent': '2', 'next': '4'},
         '4': {'ln': '4', 'enter': '5', 'parent': '2', 'next': '5'},
         '5': {'ln': '5', 'parent': '4', 'next': '6'},
         '6': {'ln': '6', 'parent': '4'}
-    }
+    })
 
     assert isinstance(story, Stories)
 
     assert story.next_block(story.line('2')) is None
 
 
-def test_stories_next_block_nested_inner(patch, story):
-    story.tree = {
+def test_stories_next_block_nested_inner(patch, story, compile_tree):
+    story.tree = compile_tree({
         '2': {'ln': '2', 'enter': '3', 'next': '3'},
         '3': {'ln': '3', 'parent': '2', 'next': '4'},
         '4': {'ln': '4', 'enter': '5', 'parent': '2', 'next': '5'},
@@ -340,8 +491,23 @@ def test_stories_next_block_nested_inner(patch, story):
         '6': {'ln': '6', 'parent': '4', 'next': '7'},
         '7': {'ln': '7', 'parent': '2', 'next': '8'},
         '8': {'ln': '8', 'parent': '2'}
-    }
+    })
 
     assert isinstance(story, Stories)
 
     assert story.tree['7'] == story.next_block(story.line('4'))
+
+
+def test_stories_line_has_parent(story, compile_tree):
+    tree = compile_tree({
+        '1': {'ln': '1', 'enter': '2', 'next': '2'},
+        '2': {'ln': '2', 'parent': '1', 'enter': '3', 'next': '3'},
+        '3': {'ln': '3', 'parent': '2', 'next': '4'},
+        '4': {'ln': '4'}
+    })
+
+    assert story.line_has_parent(tree['1'], tree['2']) is True
+    assert story.line_has_parent(tree['1'], tree['3']) is True
+    assert story.line_has_parent(tree['2'], tree['3']) is True
+    assert story.line_has_parent(tree['3'], tree['2']) is False
+    assert story.line_has_parent(tree['1'], tree['4']) is False
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+from asyncy.Compiler import Compiler
+from asyncy.Context import Context
+from asyncy.StoryCache import StoryCache
+from asyncy.processing import Story
+
+from pytest import fixture, mark
+
+
+@fixture
+def raw_story():
+    return {
+        'entrypoint': '1',
+        'tree': {
+            '1': {'ln': '1', 'method': 'set', 'name': ['a'], 'args': [
+                {'$OBJECT': 'path', 'paths': ['b']}], 'next': '2'},
+            '2': {'ln': '2', 'method': 'for', 'output': ['i'], 'enter': '3',
+                  'next': '3', 'exit': '4',
+                  'args': [{'$OBJECT': 'list', 'items': [1, 2]}]},
+            '3': {'ln': '3', 'method': 'set', 'parent': '2', 'name': ['c'],
+                  'args': [{'$OBJECT': 'path', 'paths': ['i']}], 'next': '4'},
+            '4': {'ln': '4', 'method': 'execute', 'service': 'alpine',
+                  'command': 'echo', 'next': '5'},
+            '5': {'ln': '5', 'method': 'execute', 'service': 'cowsay',
+                  'command': 'say', 'next': '6'},
+            '6': {'ln': '6', 'method': 'function', 'function': 'f',
+                  'enter': '7', 'next': '7', 'args': [
+                      {'$OBJECT': 'argument', 'name': 'x', 'argument': {
+                          '$OBJECT': 'type', 'type': 'string'}}]},
+            '7': {'ln': '7', 'method': 'set', 'parent': '6', 'name': ['y'],
+                  'args': [{'$OBJECT': 'path', 'paths': ['x']}]}
+        }
+    }
+
+
+@fixture
+def cache(tmpdir):
+    StoryCache.compiled.clear()
+    yield StoryCache(10, str(tmpdir))
+    StoryCache.compiled.clear()
+
+
+def test_story_cache_for_config(magic):
+    config = magic(STORY_CACHE_SIZE='5', STORY_CACHE_DIR='')
+    cache = StoryCache.for_config(config)
+    assert cache.size == 5
+    assert cache.directory is None
+
+
+def test_story_cache_key(raw_story):
+    key = StoryCache.key('a', raw_story)
+    assert key == StoryCache.key('a', dict(reversed(list(raw_story.items()))))
+    assert key != StoryCache.key('b', raw_story)
+    assert key == StoryCache.key('a', dict(raw_story, version='0.1'))
+    raw_story['tree']['1']['name'] = ['z']
+    assert key != StoryCache.key('a', raw_story)
+
+
+def test_story_cache_dumps_loads(raw_story):
+    compiled = Compiler.compile('a', raw_story)
+    loaded = StoryCache.loads(StoryCache.dumps(compiled))
+    assert loaded.name == 'a'
+    assert loaded.entrypoint == '1'
+    assert loaded.slots == compiled.slots
+    assert list(loaded.tree) == list(compiled.tree)
+    assert loaded.functions == {'f': loaded.tree['6']}
+    assert loaded.tree['4'].group == (loaded.tree['4'], loaded.tree['5'])
+    for original, line in zip(compiled.lines, loaded.lines):
+        assert line.raw == original.raw
+        assert line.handler is original.handler
+        for link in StoryCache.links:
+            target = getattr(original, link)
+            assert getattr(line, link) is (
+                None if target is None else loaded.lines[target.id])
+        for field in ('pre', 'post', 'slot', 'static', 'parallel', 'pure'):
+            assert getattr(line, field) == getattr(original, field)
+
+    context = Context({'b': 'x'}, slots=loaded.slots)
+    assert loaded.tree['1'].args[0].resolve(context) == 'x'
+    assert loaded.tree['2'].parallel == compiled.tree['2'].parallel
+
+
+def test_story_cache_get_put(cache, raw_story):
+    compiled = Compiler.compile('a', raw_story)
+    assert cache.get('key') is None
+    cache.put('key', compiled)
+    assert cache.get('key') is compiled
+
+    # Another process, or the next start of this one.
+    StoryCache.compiled.clear()
+    loaded = cache.get('key')
+    assert loaded is not compiled
+    assert list(loaded.tree) == list(compiled.tree)
+    assert cache.get('key') is loaded
+
+
+def test_story_cache_get_corrupt(cache, tmpdir):
+    tmpdir.join('key.pickle').write('garbage')
+    assert cache.get('key') is None
+
+
+@mark.parametrize('size', [0, 2])
+def test_story_cache_remember(size):
+    StoryCache.compiled.clear()
+    cache = StoryCache(size)
+    for key in 'abc':
+        cache.put(key, key)
+
+    assert list(StoryCache.compiled) == ['b', 'c'][:size]
+    StoryCache.compiled.clear()
+
+
+def test_story_cache_evict():
+    StoryCache.compiled.clear()
+    cache = StoryCache(2)
+    cache.put('a', 'a')
+    StoryCache.evict('a')
+    StoryCache.evict('b')
+    assert StoryCache.compiled == {}
+
+
+def test_story_cache_put_unwritable(cache, raw_story, tmpdir):
+    cache.directory = str(tmpdir.join('file'))
+    tmpdir.join('file').write('')
+    cache.put('key', Compiler.compile('a', raw_story))
+    assert 'key' in StoryCache.compiled
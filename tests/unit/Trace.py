@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import random
+
+from asyncy.Trace import Record, Trace
+
+from pytest import fixture, mark
+
+
+@fixture
+def trace():
+    return Trace(3, 1.0)
+
+
+def test_trace_init(trace):
+    assert trace.buffer == [None, None, None]
+    assert trace.position == 0
+
+
+@mark.parametrize('size,sample_rate,expected', [
+    (0, 1, None),
+    (10, 0, None),
+    (10, 0.5, (10, 0.5)),
+    (10, 2, (10, 1.0))
+])
+def test_trace_for_app(magic, size, sample_rate, expected):
+    settings = {'STORY_TRACE_SIZE': size,
+                'STORY_TRACE_SAMPLE_RATE': sample_rate}
+    app = magic()
+    app.tunable = lambda key, kind=int: kind(settings[key])
+    trace = Trace.for_app(app)
+    if expected is None:
+        assert trace is None
+    else:
+        assert (trace.size, trace.sample_rate) == expected
+
+
+@mark.parametrize('value,sampled', [(0.1, True), (0.9, False)])
+def test_trace_sample(patch, value, sampled):
+    patch.object(random, 'random', return_value=value)
+    assert Trace(1, 0.5).sample() is sampled
+
+
+def test_trace_sample_always(patch, trace):
+    patch.object(random, 'random')
+    assert trace.sample() is True
+    random.random.assert_not_called()
+
+
+@mark.parametrize('output,size', [
+    ('abc', 3), (b'ab', 2), ([1], 1), ({}, 0), (None, 0), (12345, 0)
+])
+def test_trace_output_size(output, size):
+    assert Trace.output_size(output) == size
+
+
+def test_trace_record(trace):
+    trace.record('id', '1', 10, 20, 'output')
+    assert trace.records() == [Record('id', '1', 10, 20, 6)]
+
+
+def test_trace_records_wraps(trace):
+    for start in range(5):
+        trace.record('id', str(start), start, start + 1, None)
+
+    assert [record.line for record in trace.records()] == ['2', '3', '4']
+    assert trace.position == 5
+
+
+def test_trace_dump(trace):
+    trace.record('a', '1', 0, 1, None)
+    trace.record('b', '1', 0, 1, None)
+    trace.record('a', '2', 1, 2, None)
+    assert [record.line for record in trace.dump('a')] == ['1', '2']
+    assert trace.dump('c') == []
+
+
+def test_trace_clock():
+    assert isinstance(Trace.clock(), int)
@@ -16,7 +16,18 @@ def config(magic):
 
 @fixture
 def app(magic):
-    return magic()
+    app = magic()
+    # Stories don't yield to the event loop (see Stories#tick).
+    app.yield_lines = 0
+    app.yield_interval = 0
+    app.story_timeout = None
+    app.story_max_lines = None
+    app.loop_concurrency = 1
+    app.trace = None
+    app.prepared_requests = {}
+    app.dispatch_plans = {}
+    app.containers = {}
+    return app
 
 
 @fixture
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+from asyncy.Exceptions import AsyncyError
+from asyncy.Stories import Stories
+from asyncy.Trace import Trace
+from asyncy.processing import Story
+from asyncy.processing.Codegen import Codegen
+
+import pytest
+from pytest import fixture, mark
+
+
+def path(*paths):
+    return {'$OBJECT': 'path', 'paths': list(paths)}
+
+
+def equals(left, right):
+    return {'$OBJECT': 'assertion', 'assertion': 'equals',
+            'values': [left, right]}
+
+
+@fixture
+def tree():
+    return {
+        '1': {'ln': '1', 'method': 'set', 'name': ['a'], 'args': [1],
+              'next': '2'},
+        '2': {'ln': '2', 'method': 'for', 'output': ['i'], 'enter': '3',
+              'next': '3', 'exit': '9',
+              'args': [{'$OBJECT': 'list', 'items': [1, 2, 3]}]},
+        '3': {'ln': '3', 'method': 'if', 'parent': '2', 'enter': '4',
+              'next': '4', 'args': [equals(path('i'), 2)]},
+        '4': {'ln': '4', 'method': 'set', 'parent': '3', 'name': ['a'],
+              'args': [path('i')], 'next': '5'},
+        '5': {'ln': '5', 'method': 'elif', 'parent': '2', 'enter': '6',
+              'next': '6', 'args': [equals(path('i'), 3)]},
+        '6': {'ln': '6', 'method': 'call', 'parent': '5',
+              'function': 'double', 'next': '7',
+              'args': [{'$OBJECT': 'argument', 'name': 'x',
+                        'argument': path('i')}]},
+        '7': {'ln': '7', 'method': 'else', 'parent': '2', 'enter': '8',
+              'next': '8'},
+        '8': {'ln': '8', 'method': 'set', 'parent': '7', 'name': ['b', 'c'],
+              'args': [path('i')], 'next': '9'},
+        '9': {'ln': '9', 'method': 'set', 'name': ['z'], 'args': [path('a')],
+              'next': '10'},
+        '10': {'ln': '10', 'method': 'function', 'function': 'double',
+               'enter': '11', 'next': '11',
+               'args': [{'$OBJECT': 'argument', 'name': 'x',
+                         'argument': {'$OBJECT': 'type', 'type': 'int'}}]},
+        '11': {'ln': '11', 'method': 'set', 'parent': '10', 'name': ['y'],
+               'args': [path('x')], 'next': '12'},
+        '12': {'ln': '12', 'method': 'if', 'args': [False], 'enter': '13',
+               'next': '13'},
+        '13': {'ln': '13', 'method': 'set', 'parent': '12', 'name': ['a'],
+               'args': [0], 'next': '14'},
+        '14': {'ln': '14', 'method': 'set', 'name': ['done'], 'args': [True]}
+    }
+
+
+@fixture
+def make_story(magic, compile_story):
+    def make_story(tree):
+        app = magic(yield_lines=0, yield_interval=0, story_timeout=None,
+                    story_max_lines=None, trace=Trace(64, 1.0))
+        app.stories = {'hello.story': compile_story(tree, '1')}
+        app.app_layer = {'app': {}}
+        story = Stories(app, 'hello.story', magic())
+        story.prepare({'initial': 'value'})
+        return story
+    return make_story
+
+
+def traced_lines(story):
+    return [record.line for record in story.trace.dump(story.execution_id)]
+
+
+async def run_both(make_story, tree):
+    interpreted = make_story(tree)
+    generated = make_story(tree)
+    await Story.interpret(interpreted.logger, interpreted)
+    await Codegen.build(generated.compiled)(generated.logger, generated)
+    return interpreted, generated
+
+
+@mark.asyncio
+async def test_codegen_matches_interpreter(make_story, tree):
+    interpreted, generated = await run_both(make_story, tree)
+    assert dict(generated.context) == dict(interpreted.context)
+    assert generated.context['b'] == {'c': 1}
+    assert generated.context['done'] is True
+    assert traced_lines(generated) == traced_lines(interpreted)
+    # Each story has it's own compiled lines, so compare their repr.
+    assert repr(generated.logger.log.mock_calls) == \
+        repr(interpreted.logger.log.mock_calls)
+
+
+@mark.asyncio
+async def test_codegen_complex_if(make_story, tree):
+    tree['12']['args'] = [True, False]
+    interpreted = make_story(tree)
+    generated = make_story(tree)
+    with pytest.raises(AsyncyError) as interpreted_error:
+        await Story.interpret(interpreted.logger, interpreted)
+    with pytest.raises(AsyncyError) as generated_error:
+        await Codegen.build(generated.compiled)(generated.logger, generated)
+
+    assert generated_error.value.line.ln == interpreted_error.value.line.ln
+    assert str(generated_error.value) == str(interpreted_error.value)
+
+
+@mark.asyncio
+async def test_codegen_wraps_errors(patch, make_story, tree):
+    tree['9']['args'] = [{'$OBJECT': 'path', 'paths': ['a', '0', '1']}]
+    story = make_story(tree)
+    patch.object(story, 'resolve', side_effect=ValueError())
+    with pytest.raises(AsyncyError) as e:
+        await Codegen.build(story.compiled)(story.logger, story)
+    assert e.value.line is story.tree['1']
+    assert str(e.value) == 'Failed to execute line'
+
+
+@mark.parametrize('condition', [True, False])
+def test_codegen_constant_condition(compile_story, condition):
+    source = Codegen.generate(compile_story({
+        '1': {'ln': '1', 'method': 'if', 'args': [condition], 'enter': '2',
+              'next': '2'},
+        '2': {'ln': '2', 'method': 'set', 'parent': '1', 'name': ['a'],
+              'args': [1], 'next': '3'},
+        '3': {'ln': '3', 'method': 'set', 'name': ['b'], 'args': [1]}
+    }, '1'))
+    assert 'if story.resolve' not in source
+    assert ('line = L[1]' in source) is condition
+    assert 'line = L[2]' in source
+
+
+def test_codegen_group(compile_story):
+    compiled = compile_story({
+        '1': {'ln': '1', 'method': 'execute', 'service': 'a', 'next': '2'},
+        '2': {'ln': '2', 'method': 'execute', 'service': 'b', 'next': '3'},
+        '3': {'ln': '3', 'method': 'set', 'name': ['c'], 'args': [1]}
+    }, '1')
+    source = Codegen.generate(compiled)
+    assert 'await Story.execute_group(logger, story, line)' in source
+    assert 'line = L[1]' not in source
+    assert "logger.log('story-execution', L[2])" in source
+
+
+@mark.asyncio
+async def test_codegen_for_stream(make_story):
+    async def stream():
+        for item in [1, 2, 3]:
+            yield item
+
+    tree = {
+        '1': {'ln': '1', 'method': 'for', 'output': ['i'], 'enter': '2',
+              'next': '2', 'exit': '3', 'args': [path('items')]},
+        '2': {'ln': '2', 'method': 'set', 'parent': '1', 'name': ['a'],
+              'args': [path('a', 'x')], 'next': '3'},
+        '3': {'ln': '3', 'method': 'set', 'name': ['b'], 'args': [path('i')]}
+    }
+    interpreted = make_story(tree)
+    generated = make_story(tree)
+    for story in (interpreted, generated):
+        story.context['a'] = {'x': 0}
+        story.context['items'] = stream()
+
+    await Story.interpret(interpreted.logger, interpreted)
+    await Codegen.build(generated.compiled)(generated.logger, generated)
+    assert generated.context['b'] == interpreted.context['b'] == 3
+    assert [c[1][0] for c in generated.logger.log.mock_calls] == \
+        [c[1][0] for c in interpreted.logger.log.mock_calls]
+
+
+def test_codegen_parallel_for(compile_story):
+    compiled = compile_story({
+        '1': {'ln': '1', 'method': 'for', 'output': ['i'], 'enter': '2',
+              'next': '2', 'exit': '3', 'args': [path('items')]},
+        '2': {'ln': '2', 'method': 'set', 'parent': '1', 'name': ['a'],
+              'args': [path('i')], 'next': '3'},
+        '3': {'ln': '3', 'method': 'set', 'name': ['b'], 'args': [1]}
+    }, '1')
+    assert compiled.tree['1'].parallel
+    source = Codegen.generate(compiled)
+    assert 'await line.handler(logger, story, line)' in source
+    assert 'line = L[1]' not in source
+
+
+def test_codegen_unsupported(compile_story):
+    assert Codegen.generate(compile_story({
+        '1': {'ln': '1', 'method': 'unknown'}
+    }, '1')) is None
+    assert Codegen.generate(compile_story({
+        '1': {'ln': '1', 'method': 'for', 'args': [[]]}
+    }, '1')) is None
+    assert Codegen.generate(compile_story({}, 'missing')) is None
+    assert Codegen.generate(compile_story({})) is not None
+
+
+@mark.parametrize('mode', ['off', None])
+def test_codegen_promote_disabled(magic, mode):
+    story = magic()
+    story.app.config.STORY_CODEGEN = mode
+    assert Codegen.promote(story) is None
+
+
+@mark.parametrize('mode', ['on', 'compare'])
+def test_codegen_promote(patch, magic, compile_story, mode):
+    patch.object(Codegen, 'build')
+    story = magic()
+    story.name = 'hello.story'
+    story.compiled = compile_story({'1': {'ln': '1', 'method': 'set'}})
+    story.app.config.STORY_CODEGEN = mode
+    story.app.codegen_threshold = 2
+    story.app.story_invocations = {}
+    story.app.generated_stories = {}
+
+    assert Codegen.promote(story) is None
+    assert Codegen.promote(story) is None
+    assert Codegen.promote(story) == Codegen.build.return_value
+    assert Codegen.promote(story) == Codegen.build.return_value
+    Codegen.build.assert_called_once_with(story.compiled)
+    assert story.app.story_invocations == {'hello.story': 3}
+
+
+def test_codegen_promote_compare_side_effects(patch, magic, compile_story):
+    patch.object(Codegen, 'build')
+    story = magic()
+    story.compiled = compile_story({'1': {'ln': '1', 'method': 'execute'}})
+    story.app.config.STORY_CODEGEN = 'compare'
+    story.app.codegen_threshold = 0
+    story.app.story_invocations = {}
+    story.app.generated_stories = {}
+    assert Codegen.promote(story) is None
+    Codegen.build.assert_not_called()
+
+
+@mark.asyncio
+async def test_codegen_execute(magic, async_mock):
+    story = magic()
+    story.app.config.STORY_CODEGEN = 'on'
+    generated = async_mock()
+    await Codegen.execute('logger', story, generated)
+    generated.mock.assert_called_with('logger', story)
+
+
+@mark.parametrize('mismatch', [True, False])
+@mark.asyncio
+async def test_codegen_execute_compare(patch, magic, make_story, tree,
+                                       mismatch):
+    story = make_story(tree)
+    story.app.config.STORY_CODEGEN = 'compare'
+    patch.object(Story, 'story', return_value=make_story(tree))
+    if mismatch:
+        tree['14']['args'] = [False]
+    generated = Codegen.build(make_story(tree).compiled)
+
+    await Codegen.execute(story.logger, story, generated)
+    assert story.context['done'] is True
+    assert story.logger.warn.called is mismatch
@@ -1,11 +1,16 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import json
 import uuid
 from unittest.mock import MagicMock, Mock
 
 from asyncy import Metrics
+from asyncy.Context import Context
 from asyncy.Exceptions import AsyncyError
+from asyncy.Stories import Stories
+from asyncy.Trace import Trace
 from asyncy.Types import StreamingService
+from asyncy.constants.ContextConstants import ContextConstants
 from asyncy.constants.LineConstants import LineConstants
 from asyncy.constants.ServiceConstants import ServiceConstants
 from asyncy.processing import Lexicon, Story
@@ -20,13 +25,30 @@ from tornado.httpclient import AsyncHTTPClient
 
 
 @fixture
-def line():
+def raw_line():
     return {'enter': '2', 'exit': '25', 'ln': '1',
             LineConstants.service: 'alpine',
             'command': 'echo',
             'args': ['args'], 'next': '26'}
 
 
+@fixture
+def make_line(compile_tree):
+    def make_line(raw):
+        return compile_tree({
+            raw['ln']: raw,
+            '2': {'ln': '2', 'parent': raw['ln']},
+            '25': {'ln': '25'},
+            '26': {'ln': '26'}
+        })[raw['ln']]
+    return make_line
+
+
+@fixture
+def line(make_line, raw_line):
+    return make_line(raw_line)
+
+
 @fixture
 def story(patch, story):
     patch.many(story, ['end_line', 'resolve',
@@ -36,15 +58,16 @@ def story(patch, story):
 
 @mark.parametrize('name', ['foo_var', None])
 @mark.asyncio
-async def test_lexicon_execute(patch, logger, story, line, async_mock, name):
-    line['enter'] = None
+async def test_lexicon_execute(patch, logger, story, raw_line, make_line,
+                               async_mock, name):
+    raw_line['enter'] = None
 
     if name is not None:
-        line['name'] = [name]
+        raw_line['name'] = [name]
 
+    line = make_line(raw_line)
     output = MagicMock()
     patch.object(Services, 'execute', new=async_mock(return_value=output))
-    patch.object(Lexicon, 'next_line_or_none')
     result = await Lexicon.execute(logger, story, line)
     Services.execute.mock.assert_called_with(story, line)
 
@@ -56,76 +79,112 @@ async def test_lexicon_execute(patch, logger, story, line, async_mock, name):
         story.end_line.assert_called_with(line['ln'],
                                           output=output,
                                           assign=None)
-    story.line.assert_called_with(line['next'])
-    assert result == Lexicon.next_line_or_none()
+    assert result == line.next
+    assert result.ln == '26'
 
 
 @mark.asyncio
-async def test_lexicon_execute_none(patch, logger, story, line, async_mock):
-    line['enter'] = None
-    story.line.return_value = None
+async def test_lexicon_execute_service(patch, story, async_mock,
+                                       compile_tree):
+    line = compile_tree({'1': {'ln': '1', 'service': 'alpine'}})['1']
+    patch.object(Services, 'execute', new=async_mock(return_value='out'))
+    Metrics.container_exec_seconds_total = Mock()
+    assert await Lexicon.execute_service(story, line) == 'out'
+    Services.execute.mock.assert_called_with(story, line)
+    Metrics.container_exec_seconds_total.labels.assert_called_with(
+        app_id=story.app.app_id, story_name=story.name, service='alpine')
+    story.end_line.assert_not_called()
+
+
+@mark.asyncio
+async def test_lexicon_execute_none(patch, logger, story, raw_line,
+                                    make_line, async_mock):
+    raw_line['enter'] = None
+    raw_line['next'] = None
+    line = make_line(raw_line)
     patch.object(Services, 'execute', new=async_mock())
     result = await Lexicon.execute(logger, story, line)
     assert result is None
 
 
 @mark.asyncio
-async def test_lexicon_set(patch, logger, story):
+async def test_lexicon_set(patch, logger, story, compile_tree):
     story.context = {}
-    patch.object(Lexicon, 'next_line_or_none')
-    line = {'ln': '1', 'name': ['out'], 'args': ['values'], 'next': '2'}
+    tree = compile_tree({
+        '1': {'ln': '1', 'name': ['out'], 'args': ['values'], 'next': '2'},
+        '2': {'ln': '2'}
+    })
+    line = tree['1']
     story.resolve.return_value = 'resolved'
     result = await Lexicon.set(logger, story, line)
-    story.resolve.assert_called_with(line['args'][0])
+    story.resolve.assert_called_with(line.args[0])
     story.end_line.assert_called_with(
         line['ln'], assign={'paths': ['out'], '$OBJECT': 'path'},
         output='resolved')
-    story.line.assert_called_with(line['next'])
-    assert result == Lexicon.next_line_or_none()
+    assert result == tree['2']
+
+
+@mark.asyncio
+async def test_lexicon_set_slot(patch, logger, story, compile_tree):
+    tree = compile_tree({
+        '1': {'ln': '1', 'method': 'set', 'name': ['out'], 'args': ['values'],
+              'next': '2'},
+        '2': {'ln': '2'}
+    })
+    line = tree['1']
+    story.resolve.return_value = 'resolved'
+    result = await Lexicon.set(logger, story, line)
+    story.end_line.assert_called_with(line['ln'], output='resolved',
+                                      slot=line.slot)
+    assert line.slot == 0
+    assert result == tree['2']
 
 
 @mark.asyncio
-async def test_lexicon_set_mutation(patch, logger, story):
+async def test_lexicon_set_mutation(patch, logger, story, compile_tree):
     story.context = {}
-    patch.object(Lexicon, 'next_line_or_none')
     patch.object(Mutations, 'mutate')
-    line = {
-        'ln': '1',
-        'name': ['out'],
-        'args': [
-            'values',
-            {
-                '$OBJECT': 'mutation'
-            }
-        ],
-        'next': '2'
-    }
+    tree = compile_tree({
+        '1': {
+            'ln': '1',
+            'name': ['out'],
+            'args': [
+                'values',
+                {
+                    '$OBJECT': 'mutation'
+                }
+            ],
+            'next': '2'
+        },
+        '2': {'ln': '2'}
+    })
+    line = tree['1']
     Mutations.mutate.return_value = 'mutated_result'
     result = await Lexicon.set(logger, story, line)
-    story.resolve.assert_called_with(line['args'][0])
+    story.resolve.assert_called_with(line.args[0])
     story.end_line.assert_called_with(
         line['ln'], assign={'paths': ['out'], '$OBJECT': 'path'},
         output='mutated_result')
-    story.line.assert_called_with(line['next'])
-    Mutations.mutate.assert_called_with(line['args'][1],
+    Mutations.mutate.assert_called_with(line.args[1],
                                         story.resolve(), story, line)
-    assert result == Lexicon.next_line_or_none()
+    assert result == tree['2']
 
 
 @mark.asyncio
-async def test_lexicon_set_invalid_operation(patch, logger, story):
+async def test_lexicon_set_invalid_operation(patch, logger, story,
+                                             compile_tree):
     story.context = {}
-    patch.object(Lexicon, 'next_line_or_none')
-    line = {
-        'ln': '1',
-        'args': [
-            'values',
-            {
-                '$OBJECT': 'foo'
-            }
-        ],
-        'next': '2'
-    }
+    line = compile_tree({
+        '1': {
+            'ln': '1',
+            'args': [
+                'values',
+                {
+                    '$OBJECT': 'foo'
+                }
+            ]
+        }
+    })['1']
     with pytest.raises(AsyncyError):
         await Lexicon.set(logger, story, line)
 
@@ -133,8 +192,8 @@ async def test_lexicon_set_invalid_operation(patch, logger, story):
 @mark.asyncio
 async def test_lexicon_function(patch, logger, story, line):
     patch.object(story, 'next_block')
-    patch.object(Lexicon, 'next_line_or_none', return_value='1')
-    assert await Lexicon.function(logger, story, line) == '1'
+    ret = await Lexicon.function(logger, story, line)
+    assert ret == story.next_block.return_value
     story.next_block.assert_called_with(line)
 
 
@@ -142,22 +201,27 @@ async def test_lexicon_function(patch, logger, story, line):
 @mark.parametrize('args', [[True], [1, 2, 3]])
 @mark.parametrize('no_more_blocks', [True, False])
 @mark.asyncio
-async def test_lexicon_if(patch, logger, story, async_mock,
+async def test_lexicon_if(patch, logger, story, async_mock, compile_tree,
                           method, args, no_more_blocks):
-    line = {
-        'method': method,
-        'args': args
-    }
+    tree = compile_tree({
+        '0': {'method': method, 'ln': '0', 'args': args},
+        '1': {'method': 'elif', 'ln': '1'},
+        '2': {'method': 'elif', 'ln': '2'},
+        '3': {'method': 'elif', 'ln': '3'},
+        '4': {'method': 'else', 'ln': '4'},
+        '5': {'method': 'execute', 'ln': '5'}
+    })
+    line = tree['0']
 
     patch.object(Story, 'execute_block', new=async_mock())
     patch.object(story, 'resolve', return_value=True)
     side_effect = [
-        {'method': 'elif', 'ln': '1'},  # This is just to test the while loop,
-        {'method': 'elif', 'ln': '2'},  # and that we're jumping blocks.
-        {'method': 'elif', 'ln': '3'},
-        {'method': 'else', 'ln': '4'},
-        {'method': 'execute', 'ln': '5'},
-        {'method': 'execute', 'ln': '5'},  # Only because it's called twice.
+        tree['1'],  # This is just to test the while loop,
+        tree['2'],  # and that we're jumping blocks.
+        tree['3'],
+        tree['4'],
+        tree['5'],
+        tree['5'],  # Only because it's called twice.
     ]
     if no_more_blocks:
         side_effect = [None]
@@ -174,84 +238,273 @@ async def test_lexicon_if(patch, logger, story, async_mock,
         if method == 'else':
             story.resolve.assert_not_called()
         else:
-            story.resolve.assert_called_with(line['args'][0], encode=False)
+            story.resolve.assert_called_with(line.args[0], encode=False)
         Story.execute_block.mock.assert_called_with(logger, story, line)
 
         if no_more_blocks:
             assert result is None
         else:
-            assert result == '5'
+            assert result == tree['5']
 
 
 @mark.parametrize('method', ['if', 'elif'])
 @mark.asyncio
 async def test_lexicon_if_false(patch, logger, story, async_mock,
-                                method):
-    line = {
-        'method': method,
-        'args': [True],
-        'next': '2'
-    }
+                                compile_tree, method):
+    tree = compile_tree({
+        '1': {'method': method, 'ln': '1', 'args': [True], 'next': '2'},
+        '2': {'method': 'execute', 'ln': '2'}
+    })
+    line = tree['1']
 
     patch.object(Story, 'execute_block', new=async_mock())
     patch.object(story, 'resolve', return_value=False)
-    patch.object(story, 'next_block', side_effect=[
-        {'method': 'execute', 'ln': '2'}
-    ])
+    patch.object(story, 'next_block', side_effect=[tree['2']])
 
     story.context = {}
     result = await Lexicon.if_condition(logger, story, line)
 
-    story.resolve.assert_called_with(line['args'][0], encode=False)
+    story.resolve.assert_called_with(line.args[0], encode=False)
 
     Story.execute_block.mock.assert_not_called()
 
-    assert '2' == result
+    assert tree['2'] == result
 
 
 def test_lexicon_unless(logger, story, line):
     story.context = {}
     result = Lexicon.unless_condition(logger, story, line)
     logger.log.assert_called_with('lexicon-unless', line, story.context)
-    story.resolve.assert_called_with(line['args'][0], encode=False)
-    assert result == line['exit']
+    story.resolve.assert_called_with(line.args[0], encode=False)
+    assert result == line.exit
 
 
 def test_lexicon_unless_false(logger, story, line):
     story.context = {}
     story.resolve.return_value = False
-    assert Lexicon.unless_condition(logger, story, line) == line['enter']
+    assert Lexicon.unless_condition(logger, story, line) == line.enter
 
 
 @mark.asyncio
-async def test_lexicon_for_loop(patch, logger, story, line, async_mock):
+async def test_lexicon_for_loop(patch, logger, story, raw_line, make_line,
+                                async_mock):
     patch.object(Lexicon, 'execute', new=async_mock())
     patch.object(Story, 'execute_block', new=async_mock())
-    line['args'] = [
+    raw_line['args'] = [
         {'$OBJECT': 'path', 'paths': ['elements']}
     ]
-    line['output'] = ['element']
+    raw_line['output'] = ['element']
+    line = make_line(raw_line)
     story.context = {'elements': ['one']}
     story.resolve.return_value = ['one']
     story.environment = {}
     result = await Lexicon.for_loop(logger, story, line)
     Story.execute_block.mock.assert_called_with(logger, story, line)
     assert story.context['element'] == 'one'
-    assert result == line['exit']
+    assert result == line.exit
 
 
 @mark.asyncio
-async def test_lexicon_execute_streaming_container(patch, story, async_mock):
-    line = {
-        'enter': '10',
-        'ln': '9',
-        LineConstants.service: 'foo',
-        'output': 'output',
-        'next': '11'
+async def test_lexicon_for_loop_slot(patch, logger, story, raw_line,
+                                     make_line, async_mock):
+    patch.object(Story, 'execute_block', new=async_mock())
+    raw_line['method'] = 'for'
+    raw_line['args'] = [
+        {'$OBJECT': 'path', 'paths': ['elements']}
+    ]
+    raw_line['output'] = ['element']
+    line = make_line(raw_line)
+    story.context = Context(slots={'element': line.slot})
+    story.resolve.return_value = ['one', 'two']
+    result = await Lexicon.for_loop(logger, story, line)
+    assert Story.execute_block.mock.call_count == 2
+    assert story.context.values == ['two']
+    assert result == line.exit
+
+
+@mark.asyncio
+async def test_lexicon_for_loop_stream(patch, logger, story, raw_line,
+                                       make_line, async_mock):
+    patch.object(Lexicon, 'for_stream', new=async_mock())
+
+    async def stream():
+        yield 'one'
+
+    raw_line['output'] = ['element']
+    line = make_line(raw_line)
+    story.resolve.return_value = stream()
+    result = await Lexicon.for_loop(logger, story, line)
+    Lexicon.for_stream.mock.assert_called_with(logger, story, line,
+                                               story.resolve.return_value)
+    assert result == line.exit
+
+
+@mark.asyncio
+async def test_lexicon_for_stream(patch, logger, story, raw_line,
+                                  make_line):
+    items = []
+
+    async def execute_block(logger, story, line):
+        items.append(story.context['element'])
+
+    async def stream():
+        assert items == []
+        yield 'one'
+        # The block is executed before the next item is taken.
+        assert items == ['one']
+        yield 'two'
+
+    patch.object(Story, 'execute_block', side_effect=execute_block)
+    raw_line['output'] = ['element']
+    line = make_line(raw_line)
+    story.context = {}
+    await Lexicon.for_stream(logger, story, line, stream())
+    assert items == ['one', 'two']
+
+
+@mark.asyncio
+async def test_lexicon_for_stream_closed(patch, logger, story, raw_line,
+                                         make_line):
+    closed = []
+
+    async def stream():
+        try:
+            yield 'one'
+            yield 'two'
+        finally:
+            closed.append(True)
+
+    patch.object(Story, 'execute_block', side_effect=ValueError())
+    raw_line['output'] = ['element']
+    line = make_line(raw_line)
+    story.context = {}
+    with pytest.raises(ValueError):
+        await Lexicon.for_stream(logger, story, line, stream())
+    assert closed == [True]
+
+
+@fixture
+def loop_story(magic, compile_story):
+    def loop_story(concurrency):
+        tree = {
+            '1': {'ln': '1', 'method': 'for', 'output': ['i'], 'enter': '2',
+                  'next': '2', 'exit': '4',
+                  'args': [{'$OBJECT': 'list', 'items': [1, 2, 3, 4]}]},
+            '2': {'ln': '2', 'method': 'set', 'parent': '1', 'name': ['a'],
+                  'args': [{'$OBJECT': 'path', 'paths': ['i']}], 'next': '3'},
+            '3': {'ln': '3', 'method': 'set', 'parent': '1', 'name': ['b'],
+                  'args': [{'$OBJECT': 'path', 'paths': ['a']}], 'next': '4'},
+            '4': {'ln': '4', 'method': 'set', 'name': ['c'],
+                  'args': [{'$OBJECT': 'path', 'paths': ['b']}]}
+        }
+        app = magic(yield_lines=0, yield_interval=0, story_timeout=None,
+                    story_max_lines=None, trace=Trace(16, 1.0))
+        app.stories = {'hello.story': compile_story(tree, '1')}
+        app.app_layer = {}
+        app.loop_concurrency = concurrency
+        story = Stories(app, 'hello.story', magic())
+        story.prepare({})
+        return story
+    return loop_story
+
+
+@mark.parametrize('concurrency', [1, 2, 10])
+@mark.asyncio
+async def test_lexicon_for_loop_parallel(patch, logger, loop_story,
+                                         concurrency):
+    story = loop_story(concurrency)
+    line = story.tree['1']
+    assert line.parallel
+    execute_block = Story.execute_block
+    running = []
+
+    async def slow_block(logger, story, line):
+        running.append(story)
+        # The first items finish last.
+        await asyncio.sleep(0.01 * (4 - story.context['i']))
+        assert len(running) <= concurrency
+        await execute_block(logger, story, line)
+        running.remove(story)
+
+    patch.object(Story, 'execute_block', side_effect=slow_block)
+    await Story.interpret(logger, story)
+    assert dict(story.context) == {'i': 4, 'a': 4, 'b': 4, 'c': 4,
+                                   ContextConstants.service_output: 'i'}
+    traced = [record.line for record in story.trace.dump(story.execution_id)]
+    assert sorted(traced) == ['2'] * 4 + ['3'] * 4 + ['4']
+
+
+@mark.parametrize('concurrency', [1, 4])
+@mark.asyncio
+async def test_lexicon_for_loop_parallel_conditional(logger, magic,
+                                                     compile_story,
+                                                     concurrency):
+    """
+    An iteration which doesn't assign a variable doesn't undo what an
+    iteration before it assigned.
+    """
+    tree = {
+        '1': {'ln': '1', 'method': 'set', 'name': ['total'], 'args': [0],
+              'next': '2'},
+        '2': {'ln': '2', 'method': 'for', 'output': ['item'], 'enter': '3',
+              'next': '3',
+              'args': [{'$OBJECT': 'list', 'items': [5, 1, 1]}]},
+        '3': {'ln': '3', 'method': 'if', 'parent': '2', 'enter': '4',
+              'next': '4',
+              'args': [{'$OBJECT': 'assertion', 'assertion': 'greater',
+                        'values': [{'$OBJECT': 'path', 'paths': ['item']},
+                                   2]}]},
+        '4': {'ln': '4', 'method': 'set', 'parent': '3', 'name': ['total'],
+              'args': [{'$OBJECT': 'path', 'paths': ['item']}]}
     }
+    app = magic(yield_lines=0, yield_interval=0, story_timeout=None,
+                story_max_lines=None, trace=None,
+                loop_concurrency=concurrency)
+    app.stories = {'hello.story': compile_story(tree, '1')}
+    app.app_layer = {}
+    story = Stories(app, 'hello.story', magic())
+    story.prepare({})
+    assert story.tree['2'].parallel
+    await Story.interpret(logger, story)
+    assert story.context['total'] == 5
+
+
+@mark.asyncio
+async def test_lexicon_for_loop_parallel_error(patch, logger, loop_story):
+    story = loop_story(2)
+    execute_block = Story.execute_block
+
+    async def failing_block(logger, story, line):
+        if story.context['i'] == 3:
+            raise AsyncyError()
+        await execute_block(logger, story, line)
+
+    patch.object(Story, 'execute_block', side_effect=failing_block)
+    with pytest.raises(AsyncyError):
+        await Lexicon.for_loop(logger, story, story.tree['1'])
+
+    # Only the iterations before the failing one are merged.
+    assert dict(story.context) == {'i': 2, 'a': 2, 'b': 2,
+                                   ContextConstants.service_output: 'i'}
+    assert Story.execute_block.call_count == 3
+
+
+@mark.asyncio
+async def test_lexicon_execute_streaming_container(patch, story, async_mock,
+                                                   compile_tree):
+    tree = compile_tree({
+        '9': {
+            'enter': '10',
+            'ln': '9',
+            LineConstants.service: 'foo',
+            'output': 'output',
+            'next': '10'
+        },
+        '10': {'ln': '10', 'parent': '9'}
+    })
+    line = tree['9']
 
     patch.object(Services, 'start_container', new=async_mock())
-    patch.object(Lexicon, 'next_line_or_none')
     patch.many(story, ['end_line', 'line'])
     Metrics.container_start_seconds_total = Mock()
     ret = await Lexicon.execute(story.logger, story, line)
@@ -260,9 +513,7 @@ async def test_lexicon_execute_streaming_container(patch, story, async_mock):
         line['ln'], output=Services.start_container.mock.return_value,
         assign={'paths': line.get('output')})
     Metrics.container_start_seconds_total.labels().observe.assert_called_once()
-    story.line.assert_called_with(line['next'])
-    Lexicon.next_line_or_none.assert_called_with(story.line())
-    assert ret == Lexicon.next_line_or_none()
+    assert ret == tree['10']
 
 
 @mark.parametrize('service_name', ['http', 'unknown_service'])
@@ -284,7 +535,6 @@ async def test_lexicon_when(patch, story, async_mock, service_name):
     patch.object(story, 'next_block')
 
     patch.object(Services, 'when', new=async_mock())
-    patch.object(Lexicon, 'next_line_or_none')
 
     if service_name == 'unknown_service':
         with pytest.raises(AsyncyError):
@@ -292,15 +542,7 @@ async def test_lexicon_when(patch, story, async_mock, service_name):
     else:
         ret = await Lexicon.when(story.logger, story, line)
         story.next_block.assert_called_with(line)
-        Lexicon.next_line_or_none.assert_called_with(
-            story.next_block.return_value)
-        assert ret == Lexicon.next_line_or_none.return_value
-
-
-def test_next_line_or_none():
-    line = {'ln': '10'}
-    assert Lexicon.next_line_or_none(line) == '10'
-    assert Lexicon.next_line_or_none(None) is None
+        assert ret == story.next_block.return_value
 
 
 @mark.asyncio
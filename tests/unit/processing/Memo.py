@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+
+from asyncy.processing.Memo import Memo
+
+from pytest import fixture, mark
+
+
+@fixture
+def function_line(magic):
+    return magic(id=1, pure=True)
+
+
+@mark.parametrize('scope', ['execution', 'app'])
+def test_memo_key(story, function_line, scope):
+    story.app.function_memo_scope = scope
+    key = Memo.key(story, function_line, {'b': 'b', 'a': 1, 'c': None})
+    assert key == ('hello.story', 1, (('a', 1), ('b', 'b'), ('c', None)))
+
+
+def test_memo_key_disabled(story, function_line):
+    story.app.function_memo_scope = 'off'
+    assert Memo.key(story, function_line, {}) is None
+
+
+@mark.parametrize('arguments', [{'a': []}, {'a': {}}, {'a': 1, 'b': [1]}])
+def test_memo_key_mutable(story, function_line, arguments):
+    story.app.function_memo_scope = 'execution'
+    assert Memo.key(story, function_line, arguments) is None
+
+
+def test_memo_key_impure(story, function_line):
+    story.app.function_memo_scope = 'execution'
+    function_line.pure = False
+    assert Memo.key(story, function_line, {}) is None
+
+
+def test_memo_execution(story):
+    story.app.function_memo_scope = 'execution'
+    assert Memo.hit(story, 'key') is False
+    Memo.add(story, 'key')
+    assert Memo.hit(story, 'key') is True
+    assert story.function_memo == {'key': True}
+
+
+def test_memo_app(story):
+    story.app.function_memo_scope = 'app'
+    story.app.function_memo = OrderedDict()
+    story.app.function_memo_size = 2
+    Memo.add(story, 'a')
+    Memo.add(story, 'b')
+    assert Memo.hit(story, 'a') is True
+    # b is the least recently used now.
+    Memo.add(story, 'c')
+    assert list(story.app.function_memo) == ['a', 'c']
+    assert Memo.hit(story, 'b') is False
+    assert story.function_memo == {}
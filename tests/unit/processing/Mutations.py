@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
+from asyncy.Context import read_only
 from asyncy.Exceptions import AsyncyError
 from asyncy.processing.Mutations import Mutations
+from asyncy.utils.Offload import Offload
 
 import pytest
 from pytest import mark
@@ -32,6 +34,20 @@ from pytest import mark
     [[9, 8, 2, 1, 10], 'add', 20, [9, 8, 2, 1, 10, 20], True],
     [[9, 8, 2, 1, 10], 'remove', 9, [8, 2, 1, 10], True],
     [[9, 8, 2, 1, 10], 'remove', 9999, [9, 8, 2, 1, 10], True],
+    [[1, 2, 1, 3, 2], 'unique', None, [1, 2, 3], False],
+    [[{'a': 1}, {'a': 1}, [1], [1]], 'unique', None, [{'a': 1}, [1]], False],
+    [[1, 2, 3, 4, 5], 'chunk', 2, [[1, 2], [3, 4], [5]], False],
+    [[], 'chunk', 2, [], False],
+    [[1, [2, 3], [[4]]], 'flatten', None, [1, 2, 3, [4]], False],
+    [[{'a': 1}, {'b': 2}, 3], 'pluck', 'a', [1, None, None], False],
+    [[{'k': 'x', 'v': 1}, {'k': 'y', 'v': 2}, {'k': 'x', 'v': 3}],
+     'group_by', 'k',
+     {'x': [{'k': 'x', 'v': 1}, {'k': 'x', 'v': 3}],
+      'y': [{'k': 'y', 'v': 2}]}, False],
+    [[{'k': 1}, {'k': True}, {'k': 1.0}, {'k': False}, {'k': 0}],
+     'group_by', 'k',
+     {1: [{'k': 1}, {'k': 1.0}], 'true': [{'k': True}],
+      'false': [{'k': False}], 0: [{'k': 0}]}, False],
     # --- END - list ---
 
     # --- BEGIN - string ---
@@ -60,6 +76,12 @@ from pytest import mark
     [10, '*', 7, 70, False],
     [10, '*', -7, -70, False],
     [2, '^', 10, 1024, False],
+    [[1, 2.5, -3], '+', 1, [2, 3.5, -2], False],
+    [[1, 2, 3], '-', [1, 1, 1], [0, 1, 2], False],
+    [[1, 2, 3], '*', [2, 3, 4], [2, 6, 12], False],
+    [[3, 6], '/', 3, [1.0, 2.0], False],
+    [[1, 2, 3], '^', 2, [1, 4, 9], False],
+    [[], '*', 2, [], False],
     # --- END - numbers ---
 
     # --- BEGIN - dict ---
@@ -70,6 +92,8 @@ from pytest import mark
     [{'a': '1', 'b': 2}, 'get', 'x', None, False],
     [{'a': '1', 'b': 2}, 'has', 'a', True, False],
     [{'a': '1', 'b': 2}, 'has', 'x', False, False],
+    [{'a': '1', 'b': 2}, 'merge', {'b': 3, 'c': 4},
+     {'a': '1', 'b': 3, 'c': 4}, False],
     # --- END - dict ---
 ])
 def test_mutations_mutate(story, case):
@@ -220,3 +244,156 @@ def test_mutation_int_ops(story, op):
     assert story.context['foo'] == 10
     assert Mutations.mutate(mutation, 10, story, line) == 10 + op[1]
     assert story.context['foo'] == 10 + op[1]
+
+
+def bulk_mutation(operator, operand, **arguments):
+    arguments[operator] = operand
+    return {
+        '$OBJECT': 'mutation',
+        'mutation': operator,
+        'args': [{'$OBJECT': 'argument', 'name': name,
+                  'argument': {'$OBJECT': 'value', 'value': value}}
+                 for name, value in arguments.items()]
+    }
+
+
+@mark.parametrize('operand,arguments,expected', [
+    ('age', {'greater_equal': 18}, [{'age': 18}, {'age': 40}]),
+    ('age', {'equals': 7}, [{'age': 7}]),
+    ('age', {'not_equal': 7}, [{'age': 18}, {'age': 40}, {'age': 'x'}]),
+    ('age', {'less': 18}, [{'age': 7}]),
+    (None, {'greater': 1}, [2, 3])
+])
+def test_mutations_list_filter(story, operand, arguments, expected):
+    value = [{'age': 7}, {'age': 18}, {'name': 'a'}, {'age': 40},
+             {'age': 'x'}]
+    if operand is None:
+        value = [1, 2, 3, 'a']
+
+    mutation = bulk_mutation('filter', operand, **arguments)
+    assert Mutations.mutate(mutation, value, story, None) == expected
+
+
+@mark.parametrize('arguments', [{}, {'equals': 1, 'less': 2}])
+def test_mutations_list_filter_assertion(story, arguments):
+    mutation = bulk_mutation('filter', None, **arguments)
+    with pytest.raises(AsyncyError):
+        Mutations.mutate(mutation, [1], story, None)
+
+
+def test_mutations_list_filter_compiled(story, compile_tree):
+    line = compile_tree({'1': {'ln': '1', 'args': [
+        {'$OBJECT': 'path', 'paths': ['a']},
+        bulk_mutation('filter', None, equals=2)
+    ]}})['1']
+    story.context = {}
+    assert Mutations.mutate(line.args[1], [1, 2, 2], story, line) == [2, 2]
+
+
+@mark.parametrize('operator,operand', [
+    ('chunk', 0), ('chunk', '2'), ('group_by', 'a')
+])
+def test_mutations_list_bulk_errors(story, operator, operand):
+    mutation = bulk_mutation(operator, operand)
+    with pytest.raises(AsyncyError):
+        Mutations.mutate(mutation, [{'a': [1]}], story, None)
+
+
+def test_mutations_list_unique_booleans(story):
+    mutation = bulk_mutation('unique', None)
+    result = Mutations.mutate(mutation, [1, True, 1.0, 0, False], story, None)
+    assert [(type(item), item) for item in result] == \
+        [(int, 1), (bool, True), (int, 0), (bool, False)]
+
+    value = [[1], [True], {'a': 0}, {'a': False}, [1.0]]
+    result = Mutations.mutate(mutation, value, story, None)
+    assert [repr(item) for item in result] == \
+        ['[1]', '[True]', "{'a': 0}", "{'a': False}"]
+
+
+def test_mutations_list_group_by_boolean_string(story):
+    mutation = bulk_mutation('group_by', 'a')
+    with pytest.raises(AsyncyError):
+        Mutations.mutate(mutation, [{'a': True}, {'a': 'true'}], story, None)
+
+
+def test_mutations_list_bulk_copies(story):
+    value = [[1], [1], [2]]
+    for operator in ('unique', 'flatten'):
+        result = Mutations.mutate(bulk_mutation(operator, None), value,
+                                  story, None)
+        assert result is not value
+
+    assert value == [[1], [1], [2]]
+
+
+def test_mutations_dict_merge_error(story):
+    mutation = bulk_mutation('merge', [1])
+    with pytest.raises(AsyncyError):
+        Mutations.mutate(mutation, {}, story, None)
+
+
+@mark.parametrize('value,operator,operand', [
+    ([1, 2], '+', [1]),
+    ([1, 'a'], '+', 1),
+    ([1, 2], '+', 'a'),
+    (['a', 'b'], '+', 'c'),
+    (['a'], '*', 3),
+    ([True, 1], '+', 1),
+    ([1, 2], '+', False),
+    ([1, 2], '+', [1, True]),
+    ([1, 2], '/', 0),
+    ([1, 2], '/', [1, 0.0]),
+    ([10.0], '^', 1000)
+])
+def test_mutations_list_arithmetic_errors(story, value, operator, operand):
+    mutation = bulk_mutation(operator, operand)
+    with pytest.raises(AsyncyError):
+        Mutations.mutate(mutation, value, story, None)
+
+
+def test_mutations_list_arithmetic_copies(story):
+    value = [1, 2]
+    assert Mutations.mutate(bulk_mutation('*', 2), value, story, None) == \
+        [2, 4]
+    assert value == [1, 2]
+
+
+def test_mutations_list_arithmetic_mixed(story):
+    mutation = bulk_mutation('/', [2, 0.5])
+    assert Mutations.mutate(mutation, [1, 2.0], story, None) == [0.5, 4.0]
+
+
+def test_mutations_read_only(story):
+    value = read_only({'a': [2, 1]})
+    assert Mutations.mutate(bulk_mutation('keys', None), value,
+                            story, None) == ['a']
+    with pytest.raises(AsyncyError):
+        Mutations.mutate(bulk_mutation('pop', 'a'), value, story, None)
+    assert value == {'a': [2, 1]}
+
+
+@mark.asyncio
+async def test_mutations_read_only_sort(story):
+    value = read_only([2, 1])
+    with pytest.raises(AsyncyError):
+        await Mutations.mutate_async({'mutation': 'sort'}, value, story, None)
+    assert value == [2, 1]
+
+
+@mark.asyncio
+async def test_mutations_mutate_async_sort(patch, story, async_mock):
+    patch.object(Offload, 'sort', new=async_mock())
+    value = [2, 1]
+    mutation = {'mutation': 'sort'}
+    assert await Mutations.mutate_async(mutation, value, story, None) is None
+    Offload.sort.mock.assert_called_with(story, value)
+
+
+@mark.asyncio
+async def test_mutations_mutate_async(patch, story):
+    patch.object(Mutations, 'mutate')
+    mutation = {'mutation': 'sort'}
+    result = await Mutations.mutate_async(mutation, 'abc', story, 'line')
+    Mutations.mutate.assert_called_with(mutation, 'abc', story, 'line')
+    assert result == Mutations.mutate()
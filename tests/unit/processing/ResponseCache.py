@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+
+from asyncy import Metrics
+from asyncy.processing.ResponseCache import ResponseCache
+
+from pytest import fixture, mark
+
+
+@fixture
+def cache_story(patch, story):
+    patch.object(Metrics, 'service_cache_hits')
+    patch.object(Metrics, 'service_cache_misses')
+    story.app.app_id = 'app_id'
+    story.app.responses = OrderedDict()
+    story.app.response_cache_size = 2
+    return story
+
+
+@mark.parametrize('conf,expected', [
+    ({'http': {}}, None),
+    ({'http': {'cache': {'ttl': 0}}}, None),
+    ({'http': {'cache': {'ttl': '30', 'key': ['b']}}}, (30.0, ('b',))),
+    ({'http': {'cache': {'ttl': 30}},
+      'arguments': {'b': {}, 'a': {'in': 'query'}}}, (30.0, ('a', 'b'))),
+    ({'http': {'cache': {'ttl': 30}}}, (30.0, ()))
+])
+def test_response_cache_policy(conf, expected):
+    assert ResponseCache.policy(conf) == expected
+
+
+def test_response_cache_key(patch, magic, story):
+    line = magic()
+    values = {'a': {'y': 2, 'x': 1}, 'b': 'b'}
+    patch.object(story, 'argument_by_name',
+                 side_effect=lambda line, arg: values[arg])
+    assert ResponseCache.key(story, line, 'geo', 'lookup', ('a', 'b')) \
+        == ('geo', 'lookup', '[{"x": 1, "y": 2}, "b"]')
+
+
+def test_response_cache_get_put(patch, cache_story):
+    key = ('geo', 'lookup', '[]')
+    assert ResponseCache.get(cache_story, key) is None
+    Metrics.service_cache_misses.labels.assert_called_with(
+        app_id='app_id', service='geo', command='lookup')
+
+    patch.object(ResponseCache, 'clock', return_value=100)
+    ResponseCache.put(cache_story, key, 30, 'text/plain', b'body')
+    assert ResponseCache.get(cache_story, key) == ('text/plain', b'body')
+    Metrics.service_cache_hits.labels.assert_called_with(
+        app_id='app_id', service='geo', command='lookup')
+
+    ResponseCache.clock.return_value = 130
+    assert ResponseCache.get(cache_story, key) is None
+    assert cache_story.app.responses == {}
+
+
+def test_response_cache_put_lru(patch, cache_story):
+    patch.object(ResponseCache, 'clock', return_value=100)
+    for key in ('a', 'b'):
+        ResponseCache.put(cache_story, (key, 'cmd', '[]'), 30, None, key)
+
+    ResponseCache.get(cache_story, ('a', 'cmd', '[]'))
+    ResponseCache.put(cache_story, ('c', 'cmd', '[]'), 30, None, 'c')
+    assert list(cache_story.app.responses) == [('a', 'cmd', '[]'),
+                                               ('c', 'cmd', '[]')]
+
+
+def test_response_cache_put_disabled(cache_story):
+    cache_story.app.response_cache_size = 0
+    ResponseCache.put(cache_story, ('a', 'cmd', '[]'), 30, None, b'')
+    assert cache_story.app.responses == {}
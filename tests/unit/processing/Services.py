@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 import json
 import uuid
-from collections import deque
+from collections import OrderedDict, deque
 from io import StringIO
 from unittest.mock import MagicMock, Mock
 
@@ -11,13 +11,16 @@ from asyncy.Types import StreamingService
 from asyncy.constants import ContextConstants
 from asyncy.constants.LineConstants import LineConstants as Line, LineConstants
 from asyncy.constants.ServiceConstants import ServiceConstants
-from asyncy.processing.Services import Command, Event, Service, Services
+from asyncy.processing.Services import Command, DispatchPlan, Event, \
+    Service, Services
+from asyncy.utils.HttpClients import HttpClients
 from asyncy.utils.HttpUtils import HttpUtils
+from asyncy.utils.SingleFlight import SingleFlight
 
 import pytest
 from pytest import mark
 
-from tornado.httpclient import AsyncHTTPClient, HTTPRequest, HTTPResponse
+from tornado.httpclient import HTTPRequest, HTTPResponse
 
 import ujson
 
@@ -43,6 +46,7 @@ async def test_services_execute_execute_external(patch, story, async_mock):
     patch.object(Services, 'execute_external', new=async_mock())
     assert Services.is_internal('foo_service', 'blah') is False
     line = {
+        'ln': '1',
         Line.service: 'foo_service',
         Line.command: 'foo_command',
         Line.method: 'execute'
@@ -60,6 +64,7 @@ async def test_services_execute_execute_external_inline(patch, story,
     patch.object(Services, 'get_command_conf',
                  return_value={'http': {'use_event_conn': True}})
     line = {
+        'ln': '1',
         Line.service: 'foo_service',
         Line.command: 'foo_command',
         Line.method: 'execute'
@@ -179,29 +184,16 @@ def test_resolve_chain(story):
 @mark.parametrize('location', ['requestBody', 'query', 'path', 'invalid_loc'])
 @mark.parametrize('method', ['POST', 'GET'])
 @mark.asyncio
-async def test_services_execute_http(patch, story, async_mock,
+async def test_services_execute_http(patch, story, async_mock, compile_tree,
                                      location, method):
     chain = deque([Service(name='service'), Command(name='cmd')])
-    patch.object(Containers, 'get_hostname',
-                 new=async_mock(return_value='container_host'))
-
-    command_conf = {
-        'http': {
-            'method': method.lower(),
-            'port': 2771,
-            'path': '/invoke'
-        },
-        'arguments': {
-            'foo': {
-                'in': location
-            }
-        }
-    }
+    plan = http_plan(chain, hostname='container_host', port=2771,
+                     method=method.lower(), arguments={'foo': location})
 
     patch.object(story, 'argument_by_name', return_value='bar')
 
     if location == 'path':
-        command_conf['http']['path'] = '/invoke/{foo}'
+        plan = plan._replace(path='/invoke/{foo}')
         expected_url = 'http://container_host:2771/invoke/bar'
     elif location == 'query':
         expected_url = 'http://container_host:2771/invoke?foo=bar'
@@ -221,12 +213,9 @@ async def test_services_execute_http(patch, story, async_mock,
             'Content-Type': 'application/json; charset=utf-8'
         }
 
-    line = {
-        'ln': '1'
-    }
+    line = compile_tree({'1': {'ln': '1', 'args': [path('foo')]}})['1']
 
-    patch.init(AsyncHTTPClient)
-    client = AsyncHTTPClient()
+    client = HttpClients.get('services')
     response = HTTPResponse(HTTPRequest(url=expected_url), 200,
                             buffer=StringIO('{"foo": "\U0001f44d"}'),
                             headers={'Content-Type': 'application/json'})
@@ -237,15 +226,16 @@ async def test_services_execute_http(patch, story, async_mock,
     if location == 'invalid_loc' or \
             (location == 'requestBody' and method == 'GET'):
         with pytest.raises(AsyncyError):
-            await Services.execute_http(story, line, chain, command_conf)
+            await Services.execute_http(story, line, plan)
         return
     else:
-        ret = await Services.execute_http(story, line, chain, command_conf)
+        ret = await Services.execute_http(story, line, plan)
 
     assert ret == {'foo': '\U0001f44d'}
 
     HttpUtils.fetch_with_retry.mock.assert_called_with(
-        3, story.logger, expected_url, client, expected_kwargs)
+        3, story.logger, expected_url, client, expected_kwargs,
+        deadline=story.deadline)
 
     # Additionally, test for other scenarios.
     response = HTTPResponse(HTTPRequest(url=expected_url), 200,
@@ -254,7 +244,7 @@ async def test_services_execute_http(patch, story, async_mock,
     patch.object(HttpUtils, 'fetch_with_retry',
                  new=async_mock(return_value=response))
 
-    ret = await Services.execute_http(story, line, chain, command_conf)
+    ret = await Services.execute_http(story, line, plan)
     assert ret == 'foo'
 
     response = HTTPResponse(HTTPRequest(url=expected_url), 500)
@@ -263,7 +253,90 @@ async def test_services_execute_http(patch, story, async_mock,
                  new=async_mock(return_value=response))
 
     with pytest.raises(AsyncyError):
-        await Services.execute_http(story, line, chain, command_conf)
+        await Services.execute_http(story, line, plan)
+
+
+@mark.asyncio
+async def test_services_execute_http_cache(patch, story, async_mock,
+                                           compile_tree):
+    story.app.responses = OrderedDict()
+    story.app.response_cache_size = 10
+    line = compile_tree({'1': {'ln': '1', 'args': [path('foo')]}})['1']
+    plan = http_plan(deque([Service('service'), Command('cmd')]),
+                     method='get', arguments={'foo': 'query'},
+                     cache=(60.0, ('foo',)))
+    patch.object(story, 'argument_by_name', return_value='bar')
+    response = HTTPResponse(HTTPRequest(url='http://hostname:5000/invoke'),
+                            200, buffer=StringIO('{"foo": "bar"}'),
+                            headers={'Content-Type': 'application/json'})
+    patch.object(HttpUtils, 'fetch_with_retry',
+                 new=async_mock(return_value=response))
+
+    first = await Services.execute_http(story, line, plan)
+    second = await Services.execute_http(story, line, plan)
+    assert first == second == {'foo': 'bar'}
+    assert first is not second
+    assert HttpUtils.fetch_with_retry.mock.call_count == 1
+    assert list(story.app.responses) == [('service', 'cmd', '["bar"]')]
+
+
+@mark.parametrize('method,coalesced', [('get', True), ('post', False)])
+@mark.asyncio
+async def test_services_execute_http_coalesce(patch, story, async_mock,
+                                              compile_tree, method,
+                                              coalesced):
+    line = compile_tree({'1': {'ln': '1'}})['1']
+    plan = http_plan(deque([Service('service'), Command('cmd')]),
+                     method=method, coalesce=True)
+    response = HTTPResponse(HTTPRequest(url='http://hostname:5000/invoke'),
+                            200, buffer=StringIO('foo'), headers={})
+    patch.object(HttpUtils, 'fetch_with_retry',
+                 new=async_mock(return_value=response))
+    patch.object(SingleFlight, 'run', new=async_mock(return_value=response))
+
+    assert await Services.execute_http(story, line, plan) == 'foo'
+    if coalesced:
+        SingleFlight.run.mock.assert_called_with(
+            ('services', 'http://hostname:5000/invoke'),
+            HttpUtils.fetch_with_retry, 3, story.logger,
+            'http://hostname:5000/invoke', HttpClients.get('services'),
+            {'method': 'GET'}, deadline=story.deadline)
+        HttpUtils.fetch_with_retry.mock.assert_not_called()
+    else:
+        SingleFlight.run.mock.assert_not_called()
+        HttpUtils.fetch_with_retry.mock.assert_called_once()
+
+
+def path(*paths):
+    return {'$OBJECT': 'path', 'paths': list(paths)}
+
+
+def http_plan(chain, hostname='hostname', port=5000, method='post',
+              path='/invoke', arguments=None, cache=None, coalesce=False):
+    return DispatchPlan(chain, 'http', {}, 'container', hostname, port,
+                        method, path, arguments or {}, cache, coalesce)
+
+
+@mark.parametrize('static', [True, False])
+def test_services_http_request(patch, story, compile_tree, static):
+    arg = {'$OBJECT': 'string', 'string': 'bar'} if static else path('foo')
+    line = compile_tree({'1': {'ln': '1', 'args': [
+        {'$OBJECT': 'argument', 'name': 'foo', 'argument': arg}
+    ]}})['1']
+    plan = http_plan(deque([Service('service'), Command('cmd')]),
+                     arguments={'foo': 'requestBody'})
+    patch.object(story, 'argument_by_name', return_value='bar')
+
+    expected = ('POST', '/invoke', '{"foo": "bar"}')
+    assert Services.http_request(story, line, plan) == expected
+    assert Services.http_request(story, line, plan) == expected
+
+    if static:
+        assert story.app.prepared_requests == {line: expected}
+        story.argument_by_name.assert_called_once_with(line, 'foo')
+    else:
+        assert story.app.prepared_requests == {}
+        assert story.argument_by_name.call_count == 2
 
 
 @mark.asyncio
@@ -275,8 +348,10 @@ async def test_services_start_container(patch, story, async_mock):
         Line.command: 'echo'
     }
     patch.object(Containers, 'start', new=async_mock())
+    patch.object(Containers, 'get_container_name',
+                 return_value='asyncy-alpine')
     ret = await Services.start_container(story, line)
-    Containers.start.mock.assert_called_with(story, line)
+    Containers.start.mock.assert_called_with(story, line, 'asyncy-alpine')
     assert ret == Containers.start.mock.return_value
 
 
@@ -332,16 +407,46 @@ async def test_services_execute_external_http(patch, story, async_mock):
 
     patch.object(Services, 'execute_http', new=async_mock())
     patch.object(Services, 'start_container', new=async_mock())
+    patch.object(Containers, 'get_container_name',
+                 return_value='asyncy-cups')
+    patch.object(Containers, 'get_hostname',
+                 new=async_mock(return_value='cups_host'))
 
     ret = await Services.execute_external(story, line)
+    chain = deque([Service(name='cups'), Command(name='print')])
     Services.execute_http.mock.assert_called_with(
         story, line,
-        deque([Service(name='cups'), Command(name='print')]),
-        {'http': {}})
+        DispatchPlan(chain, 'http', {'http': {}}, 'asyncy-cups',
+                     'cups_host', 5000, 'post', None, {}, None, False))
     assert ret == await Services.execute_http()
     Services.start_container.mock.assert_called()
 
 
+@mark.asyncio
+async def test_services_execute_external_forget(patch, story, async_mock):
+    line = {
+        'ln': '1',
+        Line.service: 'cups',
+        Line.command: 'print',
+        Line.method: 'execute'
+    }
+    story.app.services = {
+        'cups': {ServiceConstants.config: {'actions': {'print': {
+            'format': {}
+        }}}}
+    }
+    story.app.containers = {'asyncy-cups': 'cups_host'}
+
+    patch.object(Containers, 'get_container_name',
+                 return_value='asyncy-cups')
+    patch.object(Containers, 'exec', new=async_mock(side_effect=AsyncyError))
+    patch.object(Services, 'start_container', new=async_mock())
+
+    with pytest.raises(AsyncyError):
+        await Services.execute_external(story, line)
+    assert story.app.containers == {}
+
+
 @mark.asyncio
 async def test_services_execute_external_unknown(patch, story, async_mock):
     line = {
@@ -382,6 +487,98 @@ def test_service_get_command_conf_simple(story):
     assert Services.get_command_conf(story, chain) == {'x': 'y'}
 
 
+@mark.asyncio
+async def test_services_plan(patch, story, async_mock, compile_tree):
+    line = compile_tree({'1': {
+        'ln': '1',
+        Line.service: 'cups',
+        Line.command: 'print',
+        Line.method: 'execute'
+    }})['1']
+    story.app.services = {
+        'cups': {
+            ServiceConstants.config: {
+                'actions': {
+                    'print': {
+                        'http': {'method': 'get', 'port': 80,
+                                 'path': '/print'},
+                        'arguments': {'copies': {'in': 'query'},
+                                      'text': {}}
+                    }
+                }
+            }
+        }
+    }
+    patch.object(Services, 'resolve_chain',
+                 return_value=deque([Service('cups'), Command('print')]))
+    patch.object(Containers, 'get_container_name',
+                 return_value='asyncy-cups')
+    patch.object(Containers, 'get_hostname',
+                 new=async_mock(return_value='cups_host'))
+
+    plan = await Services.plan(story, line)
+    assert plan.kind == 'http'
+    assert plan.container_name == 'asyncy-cups'
+    assert (plan.hostname, plan.port, plan.method, plan.path) \
+        == ('cups_host', 80, 'get', '/print')
+    assert plan.arguments == {'copies': 'query', 'text': 'requestBody'}
+    assert plan.cache is None
+    assert plan.coalesce is False
+    assert story.app.dispatch_plans == {line: plan}
+
+    assert await Services.plan(story, line) is plan
+    Services.resolve_chain.assert_called_once_with(story, line)
+    Containers.get_container_name.assert_called_once()
+
+
+@mark.asyncio
+async def test_services_plan_internal(story, async_mock):
+    Services.register_internal('my_service', 'my_command', {}, 'any',
+                               async_mock())
+    line = {
+        Line.service: 'my_service',
+        Line.command: 'my_command',
+        Line.method: 'execute'
+    }
+    plan = await Services.plan(story, line)
+    assert plan.kind == 'internal'
+    assert plan.container_name is None
+    assert story.app.dispatch_plans == {}
+
+
+def test_service_get_command_conf_missing(story):
+    story.app.services = {
+        'service': {'configuration': {'actions': {'cmd': {'x': 'y'}}}}
+    }
+    chain = deque([Service('service'), Command('stream'), Event('updates')])
+    assert Services.get_command_conf(story, chain) == {}
+    chain = deque([Service('other'), Command('cmd')])
+    assert Services.get_command_conf(story, chain) == {}
+
+
+@mark.asyncio
+async def test_services_start_container_streaming(patch, story, async_mock):
+    """
+    The command of a streaming line needn't be declared in the OMG.
+    """
+    line = {
+        'ln': '1',
+        Line.service: 'alpine',
+        Line.command: 'stream',
+        Line.method: 'execute',
+        Line.enter: '2'
+    }
+    story.app.services = {'alpine': {ServiceConstants.config: {
+        'actions': {'echo': {'format': {}}}
+    }}}
+    patch.object(Containers, 'start', new=async_mock())
+
+    ret = await Services.start_container(story, line)
+    container_name = Containers.get_container_name(story, line, 'alpine')
+    Containers.start.mock.assert_called_with(story, line, container_name)
+    assert ret == Containers.start.mock.return_value
+
+
 @mark.asyncio
 async def test_start_container_http(story):
     line = {
@@ -529,7 +726,6 @@ async def test_when(patch, story, async_mock, service_name):
         'headers': {'Content-Type': 'application/json; charset=utf-8'}
     }
 
-    patch.init(AsyncHTTPClient)
     patch.object(story, 'next_block')
     patch.object(story.app, 'add_subscription')
     patch.object(story, 'argument_by_name', return_value='bar')
@@ -539,10 +735,11 @@ async def test_when(patch, story, async_mock, service_name):
                  new=async_mock(return_value=http_res))
     ret = await Services.when(streaming_service, story, line)
 
-    client = AsyncHTTPClient()
+    client = HttpClients.get('synapse')
 
     HttpUtils.fetch_with_retry.mock.assert_called_with(
-        3, story.logger, expected_url, client, expected_kwargs)
+        3, story.logger, expected_url, client, expected_kwargs,
+        deadline=story.deadline)
 
     story.app.add_subscription.assert_called_with(
         'my_guid_here', story.context[service_name],
@@ -1,18 +1,21 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import collections
 import time
 from unittest import mock
 
 from asyncy import Metrics
+from asyncy.Compiler import Compiler
 from asyncy.Containers import Containers
-from asyncy.Exceptions import AsyncyError
+from asyncy.Exceptions import AsyncyError, DeadlineExceededError
 from asyncy.Stories import Stories
 from asyncy.constants import ContextConstants
 from asyncy.processing import Lexicon, Story
+from asyncy.processing.Codegen import Codegen
 from asyncy.utils import Dict
 
 import pytest
-from pytest import mark
+from pytest import fixture, mark
 
 
 def test_story_story(patch, app, logger):
@@ -26,134 +29,306 @@ def test_story_story(patch, app, logger):
 async def test_story_execute(patch, app, logger, story, async_mock):
     patch.object(Story, 'execute_line', new=async_mock(return_value=None))
     patch.object(Stories, 'first_line')
+    patch.object(story, 'line')
     story.prepare()
     await Story.execute(logger, story)
     assert Stories.first_line.call_count == 1
+    story.line.assert_called_with(Stories.first_line())
     logger.log.assert_called_with('story-execution', None)
-    Story.execute_line.mock.assert_called_with(logger,
-                                               story, Stories.first_line())
+    Story.execute_line.mock.assert_called_with(logger, story, story.line())
 
 
+@mark.parametrize('generated', [True, False])
 @mark.asyncio
-async def test_story_execute_function(patch, logger, story, async_mock):
-    line = {'function': 'my_super_awesome_function'}
+async def test_story_execute_promoted(patch, logger, story, async_mock,
+                                      generated):
+    patch.object(Codegen, 'promote',
+                 return_value='generated' if generated else None)
+    patch.object(Codegen, 'execute', new=async_mock())
+    patch.object(Story, 'interpret', new=async_mock())
+    await Story.execute(logger, story)
+    Codegen.promote.assert_called_with(story)
+    if generated:
+        Codegen.execute.mock.assert_called_with(logger, story, 'generated')
+        Story.interpret.mock.assert_not_called()
+    else:
+        Story.interpret.mock.assert_called_with(logger, story)
+        Codegen.execute.mock.assert_not_called()
+
+
+@mark.asyncio
+async def test_story_execute_follows_lines(patch, logger, story,
+                                           async_mock, compile_tree):
+    story.tree = compile_tree({
+        '1': {'ln': '1', 'next': '2'},
+        '2': {'ln': '2'}
+    })
+    story.entrypoint = '1'
+    returns = {'1': story.tree['2'], '2': None}
+    patch.object(Story, 'execute_line', new=async_mock(
+        side_effect=lambda logger, story, line: returns[line.ln]))
+
+    await Story.execute(logger, story)
+
+    assert Story.execute_line.mock.mock_calls == [
+        mock.call(logger, story, story.tree['1']),
+        mock.call(logger, story, story.tree['2'])
+    ]
+
+
+@mark.asyncio
+async def test_story_execute_function(patch, logger, story, async_mock,
+                                      compile_tree):
+    tree = compile_tree({
+        '0': {'ln': '0', 'method': 'function',
+              'function': 'my_super_awesome_function'},
+        '1': {'ln': '1', 'method': 'call',
+              'function': 'my_super_awesome_function', 'next': '2'},
+        '2': {'ln': '2'}
+    })
+    line = tree['1']
     patch.many(story, ['function_line_by_name',
                        'context_for_function_call', 'set_context'])
     patch.object(Story, 'execute_block', new=async_mock())
     first_context = {'first': 'context'}
 
     story.context = first_context
-    await Story.execute_function(logger, story, line)
+    ret = await Story.execute_function(logger, story, line)
 
-    story.function_line_by_name.assert_called_with(line['function'])
-    story.context_for_function_call \
-        .assert_called_with(line, story.function_line_by_name())
+    story.function_line_by_name.assert_not_called()
+    story.context_for_function_call.assert_called_with(line)
 
     assert story.set_context.mock_calls == [
         mock.call(story.context_for_function_call()),
         mock.call(first_context)
     ]
 
-    Story.execute_block.mock \
-        .assert_called_with(logger, story, story.function_line_by_name())
+    Story.execute_block.mock.assert_called_with(logger, story, tree['0'])
+    assert ret == tree['2']
 
 
+@mark.parametrize('scope', ['off', 'execution'])
 @mark.asyncio
-async def test_story_execute_line_unknown_method(logger, story):
-    story.tree['1']['method'] = 'foo_method'
+async def test_story_execute_function_memo(patch, logger, story, async_mock,
+                                           compile_story, scope):
+    story.compiled = compile_story({
+        '0': {'ln': '0', 'method': 'function', 'function': 'f', 'enter': '1',
+              'args': [{'$OBJECT': 'argument', 'name': 'x',
+                        'argument': {'$OBJECT': 'type', 'type': 'int'}}]},
+        '1': {'ln': '1', 'method': 'set', 'parent': '0', 'name': ['y']},
+        '2': {'ln': '2', 'method': 'call', 'function': 'f', 'next': '3',
+              'args': [{'$OBJECT': 'argument', 'name': 'x',
+                        'argument': {'$OBJECT': 'path', 'paths': ['x']}}]},
+        '3': {'ln': '3'}
+    })
+    tree = story.compiled.tree
+    story.app.function_memo_scope = scope
+    story.prepare({'x': 1})
+    patch.object(Story, 'execute_block', new=async_mock())
+
+    for x in (1, 1, 2, 1):
+        story.context['x'] = x
+        assert await Story.execute_function(logger, story, tree['2']) \
+            == tree['3']
+
+    calls = 2 if scope == 'execution' else 4
+    assert Story.execute_block.mock.call_count == calls
+
+
+@mark.asyncio
+async def test_story_execute_function_memo_error(patch, logger, story,
+                                                 compile_story):
+    story.compiled = compile_story({
+        '0': {'ln': '0', 'method': 'function', 'function': 'f'},
+        '1': {'ln': '1', 'method': 'call', 'function': 'f'}
+    })
+    tree = story.compiled.tree
+    story.app.function_memo_scope = 'execution'
+    story.prepare()
+    patch.object(Story, 'execute_block', side_effect=AsyncyError())
+    for _ in range(2):
+        with pytest.raises(AsyncyError):
+            await Story.execute_function(logger, story, tree['1'])
+
+    assert story.function_memo == {}
+
+
+@mark.asyncio
+async def test_story_execute_function_undeclared(patch, logger, story,
+                                                 async_mock, compile_tree):
+    line = compile_tree({
+        '1': {'ln': '1', 'method': 'call', 'function': 'foo'}
+    })['1']
+    patch.object(Story, 'execute_block', new=async_mock())
     with pytest.raises(AsyncyError):
-        await Story.execute_line(logger, story, '1')
+        await Story.execute_function(logger, story, line)
 
+    Story.execute_block.mock.assert_not_called()
 
-Method = collections.namedtuple('Method', 'name lexicon_name async_mock')
+
+@mark.asyncio
+async def test_story_execute_line_unknown_method(logger, story,
+                                                 compile_tree):
+    line = compile_tree({'1': {'ln': '1', 'method': 'foo_method'}})['1']
+    with pytest.raises(AsyncyError):
+        await Story.execute_line(logger, story, line)
+
+
+Method = collections.namedtuple('Method', 'name handler')
 
 
 @mark.parametrize('method', [
-    Method(name='if', lexicon_name='if_condition', async_mock=True),
-    Method(name='elif', lexicon_name='if_condition', async_mock=True),
-    Method(name='else', lexicon_name='if_condition', async_mock=True),
-    Method(name='for', lexicon_name='for_loop', async_mock=True),
-    Method(name='execute', lexicon_name='execute', async_mock=True),
-    Method(name='set', lexicon_name='set', async_mock=True),
-    Method(name='function', lexicon_name='function', async_mock=True),
-    Method(name='when', lexicon_name='when', async_mock=True)
+    Method(name='if', handler=Lexicon.if_condition),
+    Method(name='elif', handler=Lexicon.if_condition),
+    Method(name='else', handler=Lexicon.if_condition),
+    Method(name='for', handler=Lexicon.for_loop),
+    Method(name='execute', handler=Lexicon.execute),
+    Method(name='set', handler=Lexicon.set),
+    Method(name='call', handler=Story.execute_function),
+    Method(name='function', handler=Lexicon.function),
+    Method(name='when', handler=Lexicon.when)
 ])
+def test_story_handlers(compile_tree, method):
+    assert Compiler.handlers[method.name] == method.handler
+    line = compile_tree({'1': {'ln': '1', 'method': method.name}})['1']
+    assert line.handler == method.handler
+
+
 @mark.asyncio
 async def test_story_execute_line_generic(patch, logger, story,
-                                          async_mock, method):
-    if method.async_mock:
-        patch.object(Lexicon, method.lexicon_name, new=async_mock())
-    else:
-        patch.object(Lexicon, method.lexicon_name)
-
-    patch.object(story, 'line', return_value={'method': method.name})
+                                          async_mock, compile_tree):
+    line = compile_tree({'1': {'ln': '1', 'method': 'set'}})['1']
+    line.handler = async_mock()
     patch.object(story, 'start_line')
-    result = await Story.execute_line(logger, story, '1')
+    result = await Story.execute_line(logger, story, line)
 
-    mock = getattr(Lexicon, method.lexicon_name)
-    if method.async_mock:
-        mock = mock.mock
+    line.handler.mock.assert_called_with(logger, story, line)
+    assert result == line.handler.mock.return_value
+    story.start_line.assert_called_with('1')
 
-    mock.assert_called_with(logger, story, story.line.return_value)
-    assert result == mock.return_value
 
-    story.line.assert_called_with('1')
-    story.start_line.assert_called_with('1')
+@mark.parametrize('tick', [True, False])
+@mark.asyncio
+async def test_story_execute_line_pause(patch, logger, story, async_mock,
+                                        compile_tree, tick):
+    line = compile_tree({'1': {'ln': '1', 'method': 'set'}})['1']
+    line.handler = async_mock()
+    patch.object(story, 'tick', return_value=tick)
+    patch.object(story, 'pause', new=async_mock())
+    await Story.execute_line(logger, story, line)
+    assert story.pause.mock.called is tick
 
 
 @mark.asyncio
-async def test_story_execute_line_call(patch, logger, story, async_mock):
-    patch.object(Story, 'execute_function', new=async_mock())
-    patch.object(story, 'line', return_value={'method': 'call'})
+async def test_story_execute_line_group(patch, logger, story, async_mock,
+                                        compile_tree):
+    line = compile_tree({'1': {'ln': '1', 'method': 'execute'}})['1']
+    line.group = (line,)
+    patch.object(Story, 'execute_group', new=async_mock())
+    result = await Story.execute_line(logger, story, line)
+    Story.execute_group.mock.assert_called_with(logger, story, line)
+    assert result == Story.execute_group.mock.return_value
+
+
+@fixture
+def group(compile_tree):
+    tree = compile_tree({
+        str(ln): {'ln': str(ln), 'method': 'execute', 'service': f's{ln}',
+                  'command': 'run', 'next': str(ln + 1)}
+        for ln in range(1, 5)
+    })
+    assert tree['1'].group == (tree['1'], tree['2'], tree['3'], tree['4'])
+    return tree
+
+
+@mark.asyncio
+async def test_story_execute_group(patch, logger, story, group):
+    finished = []
+
+    async def execute_service(story, line):
+        # The later lines finish first.
+        await asyncio.sleep(0.01 * (4 - int(line.ln)))
+        finished.append(line.ln)
+        return line.ln
+
+    patch.object(Lexicon, 'execute_service', side_effect=execute_service)
+    patch.object(Lexicon, 'assign_output')
     patch.object(story, 'start_line')
-    result = await Story.execute_line(logger, story, '1')
 
-    Story.execute_function.mock.assert_called_with(logger, story,
-                                                   story.line.return_value)
-    assert result == Story.execute_function.mock.return_value
+    assert await Story.execute_group(logger, story, group['1']) is None
+    assert finished == ['4', '3', '2', '1']
+    assert [c[0][0] for c in story.start_line.call_args_list] == \
+        ['1', '2', '3', '4']
+    assert Lexicon.assign_output.call_args_list == [
+        mock.call(story, group[ln], ln) for ln in '1234'
+    ]
 
-    story.line.assert_called_with('1')
-    story.start_line.assert_called_with('1')
+
+@mark.parametrize('error', [AsyncyError(), ValueError()])
+@mark.asyncio
+async def test_story_execute_group_error(patch, logger, story, group,
+                                         async_mock, error):
+    async def execute_service(story, line):
+        if line.ln == '2':
+            raise error
+        return line.ln
+
+    patch.object(Lexicon, 'execute_service', side_effect=execute_service)
+    patch.object(Lexicon, 'assign_output')
+    patch.object(story, 'start_line')
+
+    with pytest.raises(AsyncyError) as e:
+        await Story.execute_group(logger, story, group['1'])
+
+    if isinstance(error, AsyncyError):
+        assert e.value is error
+    else:
+        assert e.value.line is group['2']
+        assert e.value.__cause__ is error
+
+    # All the services were called, but only the lines before the error
+    # are assigned.
+    assert Lexicon.execute_service.call_count == 4
+    Lexicon.assign_output.assert_called_once_with(story, group['1'], '1')
 
 
 @mark.asyncio
-async def test_story_execute_block(patch, logger, story, async_mock):
-    story.tree = {
+async def test_story_execute_block(patch, logger, story, async_mock,
+                                   compile_tree):
+    story.tree = compile_tree({
         '1': {'ln': '1', 'next': '2'},
         '2': {'ln': '2', 'next': '3', 'enter': '3', 'output': ['foo_client']},
         '3': {'ln': '3', 'next': '4', 'parent': '2'},
         '4': {'ln': '4', 'next': '5', 'parent': '2', 'enter': '5'},
         '5': {'ln': '5', 'next': '6', 'parent': '4'},
-        '6': {'ln': '6', 'parent': '2'}
+        '6': {'ln': '6', 'parent': '2', 'next': '7'},
+        '7': {'ln': '7'}
+    })
+
+    # Nested blocks are skipped by their own handler.
+    returns = {
+        '3': story.tree['4'],
+        '4': story.tree['6'],
+        '6': story.tree['7']
     }
+    patch.object(Story, 'execute_line', new=async_mock(
+        side_effect=lambda logger, story, line: returns[line.ln]))
 
-    patch.object(Story, 'execute_line', new=async_mock())
-    patch.object(story, 'next_block', return_value=story.tree['6'])
-
-    line = story.line
     story.context = {
         ContextConstants.service_event: {'data': {'foo': 'bar'}}
     }
 
-    def proxy_line(*args):
-        return line(*args)
-
-    patch.object(story, 'line', side_effect=proxy_line)
-
     await Story.execute_block(logger, story, story.tree['2'])
 
     assert story.context[ContextConstants.service_output] == 'foo_client'
     assert story.context['foo_client'] \
         == story.context[ContextConstants.service_event]['data']
 
-    story.next_block.assert_called_with(story.tree['4'])
-    assert [
-        mock.call('3'),
-        mock.call('4'),
-        mock.call('5'),
-        mock.call('6'),
-        mock.call(None)
-    ] == story.line.mock_calls
+    assert Story.execute_line.mock.mock_calls == [
+        mock.call(logger, story, story.tree['3']),
+        mock.call(logger, story, story.tree['4']),
+        mock.call(logger, story, story.tree['6'])
+    ]
 
 
 @mark.asyncio
@@ -161,6 +336,7 @@ async def test_story_run(patch, app, logger, async_mock, magic):
     patch.object(time, 'time')
     patch.object(Story, 'execute', new=async_mock())
     patch.object(Story, 'story')
+    Story.story().deadline = None
     assert Metrics.story_run_total is not None
     assert Metrics.story_run_success is not None
     Metrics.story_run_total = magic()
@@ -170,6 +346,8 @@ async def test_story_run(patch, app, logger, async_mock, magic):
     Story.story.assert_called_with(app, logger, 'story_name')
     Story.story.return_value.prepare.assert_called_with(None)
     Story.execute.mock.assert_called_with(logger, Story.story())
+    app.activate.assert_called_once()
+    app.deactivate.assert_called_once()
 
     Metrics.story_run_total.labels.assert_called_with(app_id=app.app_id,
                                                       story_name='story_name')
@@ -193,8 +371,10 @@ async def test_story_run_metrics_exc(patch, app, logger, async_mock, magic):
 
     patch.object(Story, 'execute', new=async_mock(side_effect=exc))
     patch.object(Story, 'story')
+    Story.story().deadline = None
     with pytest.raises(Exception):
         await Story.run(app, logger, 'story_name')
+    app.deactivate.assert_called_once()
     Story.story.assert_called_with(app, logger, 'story_name')
     Story.story.return_value.prepare.assert_called_with(None)
     Story.execute.mock.assert_called_with(logger, Story.story())
@@ -212,6 +392,7 @@ async def test_story_run_metrics_exc(patch, app, logger, async_mock, magic):
 async def test_story_run_logger(patch, app, logger, async_mock):
     patch.object(Story, 'execute', new=async_mock())
     patch.object(Story, 'story')
+    Story.story().deadline = None
     await Story.run(app, logger, 'story_name')
     assert logger.log.call_count == 2
 
@@ -226,6 +407,7 @@ def test_story_save_logger(logger, story):
 async def test_story_run_with_id(patch, app, logger, async_mock):
     patch.object(Story, 'execute', new=async_mock())
     patch.object(Story, 'story')
+    Story.story().deadline = None
     await Story.run(app, logger, 'story_name', story_id='story_id')
 
 
@@ -233,6 +415,7 @@ async def test_story_run_with_id(patch, app, logger, async_mock):
 async def test_story_run_prepare_function(patch, app, logger, async_mock):
     patch.object(Story, 'execute_function', new=async_mock())
     patch.object(Story, 'story')
+    Story.story().deadline = None
     function_name = 'function_name'
     await Story.run(app, logger, 'story_name',
                     context='context', function_name=function_name)
@@ -247,6 +430,7 @@ async def test_story_run_prepare_function(patch, app, logger, async_mock):
 async def test_story_run_prepare_block(patch, app, logger, async_mock):
     patch.object(Story, 'execute_block', new=async_mock())
     patch.object(Story, 'story')
+    Story.story().deadline = None
     block = '1'
     await Story.run(app, logger, 'story_name',
                     context='context', block=block)
@@ -261,6 +445,7 @@ async def test_story_run_prepare_block(patch, app, logger, async_mock):
 async def test_story_run_prepare(patch, app, logger, async_mock):
     patch.object(Story, 'execute', new=async_mock())
     patch.object(Story, 'story')
+    Story.story().deadline = None
     await Story.run(app, logger, 'story_name',
                     context='context')
     Story.story().prepare.assert_called_with('context')
@@ -269,11 +454,44 @@ async def test_story_run_prepare(patch, app, logger, async_mock):
 
 
 @mark.asyncio
-async def test_story_execute_does_not_wrap(patch, story, async_mock):
+async def test_story_execute_line_cancelled(story, async_mock,
+                                            compile_tree):
+    line = compile_tree({'1': {'ln': '1', 'method': 'execute'}})['1']
+    line.handler = async_mock(side_effect=asyncio.CancelledError())
+    with pytest.raises(asyncio.CancelledError):
+        await Story.execute_line(story.logger, story, line)
+
+
+@mark.asyncio
+async def test_story_run_deadline(patch, app, logger, magic):
+    patch.object(Story, 'story')
+    Story.story().deadline.remaining.return_value = 0.01
+    cancelled = []
+
+    async def execute(logger, story):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    patch.object(Story, 'execute', side_effect=execute)
+    Metrics.story_run_failure = magic()
+    with pytest.raises(DeadlineExceededError):
+        await Story.run(app, logger, 'story_name')
+
+    await asyncio.sleep(0)  # The cancellation is delivered to the story.
+    assert cancelled == [True]
+    Metrics.story_run_failure.labels.assert_called_once()
+
+
+@mark.asyncio
+async def test_story_execute_does_not_wrap(patch, story, async_mock,
+                                           compile_tree):
     def exc(*args):
         raise AsyncyError()
 
-    patch.object(Lexicon, 'execute', new=async_mock(side_effect=exc))
-    patch.object(story, 'line', return_value={'method': 'execute'})
+    line = compile_tree({'10': {'ln': '10', 'method': 'execute'}})['10']
+    line.handler = async_mock(side_effect=exc)
     with pytest.raises(AsyncyError):
-        await Story.execute_line(story.logger, story, '10')
+        await Story.execute_line(story.logger, story, line)
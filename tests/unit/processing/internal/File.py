@@ -83,6 +83,30 @@ async def test_service_file_read_exc(patch, story, line, service_patch, exc):
         await File.file_read(story, line, resolved_args)
 
 
+@mark.asyncio
+async def test_service_file_read_lines(patch, story, line, tmpdir):
+    path = tmpdir.join('my_path')
+    path.write('a\nb\n\nc')
+    patch.object(File, 'safe_path', return_value=str(path))
+    resolved_args = {
+        'path': 'my_path'
+    }
+    stream = await File.file_read_lines(story, line, resolved_args)
+    File.safe_path.assert_called_with(story, 'my_path')
+    assert [text async for text in stream] == ['a', 'b', '', 'c']
+
+
+@mark.asyncio
+async def test_service_file_read_lines_exc(patch, story, line, exc):
+    patch.object(File, 'open', side_effect=exc)
+    resolved_args = {
+        'path': 'my_path'
+    }
+    stream = await File.file_read_lines(story, line, resolved_args)
+    with pytest.raises(AsyncyError):
+        await stream.__anext__()
+
+
 @mark.asyncio
 async def test_service_file_exists(patch, story, line):
     patch.object(os.path, 'exists')
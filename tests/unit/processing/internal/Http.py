@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
+import asyncio
 from unittest.mock import MagicMock
 
 from asyncy.Exceptions import AsyncyError
 from asyncy.processing.Services import Services
 from asyncy.processing.internal import Http
+from asyncy.utils.HttpClients import HttpClients
 from asyncy.utils.HttpUtils import HttpUtils
+from asyncy.utils.SingleFlight import SingleFlight
 
 import certifi
 
@@ -37,7 +40,6 @@ async def test_service_http_fetch(patch, story, line, json_response,
     fetch_mock = MagicMock()
     patch.object(HttpUtils, 'fetch_with_retry',
                  new=async_mock(return_value=fetch_mock))
-    patch.object(AsyncHTTPClient, '__init__', return_value=None)
     patch.object(certifi, 'where', return_value='ca_certs.pem')
     resolved_args = {
         'url': 'https://asyncy.com',
@@ -83,7 +85,7 @@ async def test_service_http_fetch(patch, story, line, json_response,
         result = await Http.http_post(story, line, resolved_args)
         HttpUtils.fetch_with_retry.mock.assert_called_with(
             3, story.logger, resolved_args['url'],
-            AsyncHTTPClient(), client_kwargs
+            HttpClients.get('fetch'), client_kwargs, deadline=story.deadline
         )
         if json_response:
             assert result == {'hello': 'world'}
@@ -91,5 +93,116 @@ async def test_service_http_fetch(patch, story, line, json_response,
             assert result == fetch_mock.body.decode('utf-8')
 
 
+@mark.parametrize('method,coalesced', [('get', True), ('post', False)])
+@mark.asyncio
+async def test_service_http_fetch_coalesce(patch, story, line, async_mock,
+                                           method, coalesced):
+    response = MagicMock(code=200, body=b'hello',
+                         headers={'Content-Type': 'text/plain'})
+    patch.object(HttpUtils, 'fetch_with_retry',
+                 new=async_mock(return_value=response))
+    patch.object(SingleFlight, 'run', new=async_mock(return_value=response))
+    patch.object(certifi, 'where', return_value='ca_certs.pem')
+    resolved_args = {'url': 'https://asyncy.com', 'method': method,
+                     'coalesce': True}
+
+    assert await Http.http_post(story, line, resolved_args) == 'hello'
+    if coalesced:
+        key = ('fetch', 'https://asyncy.com',
+               '{"User-Agent": "Asyncy/1.0-beta"}', None)
+        assert SingleFlight.run.mock.call_args[0][:2] == \
+            (key, HttpUtils.fetch_with_retry)
+        HttpUtils.fetch_with_retry.mock.assert_not_called()
+    else:
+        SingleFlight.run.mock.assert_not_called()
+        HttpUtils.fetch_with_retry.mock.assert_called_once()
+
+
+@fixture
+def streamed(patch, story):
+    story.app.config.HTTP_STREAM_BUFFER_BYTES = 1024
+
+    def streamed(code, headers, chunks):
+        def fetch(url, header_callback, streaming_callback, **kwargs):
+            # Like tornado, a callback which raises fails the request.
+            response = MagicMock(code=code, error='error')
+            future = asyncio.get_event_loop().create_future()
+            try:
+                for header in headers:
+                    header_callback(header)
+                for chunk in chunks:
+                    streaming_callback(chunk)
+            except Exception as e:
+                response = MagicMock(code=599, error=e)
+            future.set_result(response)
+            return future
+
+        patch.object(AsyncHTTPClient, 'fetch', side_effect=fetch)
+    return streamed
+
+
+@mark.asyncio
+async def test_service_http_fetch_lines(patch, story, line, streamed):
+    streamed(200, ['HTTP/1.1 302 Found\r\n', 'HTTP/1.1 200 OK\r\n',
+                   'Content-Type: text/plain\r\n'],
+             [b'a\r\nb', b'c\n\n', 'é\nd'.encode('utf-8')])
+    resolved_args = {'url': 'https://asyncy.com', 'method': 'post',
+                     'body': {'foo': 'bar'}}
+    stream = await Http.http_fetch_lines(story, line, resolved_args)
+    AsyncHTTPClient.fetch.assert_not_called()
+
+    assert [text async for text in stream] == ['a', 'bc', '', 'é', 'd']
+    kwargs = AsyncHTTPClient.fetch.call_args[1]
+    assert kwargs['method'] == 'POST'
+    assert kwargs['body'] == '{"foo": "bar"}'
+    assert kwargs['raise_error'] is False
+
+
+@mark.asyncio
+async def test_service_http_fetch_lines_error(patch, story, line, streamed):
+    streamed(500, ['HTTP/1.1 500 Internal Server Error\r\n'], [b'a\nb'])
+    resolved_args = {'url': 'https://asyncy.com'}
+    stream = await Http.http_fetch_lines(story, line, resolved_args)
+    with pytest.raises(AsyncyError):
+        await stream.__anext__()
+
+
+@mark.asyncio
+async def test_service_http_fetch_lines_overflow(patch, story, line,
+                                                 streamed):
+    story.app.config.HTTP_STREAM_BUFFER_BYTES = 4
+    streamed(200, ['HTTP/1.1 200 OK\r\n'], [b'a\nb', b'c\nd', b'e'])
+    resolved_args = {'url': 'https://asyncy.com'}
+    stream = await Http.http_fetch_lines(story, line, resolved_args)
+    with pytest.raises(AsyncyError) as e:
+        [text async for text in stream]
+    assert 'More than 4 bytes of https://asyncy.com' in str(e.value)
+
+
+@mark.asyncio
+async def test_service_http_fetch_lines_close(patch, story, line):
+    story.app.config.HTTP_STREAM_BUFFER_BYTES = 1024
+    callbacks = []
+    future = asyncio.get_event_loop().create_future()
+
+    def fetch(url, header_callback, streaming_callback, **kwargs):
+        callbacks.append(streaming_callback)
+        header_callback('HTTP/1.1 200 OK\r\n')
+        streaming_callback(b'a\nb')
+        return future
+
+    patch.object(AsyncHTTPClient, 'fetch', side_effect=fetch)
+    stream = await Http.http_fetch_lines(story, line,
+                                         {'url': 'https://asyncy.com'})
+    assert await stream.__anext__() == 'a'
+    await stream.aclose()
+
+    # The download is aborted.
+    with pytest.raises(AsyncyError):
+        callbacks[0](b'c')
+    await asyncio.sleep(0)
+    assert future.cancelled()
+
+
 def test_service_http_init():
     Http.init()
@@ -14,6 +14,15 @@ def test_dict_set_many_new():
     assert a == {'foo': {'bar': 'string'}}
 
 
+def test_dict_set_many_keys_untouched():
+    a = {}
+    keys = ['foo', 'bar']
+    Dict.set(a, keys, 'string')
+    Dict.set(a, keys, 'string2')
+    assert keys == ['foo', 'bar']
+    assert a == {'foo': {'bar': 'string2'}}
+
+
 def test_dict_set_many_old():
     a = {'foo': {'bar': 'data'}}
     Dict.set(a, ['foo', 'bar'], 'string')
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from asyncy import Metrics
+from asyncy.utils.HttpClients import HttpClient, HttpClients
+
+from pytest import fixture, mark
+
+from tornado.curl_httpclient import CurlAsyncHTTPClient
+from tornado.simple_httpclient import SimpleAsyncHTTPClient
+
+
+@fixture
+def sizes(patch):
+    patch.object(HttpClients, 'sizes', {})
+
+
+def test_http_clients_init(magic, sizes):
+    config = magic(HTTP_POOL_SERVICES='64', HTTP_POOL_SYNAPSE=16,
+                   HTTP_POOL_KUBERNETES=0, HTTP_POOL_HUB=None,
+                   HTTP_POOL_FETCH=32)
+    HttpClients.init(config)
+    assert HttpClients.sizes == {'services': 64, 'synapse': 16, 'fetch': 32}
+
+
+def test_http_clients_get(sizes):
+    HttpClients.sizes['fetch'] = 3
+    client = HttpClients.get('fetch')
+    assert isinstance(client, HttpClient)
+    assert client.pool == 'fetch'
+    assert client.size == 3
+    # curl keeps a handle for each request it can make at a time.
+    assert len(client.client._curls) == 4
+    assert HttpClients.get('fetch') is client
+
+    hub = HttpClients.get('hub')
+    assert hub is not client
+    assert hub.size == HttpClients.default_size
+
+
+@mark.asyncio
+async def test_http_clients_get_keep_alive(patch, sizes):
+    """
+    Pools keep connections alive (with curl), except kubernetes' which
+    needs ssl_options.
+    """
+    patch.object(HttpClients, 'clients', {})
+    for pool in ('services', 'fetch', 'synapse', 'hub'):
+        client = HttpClients.get(pool).client
+        assert isinstance(client, CurlAsyncHTTPClient)
+        client.close()
+
+    kubernetes = HttpClients.get('kubernetes').client
+    assert isinstance(kubernetes, SimpleAsyncHTTPClient)
+    kubernetes.close()
+
+
+@mark.asyncio
+async def test_http_client_fetch(patch, magic):
+    patch.object(Metrics, 'http_pool_wait_seconds')
+    client = HttpClient('services', 1)
+    release = asyncio.get_event_loop().create_future()
+    calls = []
+
+    async def fetch(url, **kwargs):
+        calls.append(url)
+        await release
+        return url
+
+    patch.object(client.client, 'fetch', side_effect=fetch)
+    first = asyncio.ensure_future(client.fetch('a', method='GET'))
+    second = asyncio.ensure_future(client.fetch('b'))
+    await asyncio.sleep(0)
+    assert calls == ['a']
+
+    release.set_result(None)
+    assert await first == 'a'
+    assert await second == 'b'
+    assert calls == ['a', 'b']
+    client.client.fetch.assert_any_call('a', method='GET')
+    Metrics.http_pool_wait_seconds.labels.assert_called_with(pool='services')
+    assert Metrics.http_pool_wait_seconds.labels().observe.call_count == 2
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import asyncio
 from unittest.mock import MagicMock
 
 from asyncy.utils.HttpUtils import HttpUtils
@@ -44,6 +45,40 @@ async def test_fetch_with_retry_fail(patch, logger):
     assert len(fetch.mock_calls) == 10
 
 
+@mark.asyncio
+async def test_fetch_with_retry_deadline(patch, logger, async_mock):
+    client = MagicMock()
+    patch.object(client, 'fetch', new=async_mock())
+    deadline = MagicMock()
+    deadline.request_timeout.return_value = 4.5
+    await HttpUtils.fetch_with_retry(3, logger, 'asyncy.com', client,
+                                     {'request_timeout': 10},
+                                     deadline=deadline)
+    deadline.request_timeout.assert_called_with(10)
+    client.fetch.mock.assert_called_with('asyncy.com', request_timeout=4.5,
+                                         raise_error=False)
+
+
+@mark.asyncio
+async def test_fetch_with_retry_deadline_exceeded(patch, logger):
+    client = MagicMock()
+    deadline = MagicMock()
+    deadline.request_timeout.side_effect = [1.0, 0.0]
+
+    async def fetch(*args, **kwargs):
+        return MagicMock(code=599)
+
+    sleep = asyncio.sleep
+    patch.object(client, 'fetch', side_effect=fetch)
+    patch.object(asyncio, 'sleep', side_effect=lambda _: sleep(0))
+    with pytest.raises(HTTPError) as e:
+        await HttpUtils.fetch_with_retry(3, logger, 'asyncy.com', client, {},
+                                         deadline=deadline)
+
+    assert 'Deadline exceeded' in str(e.value)
+    assert client.fetch.call_count == 1
+
+
 def test_add_params_to_url():
     assert HttpUtils.add_params_to_url('asyncy.com', {}) == 'asyncy.com'
     assert HttpUtils.add_params_to_url('asyncy.com',
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from asyncy.utils.Offload import Offload
+
+from pytest import fixture, mark
+
+
+@fixture
+def offload_story(magic):
+    story = magic()
+    story.app.config.OFFLOAD_EXECUTOR = 'thread'
+    story.app.config.OFFLOAD_WORKERS = 1
+    story.app.config.OFFLOAD_MIN_BYTES = 10
+    story.app.config.OFFLOAD_MIN_ITEMS = 3
+    return story
+
+
+@fixture
+def pools(patch):
+    patch.object(Offload, 'pools', {})
+
+
+@mark.parametrize('kind', ['off', None])
+def test_offload_executor_off(magic, pools, kind):
+    config = magic(OFFLOAD_EXECUTOR=kind)
+    assert Offload.executor(config) is None
+
+
+def test_offload_executor(magic, pools):
+    config = magic(OFFLOAD_EXECUTOR='thread', OFFLOAD_WORKERS='2')
+    executor = Offload.executor(config)
+    assert isinstance(executor, ThreadPoolExecutor)
+    assert executor._max_workers == 2
+    assert Offload.executor(config) is executor
+    executor.shutdown()
+
+
+@mark.parametrize('size,offloaded', [(9, False), (10, True)])
+@mark.asyncio
+async def test_offload_run(patch, magic, pools, offload_story, size,
+                           offloaded):
+    loop = asyncio.get_event_loop()
+    patch.object(loop, 'run_in_executor', wraps=loop.run_in_executor)
+    fn = magic(return_value='result')
+    result = await Offload.run(offload_story, size, 'OFFLOAD_MIN_BYTES',
+                               fn, 'arg')
+    assert result == 'result'
+    fn.assert_called_with('arg')
+    assert loop.run_in_executor.called is offloaded
+
+
+@mark.asyncio
+async def test_offload_run_disabled(patch, magic, pools, offload_story):
+    offload_story.app.config.OFFLOAD_MIN_BYTES = 0
+    patch.object(Offload, 'executor')
+    fn = magic()
+    await Offload.run(offload_story, 100, 'OFFLOAD_MIN_BYTES', fn)
+    await Offload.run(None, 100, 'OFFLOAD_MIN_BYTES', fn)
+    assert fn.call_count == 2
+    Offload.executor.assert_not_called()
+
+
+@mark.parametrize('content,items', [
+    ([1, 2], 2),
+    ({'a': [1, 2, 3], 'b': {'c': 1}, 'd': 'string'}, 7),
+    ('string', 0),
+    (None, 0)
+])
+def test_offload_items(content, items):
+    assert Offload.items(content) == items
+
+
+@mark.asyncio
+async def test_offload_json(pools, offload_story):
+    content = {'items': list(range(5))}
+    dumped = await Offload.json_dumps(offload_story, content)
+    assert dumped == json.dumps(content)
+    assert await Offload.json_loads(offload_story, dumped) == content
+    assert await Offload.ujson_loads(offload_story, dumped) == content
+    assert await Offload.json_loads(offload_story, '[]') == []
+
+
+@mark.asyncio
+async def test_offload_sort(pools, offload_story):
+    items = [3, 1, 2, 5, 4]
+    await Offload.sort(offload_story, items)
+    assert items == [1, 2, 3, 4, 5]
+
+
+@mark.parametrize('kind', ['off', 'thread'])
+@mark.asyncio
+async def test_offload_sort_inline(patch, pools, offload_story, kind):
+    offload_story.app.config.OFFLOAD_EXECUTOR = kind
+    patch.object(Offload, 'run')
+    items = [2, 1]
+    await Offload.sort(offload_story, items)
+    assert items == [1, 2]
+    Offload.run.assert_not_called()
@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
+import pickle
 import re
 
+from asyncy.Context import Context
 from asyncy.utils import Resolver
 
+import pytest
 from pytest import mark
 
 import storyscript
@@ -64,3 +67,98 @@ def test_resolve_all_objects(cases):
     item = tree['tree']['1']['args'][0]
 
     assert Resolver.resolve(item, data) == expected_return
+    assert Resolver.compile(item).resolve(data) == expected_return
+
+
+@mark.parametrize('item,data,expected', [
+    ('foo', {}, 'foo'),
+    (['hello', {'$OBJECT': 'path', 'paths': ['planets', '1']}],
+     {'planets': ['mars', 'earth']}, 'hello earth'),
+    ({'$OBJECT': 'path', 'paths': []}, {'a': 1}, {'a': 1}),
+    ({'$OBJECT': 'path', 'paths': ['a', 'b']}, {'a': 1}, None),
+    ({'$OBJECT': 'path', 'paths': ['a', {'$OBJECT': 'path', 'paths': ['k']}]},
+     {'a': {'k': 'x', 'x': 'y'}}, 'y'),
+    ({'$OBJECT': 'string', 'string': '{} {}',
+      'values': [{'$OBJECT': 'path', 'paths': ['a']}, 'b']},
+     {'a': 'a'}, 'a b'),
+    ({'$OBJECT': 'dict', 'items': [[{'$OBJECT': 'value', 'value': 'k'},
+                                    {'$OBJECT': 'path', 'paths': ['a']}]]},
+     {'a': 1}, {'k': 1}),
+    ({'foo': {'$OBJECT': 'path', 'paths': ['a']}}, {'a': 1}, {'foo': 1})
+])
+def test_resolver_compile(item, data, expected):
+    assert Resolver.compile(item).node is item
+    assert Resolver.compile(item).resolve(data) == expected
+    assert Resolver.resolve(item, data) == expected
+
+
+def test_resolver_compile_malformed():
+    """
+    Malformed objects are resolved when they're evaluated, so that the
+    error is raised when the line is executed (and not at deploy time).
+    """
+    item = {'$OBJECT': 'assertion', 'assertion': 'equals', 'values': [1]}
+    expression = Resolver.compile(item)
+    with pytest.raises(AssertionError):
+        expression.resolve({})
+
+
+def path(*paths):
+    return {'$OBJECT': 'path', 'paths': list(paths)}
+
+
+@mark.parametrize('item,constant,static,value', [
+    ('foo', True, True, 'foo'),
+    ({'$OBJECT': 'value', 'value': 1}, True, True, 1),
+    ({'$OBJECT': 'string', 'string': '{} {}', 'values': ['a', 1]},
+     True, True, 'a 1'),
+    ({'$OBJECT': 'string', 'string': '{}', 'values': [path('a')]},
+     False, False, 'x'),
+    ({'$OBJECT': 'assertion', 'assertion': 'less', 'values': [1, 2]},
+     True, True, True),
+    ({'$OBJECT': 'assertion', 'assertion': 'less', 'values': [1, 'a']},
+     False, True, None),
+    (['a', {'$OBJECT': 'string', 'string': 'b'}], True, True, 'a b'),
+    ({'$OBJECT': 'list', 'items': [1, 2]}, False, True, [1, 2]),
+    ({'$OBJECT': 'dict', 'items': [['a', {'$OBJECT': 'list', 'items': []}]]},
+     False, True, {'a': []}),
+    ({'$OBJECT': 'list', 'items': [path('a')]}, False, False, ['x'])
+])
+def test_resolver_compile_folding(item, constant, static, value):
+    expression = Resolver.compile(item)
+    assert expression.constant is constant
+    assert expression.static is static
+    if constant:
+        assert expression.value == value
+    if value is not None:
+        assert expression.resolve({'a': 'x'}) == value
+
+
+def test_resolver_compile_folding_mutable():
+    """
+    Constant lists and dicts are built again each time they're resolved,
+    since they can be mutated in place.
+    """
+    expression = Resolver.compile({'$OBJECT': 'list', 'items': [1, 2]})
+    first = expression.resolve({})
+    first.append(3)
+    assert expression.resolve({}) == [1, 2]
+
+
+def test_resolver_compile_folding_error():
+    expression = Resolver.compile(
+        {'$OBJECT': 'assertion', 'assertion': 'less', 'values': [1, 'a']})
+    with pytest.raises(TypeError):
+        expression.resolve({})
+
+
+def test_resolver_compile_pickle():
+    slots = {'a': 0}
+    expression = Resolver.compile({'$OBJECT': 'path', 'paths': ['a', 'b']},
+                                  slots)
+    assert expression.slots is slots
+    loaded = pickle.loads(pickle.dumps(expression))
+    assert loaded.node == expression.node
+    assert loaded.slots == slots
+    context = Context({'a': {'b': 'x'}}, slots=slots)
+    assert loaded.resolve(context) == 'x'
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from asyncy.utils.SingleFlight import SingleFlight
+
+import pytest
+from pytest import fixture, mark
+
+
+@fixture(autouse=True)
+def calls(patch):
+    patch.object(SingleFlight, 'calls', {})
+
+
+@mark.asyncio
+async def test_single_flight_run():
+    release = asyncio.get_event_loop().create_future()
+    calls = []
+
+    async def call(value, suffix=''):
+        calls.append(value)
+        await release
+        return value + suffix
+
+    first = asyncio.ensure_future(SingleFlight.run('key', call, 'a', '!'))
+    second = asyncio.ensure_future(SingleFlight.run('key', call, 'b'))
+    other = asyncio.ensure_future(SingleFlight.run('other', call, 'c'))
+    await asyncio.sleep(0.01)
+    assert calls == ['a', 'c']
+
+    release.set_result(None)
+    assert await first == 'a!'
+    assert await second == 'a!'
+    assert await other == 'c'
+    assert SingleFlight.calls == {}
+
+    assert await SingleFlight.run('key', call, 'd') == 'd'
+    assert calls == ['a', 'c', 'd']
+
+
+@mark.asyncio
+async def test_single_flight_run_exc():
+    async def fail():
+        await asyncio.sleep(0)
+        raise ValueError()
+
+    calls = [asyncio.ensure_future(SingleFlight.run('key', fail))
+             for _ in range(2)]
+    for call in calls:
+        with pytest.raises(ValueError):
+            await call
+    assert SingleFlight.calls == {}
+
+
+@mark.asyncio
+async def test_single_flight_run_cancelled():
+    release = asyncio.get_event_loop().create_future()
+
+    async def call():
+        await release
+        return 'done'
+
+    first = asyncio.ensure_future(SingleFlight.run('key', call))
+    second = asyncio.ensure_future(SingleFlight.run('key', call))
+    await asyncio.sleep(0.01)
+    first.cancel()
+    release.set_result(None)
+    assert await second == 'done'